@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Accuracy and speed of lang_detect vs the old list-scan detect_language().
+
+    python bench/bench_lang_detect.py [rounds]
+
+The corpus mixes user messages and answer sentences as they reach the TTS
+voice switch, including Lithuanian typed without diacritics. None of it
+appears in lang_detect's training samples. Timings are the best of several
+passes; lang_detect is timed warm (its word memo filled, as in a running
+app) and cold (the memo emptied before every call).
+"""
+import sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import lang_detect
+from lang_detect import detect, detect_language
+
+CORPUS = [
+    # Lithuanian with diacritics
+    ("lt", "Labas rytas, ką šiandien veiksime?"),
+    ("lt", "Kokie filmai dabar rodomi kine?"),
+    ("lt", "Žinoma, galime pažaisti žodžių žaidimą."),
+    ("lt", "Poryt žada lietų ir stiprų vėją."),
+    ("lt", "Dėkoju, labai gražiai paaiškinai."),
+    ("lt", "Kiek laiko važiuoti traukiniu į Klaipėdą?"),
+    ("lt", "Sugalvok eilėraštį apie rudenį."),
+    ("lt", "Per pertrauką žaidėme kieme su draugais."),
+    ("lt", "Mūsų kaimynų šuo labai didelis."),
+    ("lt", "Šaunuolė, Emilija! Atsakymas teisingas."),
+    # Lithuanian without diacritics
+    ("lt", "Sveika, ka siandien veikei?"),
+    ("lt", "Ar rytoj snigs Kaune?"),
+    ("lt", "Paaiskink, kaip veikia ugnikalnis"),
+    ("lt", "Kuri diena bus sestadienis"),
+    ("lt", "Dekui, dabar viskas aisku"),
+    ("lt", "Noriu isgirsti apie planetas"),
+    ("lt", "Mano sesuo turi zuikiu"),
+    ("lt", "Gal padesi parasyti rasinei?"),
+    ("lt", "Vakare eisime i baseina"),
+    ("lt", "Kodel medziai rudeni numeta lapus?"),
+    ("lt", "Teisingai, labai gerai sekasi."),
+    ("lt", "Sekmadieni svenciame gimtadieni."),
+    ("lt", "Kiek kojų turi voras?"),
+    ("lt", "Siandien per gamta mokemes apie pauksciu."),
+    ("lt", "Pamirsau savo kuprine mokykloje."),
+    # English
+    ("en", "Good morning, what should we do today?"),
+    ("en", "Is it going to snow this weekend?"),
+    ("en", "She goed to the park yesterday."),
+    ("en", "Almost! We say 'she went to the park'."),
+    ("en", "Can you make up a poem about autumn?"),
+    ("en", "Spiders have eight legs."),
+    ("en", "Well done, Emilia!"),
+    ("en", "Volcanoes can be found on every continent."),
+    ("en", "Could you explain fractions again?"),
+    ("en", "Give me a second."),
+    ("en", "Rome is the capital of Italy."),
+    ("en", "Excellent work!"),
+    ("en", "Owls hunt at night and sleep during the day."),
+    ("en", "Remember to pack your swimsuit."),
+    ("en", "Next week will be rainy and cold."),
+    # Russian
+    ("ru", "Доброе утро, что будем делать?"),
+    ("ru", "Сколько ног у паука?"),
+    ("ru", "Минутку, сейчас проверю."),
+    ("ru", "Придумай стих про осень."),
+    ("ru", "Я скачала новую игру на iPad."),
+    ("ru", "Отлично, молодец!"),
+]
+
+def old_detect_language(text):
+    """detect_language() as it was in app_emilia.py"""
+    text_lower = text.lower()
+    words = text_lower.split()
+    ru_chars = ['а', 'б', 'в', 'г', 'д', 'е', 'ё', 'ж', 'з', 'и', 'й', 'к', 'л', 'м',
+                'н', 'о', 'п', 'р', 'с', 'т', 'у', 'ф', 'х', 'ц', 'ч', 'ш', 'щ', 'ъ',
+                'ы', 'ь', 'э', 'ю', 'я']
+    if any(c in text_lower for c in ru_chars):
+        return "ru"
+    lt_chars = ['ą', 'č', 'ę', 'ė', 'į', 'š', 'ų', 'ū', 'ž']
+    if any(c in text_lower for c in lt_chars):
+        return "lt"
+    en_words = ['the', 'is', 'are', 'was', 'were', 'have', 'has', 'had', 'do', 'does',
+                'did', 'will', 'would', 'could', 'should', 'can', 'may', 'might',
+                'hello', 'hi', 'hey', 'how', 'what', 'where', 'when', 'why', 'who',
+                'yes', 'no', 'please', 'thank', 'thanks', 'sorry', 'okay', 'ok',
+                'good', 'great', 'nice', 'well', 'very', 'much', 'more', 'less',
+                'this', 'that', 'these', 'those', 'here', 'there', 'now', 'then',
+                'i', 'you', 'he', 'she', 'it', 'we', 'they', 'my', 'your', 'his', 'her',
+                'and', 'but', 'or', 'if', 'because', 'so', 'just', 'only', 'also',
+                'about', 'with', 'for', 'from', 'into', 'like', 'want', 'need',
+                'know', 'think', 'feel', 'see', 'hear', 'say', 'tell', 'ask',
+                'help', 'let', 'make', 'get', 'go', 'come', 'take', 'give', 'find']
+    lt_words = ['labas', 'kaip', 'aciu', 'prasau', 'gerai', 'taip', 'kas', 'kur',
+                'kodel', 'kada', 'man', 'tau', 'jis', 'ji', 'mes', 'jus', 'as', 'tu',
+                'noriu', 'galiu', 'reikia', 'zinau', 'suprantu', 'klausyk', 'pasakyk',
+                'kokios', 'kokia', 'koks', 'kokie', 'naujienos', 'dabar', 'siandien',
+                'sveiki', 'sveikas', 'sveika', 'laba', 'labai', 'gera', 'geras', 'gali',
+                'nori', 'turi', 'matau', 'zinai', 'sakyk', 'klausiu', 'atsakyk',
+                'emilija', 'tavo', 'mano', 'musu', 'jusu']
+    en_count = sum(1 for w in words if w in en_words)
+    lt_count = sum(1 for w in words if w in lt_words)
+    if en_count > lt_count:
+        return "en"
+    if lt_count > 0:
+        return "lt"
+    return "en"
+
+
+def accuracy(fn):
+    wrong = [(want, text, got) for want, text in CORPUS if (got := fn(text)) != want]
+    return 1 - len(wrong) / len(CORPUS), wrong
+
+
+def per_call_us(fn, rounds, passes=7):
+    """Best of `passes` passes of `rounds` rounds over the corpus"""
+    best = float("inf")
+    for _ in range(passes):
+        t = time.perf_counter()
+        for _ in range(rounds):
+            for _, text in CORPUS:
+                fn(text)
+        best = min(best, time.perf_counter() - t)
+    return best * 1e6 / (rounds * len(CORPUS))
+
+
+def cold_detect_language(text):
+    lang_detect._SCORES.clear()
+    return detect_language(text)
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    for name, fn in [("old list scan", old_detect_language), ("lang_detect", detect_language),
+                     ("  cold memo", cold_detect_language)]:
+        acc, wrong = accuracy(fn)
+        print(f"{name:14s} accuracy {acc:6.1%}  {per_call_us(fn, rounds):7.1f} us/call")
+        for want, text, got in wrong:
+            print(f"    {want} -> {got}: {text}")
+    low = [(text, c) for _, text in CORPUS for lang, c in [detect(text)] if c < 0.8]
+    print(f"low confidence (<0.8): {len(low)}")
+    for text, c in low:
+        print(f"    {c:.3f} {text}")
+
+
+if __name__ == "__main__":
+    main()
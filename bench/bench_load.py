@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Load test for the voice apps against local fake upstreams: no network
+access, no API spend.
+
+    python bench/bench_load.py app_emilia --users 20 --turns 5 [--asgi] [--frames] [--chunks] [--search]
+    python bench/bench_load.py web_voice_chat --users 10 --turns 3 [--asgi] [--binary] [--mic-rate 48000]
+    python bench/bench_load.py web_voice_chat --asgi --ramp 100,200,400,800 --slo-ms 1000
+    python bench/bench_load.py app_personal --users 32 --profiles 8 --workers 4
+    python bench/bench_load.py app_emilia --users 8 --abort-after 1500 --answer-repeat 4
+
+Starts fake_upstreams.py in this process, runs the app as a subprocess in a
+scratch directory pointed at it (XAI_API_URL, PPLX_API_URL, GROK_WS_URL;
+TTS through bench/inject/sitecustomize.py), then drives /chat-stream (or /ws) with N concurrent users,
+each doing --turns turns back to back. Reports throughput, p50/p95/p99
+time to first text, time to first audio and turn time (for /ws also call
+setup: connect to the session_id reply), and the app's
+memory (RSS, from /proc) and threads, sampled while the users are active;
+"per user" is the growth over the idle app divided by the users.
+
+--ramp runs the users counts given one after another against the same app
+process and stops at the first step with errors or a p95 first audio over
+--slo-ms: the last step that passed is the most concurrent users (for /ws,
+calls) the app handled.
+
+With --abort-after the client hangs up that many ms into each turn, like a
+barge-in; the report then shows how much the fakes kept sending (LLM tokens,
+TTS audio) per turn after that.
+
+Needs aiohttp (bench/requirements.txt). Upstream timings take the same
+options as fake_upstreams.py. For /ws,
+"first text" is the answer transcript, which web_voice_chat sends when
+the answer is done; the clock starts when the last input audio is sent.
+"""
+import argparse, asyncio, base64, json, os, socket, struct, subprocess, sys, tempfile, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+INJECT = Path(__file__).resolve().parent / "inject"
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import aiohttp
+import fake_upstreams
+from chat_stream import FRAMES_MIMETYPE, FRAME_TEXT, FRAME_AUDIO, FRAME_DONE, FRAME_CHUNK
+
+APPS = {
+    "grok_stream": "/chat-stream",
+    "app_emilia": "/chat-stream",
+    "app_personal": "/{profile}/chat-stream",
+    "web_voice_chat": "/ws",
+}
+PROFILE = {"name": "Bench", "display_name": "Bench", "voice_lt": "lt-LT-LeonasNeural",
+           "voice_en": "en-US-JennyNeural", "system_prompt": "You are a helpful assistant."}
+MESSAGES = ["Papasakok apie dinozaurus {u} {t}", "Kaip tau sekasi? {u} {t}"]
+SEARCH_MESSAGES = ["Koks šiandien oras Vilniuje? {u} {t}", "Kokios naujienos? {u} {t}"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid):
+    """(current, peak) resident memory in MB of a process and its children
+    (pre-fork workers), from /proc"""
+    rss = hwm = 0
+    for p in [pid] + children(pid):
+        try:
+            status = Path(f"/proc/{p}/status").read_text()
+        except OSError:
+            continue
+        kb = {ln.split(":")[0]: int(ln.split()[1]) for ln in status.splitlines()
+              if ln.startswith(("VmRSS", "VmHWM"))}
+        rss += kb.get("VmRSS", 0)
+        hwm += kb.get("VmHWM", 0)
+    return (round(rss / 1024, 1), round(hwm / 1024, 1)) if rss else (None, None)
+
+
+def threads(pid):
+    """OS threads of a process and its children"""
+    n = 0
+    for p in [pid] + children(pid):
+        try:
+            n += int(next(ln.split()[1] for ln in Path(f"/proc/{p}/status").read_text().splitlines()
+                          if ln.startswith("Threads:")))
+        except (OSError, StopIteration):
+            pass
+    return n
+
+
+def cpu_s(pid):
+    """CPU seconds (user + system) used so far by a process and its children"""
+    ticks = 0
+    for p in [pid] + children(pid):
+        try:
+            fields = Path(f"/proc/{p}/stat").read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        ticks += int(fields[11]) + int(fields[12])
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+
+def children(pid):
+    try:
+        return [int(c) for t in Path(f"/proc/{pid}/task").iterdir()
+                for c in (t / "children").read_text().split()]
+    except OSError:
+        return []
+
+
+def start_app(name, opts, upstream, workdir):
+    port = free_port()
+    env = dict(os.environ, **fake_upstreams.app_env(upstream), PORT=str(port),
+               TTS_CACHE_DIR="", PYTHONUNBUFFERED="1")
+    # sitecustomize in every process the app starts (uvicorn workers are spawned, not forked)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(INJECT), str(ROOT),
+                                                      os.environ.get("PYTHONPATH")]))
+    if not opts.tts_cache:
+        env["TTS_CACHE_MB"] = "0"
+    if opts.asgi:
+        env["SERVE_MODE"] = "asgi"
+    if opts.workers > 1:
+        env["WORKERS"] = str(opts.workers)
+    if name == "app_personal":
+        profiles = {f"bench{i}": dict(PROFILE, name=f"Bench {i}") for i in range(opts.profiles)}
+        (workdir / "profiles.json").write_text(json.dumps(profiles), encoding="utf-8")
+    log = open(workdir / "app.log", "w")
+    proc = subprocess.Popen([sys.executable, str(ROOT / f"{name}.py")], cwd=workdir, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+    return proc, f"http://127.0.0.1:{port}"
+
+
+async def wait_ready(proc, base, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as s:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                return False
+            try:
+                async with s.get(base + "/") as r:
+                    return r.status < 500
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.2)
+    return False
+
+
+async def http_turn(session, url, msg, opts):
+    """One /chat-stream request -> (first text, first audio, turn) in ms"""
+    t0 = time.perf_counter()
+    first_text = first_audio = None
+    headers = {"Accept": FRAMES_MIMETYPE} if opts.frames else {}
+    body = {"message": msg, "audio_chunks": opts.chunks}
+    async def read_event(r):
+        if opts.frames:
+            kind, n = struct.unpack(">BI", await r.content.readexactly(5))
+            await r.content.readexactly(n)
+            return {FRAME_TEXT: "text", FRAME_AUDIO: "audio", FRAME_CHUNK: "audio",
+                    FRAME_DONE: "done"}.get(kind)
+        line = await r.content.readline()
+        if not line:
+            raise ConnectionError("stream ended without [DONE]")
+        if not line.startswith(b"data: "):
+            return None
+        data = line[6:].strip()
+        kind = "done" if data == b"[DONE]" else json.loads(data).get("type")
+        return "audio" if kind == "audio_chunk" else kind
+
+    async with session.post(url, json=body, headers=headers) as r:
+        r.raise_for_status()
+        while True:
+            if opts.abort_after:
+                try:
+                    left = opts.abort_after / 1000 - (time.perf_counter() - t0)
+                    kind = await asyncio.wait_for(read_event(r), max(left, 0))
+                except asyncio.TimeoutError:
+                    r.close()   # hang up mid-answer
+                    return first_text, first_audio, (time.perf_counter() - t0) * 1000
+            else:
+                kind = await read_event(r)
+            now = (time.perf_counter() - t0) * 1000
+            if kind == "text" and first_text is None:
+                first_text = now
+            elif kind == "audio" and first_audio is None:
+                first_audio = now
+            elif kind == "done":
+                return first_text, first_audio, now
+
+
+async def http_user(session, base, u, opts, results):
+    url = base + APPS[opts.app].format(profile=f"bench{u % opts.profiles}" if isinstance(u, int) else "bench0")
+    msgs = SEARCH_MESSAGES if opts.search else MESSAGES
+    for t in range(opts.turns):
+        try:
+            results.append(await http_turn(session, url, msgs[t % len(msgs)].format(u=u, t=t), opts))
+        except Exception as e:
+            results.append(e)
+
+
+def ws_audio_frame(opts):
+    """100 ms microphone frame at --mic-rate as the browser sends it: binary
+    PCM, or JSON + base64 (older pages)"""
+    pcm = bytes(len(fake_upstreams.PCM_CHUNK) * opts.mic_rate // 24000)
+    if opts.binary:
+        return pcm
+    return json.dumps({"type": "audio", "audio": base64.b64encode(pcm).decode()})
+
+
+async def ws_user(session, base, u, opts, results):
+    frame = ws_audio_frame(opts)
+    pieces = -(-opts.rt_turn_bytes // len(fake_upstreams.PCM_CHUNK))
+    try:
+        t0 = time.perf_counter()
+        url = base.replace("http", "ws", 1) + APPS[opts.app] + f"?rate={opts.mic_rate}"
+        async with session.ws_connect(url) as ws:
+            hello = await ws.receive_json()
+            if hello.get("type") != "session_id":
+                raise ConnectionError(hello.get("message", hello))
+            setup = (time.perf_counter() - t0) * 1000
+            send = ws.send_bytes if opts.binary else ws.send_str
+            for t in range(opts.turns):
+                for _ in range(pieces):
+                    await send(frame)
+                t0 = time.perf_counter()
+                first_text = first_audio = None
+                while True:
+                    ev = await ws.receive_json()
+                    now = (time.perf_counter() - t0) * 1000
+                    if ev["type"] == "audio" and first_audio is None:
+                        first_audio = now
+                    elif ev["type"] == "grok_transcript" and first_text is None:
+                        first_text = now
+                    elif ev["type"] == "done":
+                        results.append((first_text, first_audio, now, setup if t == 0 else None))
+                        break
+                    elif ev["type"] == "error":
+                        raise ConnectionError(ev.get("message"))
+    except Exception as e:
+        results.append(e)
+
+
+def pct(values, q):
+    values = sorted(v for v in values if v is not None)
+    return values[min(int(q * len(values)), len(values) - 1)] if values else None
+
+
+async def upstream_sent(session, upstream):
+    async with session.get(upstream + "/stats") as r:
+        return await r.json()
+
+
+async def run(opts, base, proc, upstream):
+    user = ws_user if opts.app == "web_voice_chat" else http_user
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=60)
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        warm = []
+        for _ in range(opts.warmup):
+            await user(session, base, "warmup", argparse.Namespace(**dict(vars(opts), turns=1)), warm)
+        rss_start = rss_mb(proc.pid)[0]
+        sent_start = await upstream_sent(session, upstream)
+        results = []
+        active = {"rss": 0, "threads": 0}
+
+        async def sample():
+            while True:
+                active["rss"] = max(active["rss"], rss_mb(proc.pid)[0] or 0)
+                active["threads"] = max(active["threads"], threads(proc.pid))
+                await asyncio.sleep(0.1)
+
+        sampler = asyncio.ensure_future(sample())
+        cpu_start = cpu_s(proc.pid)
+        t = time.perf_counter()
+        await asyncio.gather(*(user(session, base, u, opts, results) for u in range(opts.users)))
+        wall = time.perf_counter() - t
+        cpu = cpu_s(proc.pid) - cpu_start
+        sampler.cancel()
+        # Let cancelled (or not cancelled) upstream work play out before counting it
+        await asyncio.sleep(opts.settle)
+        sent_end = await upstream_sent(session, upstream)
+    rss_end, rss_peak = rss_mb(proc.pid)
+    ok = [r for r in results if not isinstance(r, Exception)]
+    errors = [r for r in results if isinstance(r, Exception)]
+    report = {"app": opts.app, "mode": "asgi" if opts.asgi else "flask",
+              "format": "ws" if opts.app == "web_voice_chat" else "frames" if opts.frames else "sse",
+              "users": opts.users, "workers": opts.workers,
+              "turns": len(ok), "errors": len(errors), "wall_s": round(wall, 2),
+              "turns_per_s": round(len(ok) / wall, 2) if wall else 0.0,
+              "rss_mb": {"after_warmup": rss_start, "active": active["rss"], "end": rss_end,
+                         "peak": rss_peak},
+              "per_user_kb": round((active["rss"] - rss_start) * 1024 / opts.users, 1) if rss_start else None,
+              "threads_active": active["threads"],
+              "app_cpu_pct": round(100 * cpu / wall) if wall else None,
+              "app_cpu_ms_per_turn": round(cpu * 1000 / len(ok), 1) if ok else None}
+    if opts.app == "web_voice_chat":
+        pieces = -(-opts.rt_turn_bytes // len(fake_upstreams.PCM_CHUNK))
+        report["format"] = "ws binary" if opts.binary else "ws"
+        report["audio_up_kb_per_turn"] = round(pieces * len(ws_audio_frame(opts)) / 1024, 1)
+    for i, name in enumerate(("first_text_ms", "first_audio_ms", "turn_ms", "setup_ms")):
+        report[name] = {f"p{int(q * 100)}": round(v, 1) if (v := pct([r[i] for r in ok if len(r) > i], q)) is not None else None
+                        for q in (0.5, 0.95, 0.99)}
+    report["upstream_per_turn"] = {k: round((sent_end[k] - sent_start[k]) / max(len(ok), 1), 1)
+                                   for k in sent_end}
+    report["aborted_at_ms"] = opts.abort_after or None
+    report["error_samples"] = sorted({repr(e)[:200] for e in errors})[:5]
+    return report
+
+
+def print_report(r):
+    workers = f", {r['workers']} workers" if r["workers"] > 1 else ""
+    print(f"{r['app']} ({r['mode']}, {r['format']}{workers}) {r['users']} users: {r['turns']} turns, "
+          f"{r['errors']} errors, {r['wall_s']} s, {r['turns_per_s']} turns/s")
+    print(f"{'':14s}{'p50':>9s}{'p95':>9s}{'p99':>9s}  (ms)")
+    for name, label in (("first_text_ms", "first text"), ("first_audio_ms", "first audio"),
+                        ("turn_ms", "turn"), ("setup_ms", "call setup")):
+        if not r["format"].startswith("ws") and name == "setup_ms":
+            continue
+        print(f"{label:14s}" + "".join(f"{v:9.1f}" if v is not None else f"{'-':>9s}"
+                                       for v in r[name].values()))
+    u = r["upstream_per_turn"]
+    aborted = f" (client hung up at {r['aborted_at_ms']} ms)" if r["aborted_at_ms"] else ""
+    if not r["format"].startswith("ws"):
+        print(f"upstream per turn{aborted}: {u['llm_tokens']} LLM tokens, "
+              f"{u['tts_requests']} TTS requests, {u['tts_bytes'] / 1024:.1f} KB TTS audio")
+    m = r["rss_mb"]
+    print(f"memory: {m['after_warmup']} MB after warmup, {m['active']} MB active "
+          f"({r['per_user_kb']} KB per user), {m['end']} MB at end, peak {m['peak']} MB; "
+          f"{r['threads_active']} threads active, app CPU {r['app_cpu_pct']}% "
+          f"({r['app_cpu_ms_per_turn']} ms per turn)")
+    if "audio_up_kb_per_turn" in r:
+        print(f"browser -> app audio per turn: {r['audio_up_kb_per_turn']} KB")
+    for e in r["error_samples"]:
+        print(f"    {e}")
+
+
+def ramp(opts, base, proc, upstream):
+    """Run each --ramp step until one fails -> {"steps", "max_users"}"""
+    steps, max_users = [], 0
+    for users in (int(u) for u in opts.ramp.split(",")):
+        r = asyncio.run(run(argparse.Namespace(**dict(vars(opts), users=users,
+                                                      warmup=opts.warmup if not steps else 0)),
+                            base, proc, upstream))
+        p95 = r["first_audio_ms"]["p95"]
+        ok = not r["errors"] and p95 is not None and p95 <= opts.slo_ms
+        steps.append(dict(r, within_slo=ok))
+        if not opts.json:
+            print(f"{users:6d} users: {r['errors']:4d} errors, first audio p95 "
+                  f"{p95 if p95 is not None else '-':>8} ms, {r['rss_mb']['active']:7.1f} MB active "
+                  f"({r['per_user_kb']} KB per user), {r['threads_active']:5d} threads, "
+                  f"app CPU {r['app_cpu_pct']:3d}%"
+                  f"{'' if ok else '  <- over the limit'}", flush=True)
+        if not ok:
+            break
+        max_users = users
+    if not opts.json:
+        print(f"max concurrent users within {opts.slo_ms:.0f} ms p95 first audio, no errors: "
+              f"{max_users or 'none'} (of {opts.ramp})")
+    return {"steps": steps, "max_users": max_users}
+
+
+def main():
+    p = argparse.ArgumentParser(description="Load test the voice apps against fake upstreams")
+    p.add_argument("app", choices=sorted(APPS))
+    p.add_argument("--users", type=int, default=10)
+    p.add_argument("--turns", type=int, default=3)
+    p.add_argument("--warmup", type=int, default=1, help="turns before measuring")
+    p.add_argument("--asgi", action="store_true", help="run the app with SERVE_MODE=asgi")
+    p.add_argument("--workers", type=int, default=1, help="WORKERS (app_personal: pre-fork processes)")
+    p.add_argument("--profiles", type=int, default=1, help="app_personal profiles the users are spread over")
+    p.add_argument("--frames", action="store_true", help="binary frames instead of SSE")
+    p.add_argument("--chunks", action="store_true", help='"audio_chunks": true')
+    p.add_argument("--binary", action="store_true", help="/ws: microphone audio as binary PCM frames")
+    p.add_argument("--mic-rate", type=int, default=24000, help="/ws: microphone sample rate")
+    p.add_argument("--search", action="store_true", help="messages that trigger a search")
+    p.add_argument("--tts-cache", action="store_true", help="keep the app's TTS cache on")
+    p.add_argument("--abort-after", type=float, default=0, help="hang up this many ms into each turn")
+    p.add_argument("--settle", type=float, default=3, help="seconds to wait before counting upstream work")
+    p.add_argument("--ramp", help="comma-separated --users steps, e.g. 100,200,400")
+    p.add_argument("--slo-ms", type=float, default=1000, help="--ramp: p95 first audio limit")
+    p.add_argument("--json", action="store_true", help="print the report as JSON")
+    fake_upstreams.add_args(p)
+    opts = p.parse_args()
+
+    upstream = fake_upstreams.start(opts)
+    with tempfile.TemporaryDirectory(prefix="bench-") as d:
+        workdir = Path(d)
+        proc, base = start_app(opts.app, opts, upstream, workdir)
+        try:
+            if not asyncio.run(wait_ready(proc, base)):
+                print((workdir / "app.log").read_text()[-3000:])
+                sys.exit(f"{opts.app} did not start")
+            if opts.ramp:
+                report = ramp(opts, base, proc, upstream)
+            else:
+                report = asyncio.run(run(opts, base, proc, upstream))
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    if opts.json:
+        print(json.dumps(report, indent=2))
+    elif not opts.ramp:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
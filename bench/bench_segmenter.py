@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Sentence chunking for TTS: the old regex-on-buffer split vs segmenter.
+
+    python bench/bench_segmenter.py [rounds]
+
+Answers are fed in small LLM-sized tokens. Reports the cost per token, the
+number of chunks and how many characters had to stream in before the first
+chunk went to TTS (a proxy for time to first audio).
+"""
+import re, sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from segmenter import Segmenter
+
+ANSWERS = [
+    "Labas, Emilija! Šiandien Vilniuje bus 3.5 laipsnio šilumos, t.y. gana vėsu. "
+    "Pvz. rytoj bus šilčiau, apie 8 laipsnius. Ar nori sužinoti daugiau?",
+    "Great question! Dinosaurs lived millions of years ago, and the biggest ones "
+    "were as long as three buses. Dr. Smith says the T. rex could run about 25 km/h. "
+    "Do you want to hear about the smallest dinosaur too?",
+    "Kaina yra 3,5 euro, o ne 4, kaip sakei. Bitcoin šiuo metu kainuoja apie "
+    "60 000 dolerių, bet kursas keičiasi kas minutę...",
+    "Сейчас в Вильнюсе около 5 градусов, т.е. довольно прохладно. Завтра будет теплее.",
+    "Okay so here is a long answer without much punctuation that just keeps going "
+    "and going because the model decided to ramble about the weather and the news "
+    "and everything else it could think of while you were waiting for it to stop "
+    "talking and finally get to the point which it does eventually right here.",
+]
+
+
+def tokens(text, size=4):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def old_chunks(toks, split=re.compile(r"[.!?]\s*$"), min_len=15):
+    """chat_stream's boundary check before segmenter: regex over the whole buffer per token"""
+    out, buf, seen, first = [], "", 0, None
+    for tok in toks:
+        buf += tok
+        seen += len(tok)
+        if len(buf) > min_len and split.search(buf):
+            out.append(buf.strip())
+            first = first or seen
+            buf = ""
+    if buf.strip():
+        out.append(buf.strip())
+    return out, first or seen
+
+
+def new_chunks(toks):
+    seg, out, seen, first = Segmenter(), [], 0, None
+    for tok in toks:
+        seen += len(tok)
+        got = seg.feed(tok)
+        if got and first is None:
+            first = seen
+        out += got
+    out += seg.flush()
+    return out, first or seen
+
+
+def per_token_us(fn, streams, rounds):
+    n = sum(len(t) for t in streams) * rounds
+    t = time.perf_counter()
+    for _ in range(rounds):
+        for toks in streams:
+            fn(toks)
+    return (time.perf_counter() - t) * 1e6 / n
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    streams = [tokens(a) for a in ANSWERS]
+    for name, fn in [("old regex split", old_chunks), ("segmenter", new_chunks)]:
+        results = [fn(t) for t in streams]
+        chunks = sum(len(c) for c, _ in results) / len(results)
+        first = sum(f for _, f in results) / len(results)
+        print(f"{name:16s} {per_token_us(fn, streams, rounds):5.2f} us/token  "
+              f"{chunks:4.1f} chunks/answer  first chunk after {first:5.1f} chars")
+    print("\nsegmenter chunks:")
+    for toks in streams:
+        for c in new_chunks(toks)[0]:
+            print(f"    {c}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Per-fragment cost of asyncio.run() + fresh edge-tts connection vs the
+persistent TTSWorker loop.
+
+    python bench/bench_tts_loop.py [rounds] [voice]
+
+Needs network access to edge-tts.
+"""
+import sys, asyncio, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import edge_tts
+from tts_worker import TTSWorker
+
+FRAGMENTS = [
+    "Labas, Emilija!",
+    "Zinoma, Emilija!",
+    "Sveiki, kaip sekasi?",
+    "Today is a sunny day in Vilnius.",
+    "Сегодня хорошая погода.",
+]
+
+
+def measure_loop_cost(rounds=20):
+    """Average ms to create + run + close a fresh loop (what asyncio.run pays)"""
+    async def _noop():
+        pass
+    t = time.perf_counter()
+    for _ in range(rounds):
+        asyncio.run(_noop())
+    return (time.perf_counter() - t) * 1000 / rounds
+
+
+def old_gen_tts(text, voice):
+    async def _g():
+        c = edge_tts.Communicate(text, voice)
+        d = b""
+        async for ch in c.stream():
+            if ch["type"] == "audio":
+                d += ch["data"]
+        return d
+    return asyncio.run(_g())
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    voice = sys.argv[2] if len(sys.argv) > 2 else "lt-LT-LeonasNeural"
+    texts = FRAGMENTS * rounds
+
+    print(f"asyncio.run loop create+close: {measure_loop_cost(200):.3f} ms")
+
+    t = time.perf_counter()
+    for s in texts:
+        old_gen_tts(s, voice)
+    old = (time.perf_counter() - t) * 1000 / len(texts)
+    print(f"asyncio.run per fragment:      {old:.1f} ms avg ({len(texts)} fragments)")
+
+    w = TTSWorker()
+    t = time.perf_counter()
+    for s in texts:
+        w.synthesize(s, voice)
+    new = (time.perf_counter() - t) * 1000 / len(texts)
+    st = w.stats()
+    print(f"worker per fragment:           {new:.1f} ms avg")
+    print(f"  handshake (to first audio):  {st['avg_handshake_ms']} ms")
+    print(f"  synthesis (first..last):     {st['avg_synth_ms']} ms")
+
+    t = time.perf_counter()
+    for f in [w.submit(s, voice) for s in texts]:
+        f.result()
+    print(f"worker, all fragments queued:  {(time.perf_counter() - t) * 1000 / len(texts):.1f} ms avg")
+
+
+if __name__ == "__main__":
+    main()
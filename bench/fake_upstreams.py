@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for xAI, Perplexity and edge-tts, so the apps can be
+benchmarked without network access or API spend.
+
+    python bench/fake_upstreams.py [--port 9100] [--first-token-ms 300] ...
+
+    POST /v1/chat/completions  xAI chat: SSE deltas at --token-rate after --first-token-ms
+    POST /chat/completions     Perplexity: one JSON answer after --search-ms
+    POST /tts                  TTS: MP3 frames sized by text length, first after --tts-ms
+    GET  /v1/realtime          xAI realtime websocket: accepts after --rt-connect-ms, answers
+                               each --rt-turn-bytes of input audio
+    GET  /stats                what was actually sent: LLM tokens, TTS bytes (stops when the app hangs up)
+
+Point the apps at it with XAI_API_URL, PPLX_API_URL and GROK_WS_URL;
+bench_load.py does that for you, and swaps the apps' edge-tts for /tts
+(bench/inject/sitecustomize.py, driven by BENCH_TTS_URL).
+"""
+import argparse, asyncio, base64, json, re, threading
+from aiohttp import web
+
+ANSWER = ("Labas! Šiandien Vilniuje bus apie 12 laipsnių šilumos, vakare gali palyti. "
+          "Rytoj orai bus panašūs, tik vėjas sustiprės iki 8 m/s. "
+          "Jei eisi į lauką, pasiimk skėtį ir šiltesnę striukę. "
+          "Ar nori, kad papasakočiau, kokie orai bus savaitgalį?")
+SEARCH_ANSWER = "Vilnius: 12°C, cloudy, light rain in the evening. Tomorrow 11°C, wind 8 m/s."
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, mono: 417-byte frames of silence
+MP3_FRAME = bytes([0xFF, 0xFB, 0x90, 0xC0]) + bytes(413)
+PCM_CHUNK = bytes(4800)   # 100 ms of 24 kHz 16-bit mono
+
+
+def add_args(p):
+    p.add_argument("--first-token-ms", type=float, default=300, help="LLM delay before the first token")
+    p.add_argument("--token-rate", type=float, default=40, help="LLM tokens per second")
+    p.add_argument("--answer-repeat", type=int, default=1, help="answer length, in copies of the canned answer")
+    p.add_argument("--search-ms", type=float, default=800, help="Perplexity answer delay")
+    p.add_argument("--tts-ms", type=float, default=150, help="TTS delay before the first audio")
+    p.add_argument("--tts-bytes-per-char", type=int, default=430, help="MP3 size per text char (edge-tts: ~430)")
+    p.add_argument("--tts-chunk-ms", type=float, default=20, help="gap between TTS chunks (8 frames each)")
+    p.add_argument("--rt-turn-bytes", type=int, default=48000, help="realtime input audio per turn (48000 = 1 s)")
+    p.add_argument("--rt-connect-ms", type=float, default=200,
+                   help="realtime websocket handshake time (TCP + TLS + upgrade)")
+    return p
+
+
+def tokens(opts):
+    return re.findall(r"\S+\s*", " ".join([ANSWER] * opts.answer_repeat))
+
+
+def make_app(opts):
+    sent = {"llm_streams": 0, "llm_tokens": 0, "tts_requests": 0, "tts_bytes": 0}
+
+    async def chat(request):
+        body = await request.json()
+        await asyncio.sleep(opts.first_token_ms / 1000)
+        if not body.get("stream"):
+            return web.json_response({"choices": [{"message": {"role": "assistant",
+                                                               "content": "".join(tokens(opts))}}]})
+        r = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        sent["llm_streams"] += 1
+        try:
+            await r.prepare(request)
+            for i, tok in enumerate(tokens(opts)):
+                if i:
+                    await asyncio.sleep(1 / opts.token_rate)
+                await r.write(f"data: {json.dumps({'choices': [{'delta': {'content': tok}}]})}\n\n".encode())
+                sent["llm_tokens"] += 1
+            await r.write(b"data: [DONE]\n\n")
+            await r.write_eof()
+        except ConnectionResetError:
+            pass  # the app cancelled the turn
+        return r
+
+    async def search(request):
+        await request.json()
+        await asyncio.sleep(opts.search_ms / 1000)
+        return web.json_response({"choices": [{"message": {"role": "assistant",
+                                                           "content": SEARCH_ANSWER}}]})
+
+    async def tts(request):
+        body = await request.json()
+        frames = max(1, len(body.get("text", "")) * opts.tts_bytes_per_char // len(MP3_FRAME))
+        await asyncio.sleep(opts.tts_ms / 1000)
+        r = web.StreamResponse(headers={"Content-Type": "audio/mpeg"})
+        sent["tts_requests"] += 1
+        try:
+            await r.prepare(request)
+            for i in range(0, frames, 8):
+                if i:
+                    await asyncio.sleep(opts.tts_chunk_ms / 1000)
+                data = MP3_FRAME * min(8, frames - i)
+                await r.write(data)
+                sent["tts_bytes"] += len(data)
+            await r.write_eof()
+        except ConnectionResetError:
+            pass
+        return r
+
+    async def respond(ws):
+        """One realtime turn, as the xAI realtime API sends it"""
+        for ev in ({"type": "input_audio_buffer.speech_started"},
+                   {"type": "input_audio_buffer.speech_stopped"},
+                   {"type": "conversation.item.input_audio_transcription.completed",
+                    "transcript": "Koks šiandien oras?"},
+                   {"type": "response.created"}):
+            await ws.send_json(ev)
+        await asyncio.sleep(opts.first_token_ms / 1000)
+        audio = base64.b64encode(PCM_CHUNK).decode()
+        for i, tok in enumerate(tokens(opts)):
+            if i:
+                await asyncio.sleep(1 / opts.token_rate)
+            await ws.send_json({"type": "response.output_audio_transcript.delta", "delta": tok})
+            await ws.send_json({"type": "response.output_audio.delta", "delta": audio})
+        await ws.send_json({"type": "response.done"})
+
+    async def realtime(request):
+        ws = web.WebSocketResponse()
+        await asyncio.sleep(opts.rt_connect_ms / 1000)
+        await ws.prepare(request)
+        heard, tasks = 0, set()
+        async for msg in ws:
+            ev = json.loads(msg.data)
+            if ev.get("type") == "session.update":
+                await ws.send_json({"type": "session.updated", "session": ev.get("session", {})})
+            elif ev.get("type") == "input_audio_buffer.append":
+                heard += len(ev.get("audio", "")) * 3 // 4
+                if heard >= opts.rt_turn_bytes:
+                    heard = 0
+                    task = asyncio.ensure_future(respond(ws))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+        for task in tasks:
+            task.cancel()
+        return ws
+
+    async def stats(request):
+        return web.json_response(sent)
+
+    app = web.Application()
+    app.router.add_get("/stats", stats)
+    app.router.add_post("/v1/chat/completions", chat)
+    app.router.add_post("/chat/completions", search)
+    app.router.add_post("/tts", tts)
+    app.router.add_get("/v1/realtime", realtime)
+    return app
+
+
+def start(opts, port=0):
+    """Serve in a background thread -> base URL (http://127.0.0.1:<port>)"""
+    ready = threading.Event()
+    box = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(make_app(opts), access_log=None)
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", port)
+        loop.run_until_complete(site.start())
+        box["port"] = runner.addresses[0][1]
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name="fake-upstreams", daemon=True).start()
+    ready.wait()
+    return f"http://127.0.0.1:{box['port']}"
+
+
+def app_env(base):
+    """Environment that points an app at the fakes"""
+    return {"XAI_API_URL": f"{base}/v1/chat/completions",
+            "PPLX_API_URL": f"{base}/chat/completions",
+            "BENCH_TTS_URL": f"{base}/tts",
+            "GROK_WS_URL": base.replace("http", "ws", 1) + "/v1/realtime",
+            "XAI_API_KEY": "bench", "PPLX_API_KEY": "bench"}
+
+
+def main():
+    p = add_args(argparse.ArgumentParser(description=__doc__.strip().splitlines()[0]))
+    p.add_argument("--port", type=int, default=9100)
+    opts = p.parse_args()
+    web.run_app(make_app(opts), host="127.0.0.1", port=opts.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
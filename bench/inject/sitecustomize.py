@@ -0,0 +1,33 @@
+"""
+Imported at startup by every Python process bench_load.py runs an app in
+(it puts this directory on PYTHONPATH). With BENCH_TTS_URL set, TTSWorker
+streams audio from that endpoint, the fake TTS in fake_upstreams.py,
+instead of edge-tts:
+
+    POST {"text", "voice", "rate", "pitch", "volume"} -> streamed MP3
+"""
+import os
+
+BENCH_TTS_URL = os.getenv("BENCH_TTS_URL", "")
+
+
+def _install():
+    import aiohttp
+    import tts_worker
+
+    async def fake_stream(self, text, voice, rate, pitch, volume):
+        """Audio chunks for one text, from the fake TTS"""
+        # Created on the worker's loop, on first use
+        if getattr(self, "_bench_http", None) is None:
+            self._bench_http = aiohttp.ClientSession()
+        body = {"text": text, "voice": voice, "rate": rate, "pitch": pitch, "volume": volume}
+        async with self._bench_http.post(BENCH_TTS_URL, json=body) as r:
+            r.raise_for_status()
+            async for data in r.content.iter_any():
+                yield data
+
+    tts_worker.TTSWorker._stream = fake_stream
+
+
+if BENCH_TTS_URL:
+    _install()
@@ -0,0 +1,519 @@
+"""
+Shared /chat-stream loop for the voice apps.
+Text deltas go out as they arrive, finished sentences go to the TTS
+pipeline, audio events come back in sentence order. stream_turn() is the
+Flask (thread) version, astream_turn() the ASGI (asyncio) one; both speak
+the same SSE contract:
+    data: {"type": "text", "content": ...}
+    data: {"type": "audio", "audio": <base64 mp3>}
+    data: [DONE]
+
+Clients that send "Accept: application/x-chat-frames" get the same events
+as length-prefixed binary frames instead (no base64, no JSON):
+    <1 byte type> <4 byte big-endian length> <payload>
+    type 1 = text delta (UTF-8), 2 = audio (MP3 bytes), 3 = done (empty)
+
+Requests with "audio_chunks": true get each sentence's MP3 piece by piece
+while edge-tts is still synthesizing it, in sentence order:
+    data: {"type": "audio_chunk", "seq": n, "audio": <base64 mp3 piece>}
+    data: {"type": "audio_end", "seq": n}
+    frames: 4 = <4 byte seq> + MP3 piece, 5 = <4 byte seq> (sentence done)
+
+Sentences are cut by segmenter.Segmenter: a short first chunk to get audio
+going early, then sentence-sized ones. turn_stats keeps time to first audio
+and chunk counts per turn; turn.trace (turn_trace.Trace) gets the timing
+of every step.
+
+Speculative search: the search is started as soon as the request arrives.
+While it runs the stream plays a short spoken acknowledgement; the prompt
+is built when the result is in, or without it once SEARCH_BUDGET_SECS is
+spent.
+
+A turn can be cancelled (Turn.cancel): the stream stops at the next token,
+closes the upstream LLM stream, drops the TTS work still queued, passes the
+partial answer to on_done and ends. UserTurns keeps one turn in flight per
+user: a new request cancels the previous one and waits for it to stop, so
+the history stays in order. The claim is made by the stream's begin hook,
+so a response that is never read (the client left first) holds none. A
+client that goes away cancels the turn the same way, whether the server
+notices on a failed write (the generator is closed or, under ASGI,
+cancelled) or, in Flask mode, by the turn peeking at the client socket
+(client_gone).
+"""
+import os, json, base64, select, socket, struct, threading, time, asyncio
+from concurrent.futures import ThreadPoolExecutor, wait
+from tts_pipeline import TTSPipeline
+from segmenter import Segmenter
+from turn_trace import Trace
+
+SEARCH_BUDGET_SECS = float(os.getenv("SEARCH_BUDGET_SECS", 5))
+# How long a new turn waits for the same user's previous turn to stop
+TURN_CANCEL_WAIT = float(os.getenv("TURN_CANCEL_WAIT", 2))
+# Seconds between Turn.check polls (cancellation from other processes)
+TURN_CHECK_SECS = 0.25
+
+SSE_DONE = "data: [DONE]\n\n"
+
+_search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="search")
+
+
+def start_search(search, query):
+    """Run a blocking search(query) in the background -> Future"""
+    return _search_executor.submit(search, query)
+
+
+def sse(event):
+    return f"data: {json.dumps(event)}\n\n"
+
+
+def text_event(tok):
+    return sse({"type": "text", "content": tok})
+
+
+def audio_event(ad):
+    return sse({"type": "audio", "audio": base64.b64encode(ad).decode()})
+
+
+FRAME_TEXT, FRAME_AUDIO, FRAME_DONE, FRAME_CHUNK, FRAME_CHUNK_END = 1, 2, 3, 4, 5
+FRAMES_MIMETYPE = "application/x-chat-frames"
+
+
+def frame(kind, payload=b""):
+    return struct.pack(">BI", kind, len(payload)) + payload
+
+
+class SSE:
+    mimetype = "text/event-stream"
+    text = staticmethod(text_event)
+    audio = staticmethod(audio_event)
+    done = SSE_DONE
+
+    @staticmethod
+    def chunk(item):
+        seq, data, final = item
+        if final:
+            return sse({"type": "audio_end", "seq": seq})
+        return sse({"type": "audio_chunk", "seq": seq, "audio": base64.b64encode(data).decode()})
+
+
+class Frames:
+    mimetype = FRAMES_MIMETYPE
+
+    @staticmethod
+    def text(tok):
+        return frame(FRAME_TEXT, tok.encode("utf-8"))
+
+    @staticmethod
+    def audio(ad):
+        return frame(FRAME_AUDIO, ad)
+
+    @staticmethod
+    def chunk(item):
+        seq, data, final = item
+        if final:
+            return frame(FRAME_CHUNK_END, struct.pack(">I", seq))
+        return frame(FRAME_CHUNK, struct.pack(">I", seq) + data)
+
+    done = frame(FRAME_DONE)
+
+
+def pick_format(accept):
+    """Stream format for a request's Accept header; SSE unless frames are asked for"""
+    return Frames if FRAMES_MIMETYPE in (accept or "") else SSE
+
+
+class Turn:
+    """One answer: how to build the prompt plus the app-specific hooks.
+
+    build(search_result) -> prompt messages (search_result is None without search)
+    sentence(text) -> tuple of args for the TTS submit function, or None to skip
+    on_done(full) -> called with the full answer text (save to history etc.)
+    search -> Future / asyncio task of a search started for this turn, or None
+    ack -> TTS args for an acknowledgement spoken while the search runs
+    audio_chunks -> stream each sentence's audio as it is synthesized
+    min_len / clauses -> Segmenter settings for the chunks after the first
+    trace -> turn_trace.Trace started when the request came in
+    checks -> list of () -> reason to cancel, or None; polled while streaming
+    on_stop -> callables run once the stream has stopped, however it ended
+    """
+
+    def __init__(self, build, sentence, on_done, search=None, ack=None,
+                 min_len=15, clauses=False, trace=None):
+        self.build = build
+        self.sentence = sentence
+        self.on_done = on_done
+        self.search = search
+        self.ack = ack
+        self.min_len = min_len
+        self.clauses = clauses
+        self.audio_chunks = False
+        self.msgs = None
+        self.trace = trace or Trace("chat")
+        self.cancelled = None   # reason, once cancel() was called
+        self.checks = []
+        self.on_stop = []
+        self.stopped = threading.Event()
+        self._checked = 0.0
+
+    def cancel(self, reason):
+        """Stop at the next token: upstream stream closed, queued TTS dropped"""
+        if self.cancelled is None:
+            self.cancelled = reason
+            self.trace.mark("cancel", reason=reason)
+
+    def is_cancelled(self):
+        if self.cancelled is None and self.checks:
+            now = time.monotonic()
+            if now - self._checked >= TURN_CHECK_SECS:
+                self._checked = now
+                for check in self.checks:
+                    reason = check()
+                    if reason:
+                        self.cancel(reason)
+                        break
+        return self.cancelled is not None
+
+    def stop(self):
+        """Called by the stream loop when it is done with the turn"""
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        for fn in self.on_stop:
+            try:
+                fn()
+            except Exception as e:
+                print(f"[TURN ERR] {e}")
+
+    def segmenter(self):
+        return Segmenter(min_len=self.min_len, clauses=self.clauses)
+
+    def search_result(self):
+        if self.search is None or not self.search.done():
+            if self.search is not None:
+                print(f"[SEARCH] No result within {SEARCH_BUDGET_SECS}s - answering without it")
+                self.trace.mark("search_budget_spent")
+            return None
+        try:
+            return self.search.result()
+        except Exception as e:
+            print(f"[SEARCH ERR] {e}")
+            return None
+
+
+class TurnStats:
+    """Time to first audio and TTS chunking, over all turns of the process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._n = 0
+        self._sums = {"ttfa_ms": 0.0, "first_chunk_ms": 0.0, "chunks": 0, "first_chunk_chars": 0}
+        self._last = None
+        self._cancelled = {}   # reason -> turns
+        self._dropped_tts = 0
+
+    def record(self, **turn):
+        with self._lock:
+            self._n += 1
+            for k in self._sums:
+                self._sums[k] += turn[k]
+            self._last = turn
+
+    def cancel(self, reason, dropped_tts=0):
+        with self._lock:
+            self._cancelled[reason] = self._cancelled.get(reason, 0) + 1
+            self._dropped_tts += dropped_tts
+
+    def stats(self):
+        with self._lock:
+            n = self._n or 1
+            out = {"turns": self._n, "last": self._last, "cancelled": dict(self._cancelled),
+                   "dropped_tts_jobs": self._dropped_tts}
+            for k, v in self._sums.items():
+                out["avg_" + k] = round(v / n, 1)
+            return out
+
+
+turn_stats = TurnStats()
+
+
+def _audio(trace, emit):
+    """emit() for audio events that marks the first one on the trace"""
+    def audio(item):
+        trace.first("first_audio")
+        return emit(item)
+    return audio
+
+
+def _chunk(turn, text):
+    """TTS args for one segmenter chunk"""
+    turn.trace.mark("chunk", chars=len(text))
+    return turn.sentence(text)
+
+
+def _finish(turn, seg):
+    trace = turn.trace
+    ttfa, first_chunk = trace.at("first_audio") or 0.0, trace.at("chunk") or 0.0
+    turn_stats.record(ttfa_ms=ttfa, first_chunk_ms=first_chunk, chunks=seg.chunks,
+                      first_chunk_chars=seg.first_chunk_chars)
+    print(f"[TURN] first audio {ttfa} ms, {seg.chunks} chunks "
+          f"(first {seg.first_chunk_chars} chars at {first_chunk} ms)")
+    trace.finish(chunks=seg.chunks)
+
+
+def client_gone(environ):
+    """Turn check for Flask mode: "disconnected" once the client has closed
+    the connection (the socket turns readable with nothing left to read)"""
+    sock = environ.get("werkzeug.socket") or environ.get("gunicorn.socket")
+    if not isinstance(sock, socket.socket):
+        return lambda: None
+
+    def check():
+        try:
+            if select.select([sock], [], [], 0)[0] and not sock.recv(1, socket.MSG_PEEK):
+                return "disconnected"
+        except (OSError, ValueError):
+            return "disconnected" if sock.fileno() < 0 else None
+        return None
+    return check
+
+
+def _cancelled(turn, seg, tts, full):
+    """End a cancelled turn: drop queued TTS -> True if there is a partial
+    answer for on_done to keep"""
+    dropped = tts.cancel()
+    turn_stats.cancel(turn.cancelled, dropped)
+    print(f"[TURN] cancelled ({turn.cancelled}) after {len(full)} chars, "
+          f"{dropped} TTS jobs dropped")
+    turn.trace.finish(chunks=seg.chunks, cancelled=turn.cancelled, dropped_tts=dropped)
+    return bool(full)
+
+
+def _close(stream):
+    close = getattr(stream, "close", None)
+    if close:
+        close()
+
+
+async def _aclose(stream):
+    aclose = getattr(stream, "aclose", None)
+    if aclose:
+        await aclose()
+
+
+def stream_turn(turn, llm, submit, fmt=SSE, begin=None):
+    """llm(msgs) -> iterator of text deltas; begin() runs when the stream is
+    first read, and turn.stop() is guaranteed after it"""
+    trace = turn.trace
+    trace.activate()
+    full = ""
+    seg = turn.segmenter()
+    tts = TTSPipeline(trace.traced_submit(submit), chunks=turn.audio_chunks)
+    audio = _audio(trace, fmt.chunk if turn.audio_chunks else fmt.audio)
+    try:
+        if begin is not None:
+            begin()
+        if turn.search is not None:
+            if turn.ack:
+                for ad in tts.submit(*turn.ack):
+                    yield audio(ad)
+            deadline = time.monotonic() + SEARCH_BUDGET_SECS
+            while (not turn.search.done() and time.monotonic() < deadline
+                   and not turn.is_cancelled()):
+                wait([turn.search], timeout=min(deadline - time.monotonic(), 0.1))
+                for ad in tts.ready():
+                    yield audio(ad)
+        if not turn.is_cancelled():
+            turn.msgs = turn.build(turn.search_result())
+            trace.mark("llm_start")
+            stream = llm(turn.msgs)
+            try:
+                for tok in stream:
+                    trace.first("first_token")
+                    full += tok
+                    yield fmt.text(tok)
+                    for text in seg.feed(tok):
+                        job = _chunk(turn, text)
+                        if job:
+                            for ad in tts.submit(*job):
+                                yield audio(ad)
+                    for ad in tts.ready():
+                        yield audio(ad)
+                    if turn.is_cancelled():
+                        break
+            finally:
+                _close(stream)
+        if not turn.is_cancelled():
+            for text in seg.flush():
+                job = _chunk(turn, text)
+                if job:
+                    for ad in tts.submit(*job):
+                        yield audio(ad)
+            for ad in tts.drain():
+                yield audio(ad)
+                if turn.is_cancelled():
+                    break
+        if turn.is_cancelled():
+            if _cancelled(turn, seg, tts, full):
+                turn.on_done(full)
+        else:
+            _finish(turn, seg)
+            turn.on_done(full)
+        yield fmt.done
+    except GeneratorExit:
+        # The server closed the stream: the client went away mid-answer
+        if not turn.trace.finished:
+            turn.cancel("disconnected")
+            if _cancelled(turn, seg, tts, full):
+                turn.on_done(full)
+        raise
+    finally:
+        turn.stop()
+
+
+async def astream_turn(turn, llm, submit, fmt=SSE, begin=None):
+    """llm(msgs) -> async iterator of text deltas; await begin() runs when the
+    stream is first read"""
+    trace = turn.trace
+    trace.activate()
+    full = ""
+    seg = turn.segmenter()
+    tts = TTSPipeline(trace.traced_submit(submit), chunks=turn.audio_chunks)
+    audio = _audio(trace, fmt.chunk if turn.audio_chunks else fmt.audio)
+    try:
+        if begin is not None:
+            await begin()
+        if turn.search is not None:
+            if turn.ack:
+                for ad in await tts.asubmit(*turn.ack):
+                    yield audio(ad)
+            deadline = time.monotonic() + SEARCH_BUDGET_SECS
+            while (not turn.search.done() and time.monotonic() < deadline
+                   and not turn.is_cancelled()):
+                await asyncio.wait([turn.search], timeout=min(deadline - time.monotonic(), 0.1))
+                for ad in tts.ready():
+                    yield audio(ad)
+        if not turn.is_cancelled():
+            turn.msgs = turn.build(turn.search_result())
+            trace.mark("llm_start")
+            stream = llm(turn.msgs)
+            try:
+                async for tok in stream:
+                    trace.first("first_token")
+                    full += tok
+                    yield fmt.text(tok)
+                    for text in seg.feed(tok):
+                        job = _chunk(turn, text)
+                        if job:
+                            for ad in await tts.asubmit(*job):
+                                yield audio(ad)
+                    for ad in tts.ready():
+                        yield audio(ad)
+                    if turn.is_cancelled():
+                        break
+            finally:
+                await _aclose(stream)
+        if not turn.is_cancelled():
+            for text in seg.flush():
+                job = _chunk(turn, text)
+                if job:
+                    for ad in await tts.asubmit(*job):
+                        yield audio(ad)
+            async for ad in tts.adrain():
+                yield audio(ad)
+                if turn.is_cancelled():
+                    break
+        # on_done saves the answer (file, SQLite): off the loop, but before stop()
+        if turn.is_cancelled():
+            if _cancelled(turn, seg, tts, full):
+                await asyncio.to_thread(turn.on_done, full)
+        else:
+            _finish(turn, seg)
+            await asyncio.to_thread(turn.on_done, full)
+        yield fmt.done
+    except (GeneratorExit, asyncio.CancelledError):
+        # Closed by the server, or the response task cancelled: the client went away
+        if not turn.trace.finished:
+            turn.cancel("disconnected")
+            if _cancelled(turn, seg, tts, full):
+                await asyncio.to_thread(turn.on_done, full)
+        raise
+    finally:
+        turn.stop()
+
+
+class UserTurns:
+    """One turn in flight per user. start() cancels the user's previous turn
+    and waits up to TURN_CANCEL_WAIT for it to stop before the new one goes on.
+
+    shared (optional) -> the store that covers turns in other processes:
+    claim_turn(key, id) -> ids of that user's other running turns,
+    current_turn(key) -> id of the newest, turns_running(ids) -> the ones
+    still running, release_turn(id).
+    """
+
+    def __init__(self, shared=None):
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._turns = {}
+
+    def _claim(self, key, turn, on_loop=False):
+        """on_loop: the turn is stopped on the event loop (astart), so the
+        shared release goes to an executor"""
+        with self._lock:
+            old = self._turns.get(key)
+            self._turns[key] = turn
+        turn.on_stop.append(lambda: self._end(key, turn, on_loop))
+        if old is not None:
+            old.cancel("superseded")
+        others = []
+        if self.shared is not None:
+            others = self.shared().claim_turn(key, turn.trace.id)
+        if turn.stopped.is_set():
+            self._end(key, turn)   # stopped while claiming (astart, from a thread)
+        return old, others
+
+    def _superseded(self, key, turn):
+        """Turn check: "superseded" once another process claimed a newer turn for key"""
+        return None if self.shared().current_turn(key) == turn.trace.id else "superseded"
+
+    def _end(self, key, turn, on_loop=False):
+        with self._lock:
+            if self._turns.get(key) is turn:
+                del self._turns[key]
+        if self.shared is not None:
+            release = lambda: self.shared().release_turn(turn.trace.id)
+            if on_loop:
+                asyncio.get_running_loop().run_in_executor(None, release)
+            else:
+                release()
+
+    def _wait(self, old, others):
+        deadline = time.monotonic() + TURN_CANCEL_WAIT
+        if old is not None and not old.stopped.wait(TURN_CANCEL_WAIT):
+            print(f"[TURN] previous turn {old.trace.id} still running after {TURN_CANCEL_WAIT}s")
+        while others and time.monotonic() < deadline:
+            others = self.shared().turns_running(others)
+            if others:
+                time.sleep(0.05)
+
+    def start(self, key, turn):
+        old, others = self._claim(key, turn)
+        if self.shared is not None:
+            turn.checks.append(lambda: self._superseded(key, turn))
+        self._wait(old, others)
+
+    async def _awatch(self, key, turn):
+        """The superseded check for astart: polled off the loop while the turn runs"""
+        while turn.cancelled is None and not turn.stopped.is_set():
+            await asyncio.sleep(TURN_CHECK_SECS)
+            if not turn.stopped.is_set() and await asyncio.to_thread(self._superseded, key, turn):
+                turn.cancel("superseded")
+
+    async def astart(self, key, turn):
+        """start() for ASGI mode: the store is only touched from threads"""
+        old, others = await asyncio.to_thread(self._claim, key, turn, True)
+        if self.shared is not None:
+            watch = asyncio.create_task(self._awatch(key, turn))
+            turn.on_stop.append(watch.cancel)
+        if (old is not None and not old.stopped.is_set()) or others:
+            await asyncio.to_thread(self._wait, old, others)
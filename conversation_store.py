@@ -0,0 +1,247 @@
+"""
+Conversation state shared by all worker processes of app_personal.py.
+Messages and the context_window summary live in SQLite (WAL mode), so any
+worker can serve any profile. Changes to one user's state go through a
+per-user lock: a thread lock plus flock() on <db>.locks/<user>.lock.
+
+Each worker keeps a SharedConversation (a ContextWindow) per user and, under
+the lock, catches up with what other workers wrote since: new messages are
+appended, a summary folded elsewhere reloads the window. A user who keeps
+hitting the same worker costs one indexed SELECT per turn.
+
+The turns table lists the answers being streamed, so chat_stream.UserTurns
+can cancel a user's turn running in another worker.
+"""
+import os, json, sqlite3, threading, time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from context_window import ContextWindow, CONTEXT_LOAD_MESSAGES
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines - in-process lock only
+    fcntl = None
+
+CONVERSATIONS_DB = os.getenv("CONVERSATIONS_DB", "conversations.db")
+# Messages kept per user; older ones are pruned in batches
+CONVERSATION_KEEP = int(os.getenv("CONVERSATION_KEEP", 500))
+# A running turn older than this is ignored (its worker hung or lost track of it)
+TURN_STALE_SECS = 300
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+class ConversationStore:
+    def __init__(self, db_path=CONVERSATIONS_DB, keep=CONVERSATION_KEEP):
+        self.keep = keep
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._user_locks = {}
+        self._lock_dir = Path(f"{db_path}.locks")
+        self._lock_dir.mkdir(exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT, role TEXT, content TEXT, timestamp TEXT);
+            CREATE INDEX IF NOT EXISTS messages_user ON messages(user_id, id);
+            CREATE TABLE IF NOT EXISTS memory (
+                user_id TEXT PRIMARY KEY, summary TEXT, until TEXT);
+            CREATE TABLE IF NOT EXISTS turns (
+                turn_id TEXT PRIMARY KEY, user_id TEXT, pid INTEGER, started REAL,
+                stopped INTEGER DEFAULT 0);
+            CREATE INDEX IF NOT EXISTS turns_user ON turns(user_id);
+        """)
+        self._appends = {}   # user_id -> appends since the last prune
+
+    @contextmanager
+    def lock(self, user_id):
+        """Exclusive access to one user's state, across threads and processes"""
+        with self._lock:
+            local = self._user_locks.setdefault(user_id, threading.Lock())
+        with local:
+            if fcntl is None:
+                yield
+                return
+            # Opened per use: a descriptor inherited over fork would share the lock
+            with open(self._lock_dir / f"{user_id}.lock", "a") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def append(self, user_id, role, content):
+        """-> (id, timestamp) of the new message"""
+        timestamp = datetime.now().isoformat()
+        with self._lock, self._db:
+            cur = self._db.execute(
+                "INSERT INTO messages (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                (user_id, role, content, timestamp))
+            n = self._appends[user_id] = self._appends.get(user_id, 0) + 1
+            if n >= self.keep // 2:
+                self._db.execute(
+                    "DELETE FROM messages WHERE user_id = ? AND id NOT IN "
+                    "(SELECT id FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT ?)",
+                    (user_id, user_id, self.keep))
+                self._appends[user_id] = 0
+            return cur.lastrowid, timestamp
+
+    def messages(self, user_id, after_id=0, after_ts="", limit=CONTEXT_LOAD_MESSAGES):
+        """Up to `limit` newest messages with id > after_id and timestamp > after_ts, oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, role, content, timestamp FROM messages "
+                "WHERE user_id = ? AND id > ? AND timestamp > ? ORDER BY id DESC LIMIT ?",
+                (user_id, after_id, after_ts, limit)).fetchall()
+        return [{"id": i, "role": r, "content": c, "timestamp": t} for i, r, c, t in reversed(rows)]
+
+    def last_id(self, user_id):
+        with self._lock:
+            row = self._db.execute("SELECT MAX(id) FROM messages WHERE user_id = ?",
+                                   (user_id,)).fetchone()
+        return row[0] or 0
+
+    def memory(self, user_id):
+        """-> (summary, until) of the user's folded messages"""
+        with self._lock:
+            row = self._db.execute("SELECT summary, until FROM memory WHERE user_id = ?",
+                                   (user_id,)).fetchone()
+        return (row[0] or "", row[1] or "") if row else ("", "")
+
+    def set_memory(self, user_id, summary, until):
+        """Keeps the summary that covers more, if two workers fold at once"""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO memory (user_id, summary, until) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET summary = excluded.summary, "
+                "until = excluded.until WHERE excluded.until > memory.until",
+                (user_id, summary, until))
+
+    @staticmethod
+    def _running(rows):
+        now = time.time()
+        return [t for t, pid, started in rows if now - started < TURN_STALE_SECS and _alive(pid)]
+
+    def claim_turn(self, user_id, turn_id):
+        """Register a new turn as the user's current one -> ids of the user's
+        turns still running (in any worker)"""
+        with self._lock, self._db:
+            rows = self._db.execute(
+                "SELECT turn_id, pid, started FROM turns WHERE user_id = ? AND stopped = 0",
+                (user_id,)).fetchall()
+            self._db.execute("DELETE FROM turns WHERE user_id = ? AND stopped = 1", (user_id,))
+            self._db.execute("INSERT INTO turns (turn_id, user_id, pid, started) VALUES (?, ?, ?, ?)",
+                             (turn_id, user_id, os.getpid(), time.time()))
+        return self._running(rows)
+
+    def current_turn(self, user_id):
+        with self._lock:
+            row = self._db.execute("SELECT turn_id FROM turns WHERE user_id = ? "
+                                   "ORDER BY rowid DESC LIMIT 1", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def turns_running(self, turn_ids):
+        marks = ",".join("?" * len(turn_ids))
+        with self._lock:
+            rows = self._db.execute(f"SELECT turn_id, pid, started FROM turns "
+                                    f"WHERE stopped = 0 AND turn_id IN ({marks})",
+                                    list(turn_ids)).fetchall()
+        return self._running(rows)
+
+    def release_turn(self, turn_id):
+        with self._lock, self._db:
+            self._db.execute("UPDATE turns SET stopped = 1 WHERE turn_id = ?", (turn_id,))
+
+    def import_log(self, user_id, log, summary_path=None):
+        """One-time copy of a chat_log history (and its summary file); caller holds lock()"""
+        entries = log.tail(self.keep)
+        summary, until = "", ""
+        if summary_path and Path(summary_path).exists():
+            try:
+                data = json.loads(Path(summary_path).read_text(encoding="utf-8"))
+                summary, until = data.get("summary", ""), data.get("until", "")
+            except ValueError:
+                pass
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO messages (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                [(user_id, e["role"], e["content"], e.get("timestamp", "")) for e in entries])
+        if summary:
+            self.set_memory(user_id, summary, until)
+        print(f"[STORE] Imported {len(entries)} messages for {user_id} from {log.path}")
+
+
+class SharedConversation:
+    """One user's ContextWindow in this process, kept in step with the store"""
+
+    def __init__(self, store, user_id, summarize=None):
+        self.store = store
+        self.user_id = user_id
+        self.summarize = summarize
+        with store.lock(user_id):
+            self._reload()
+
+    def _reload(self):
+        summary, self._until = self.store.memory(self.user_id)
+        msgs = self.store.messages(self.user_id, after_ts=self._until)
+        self._seen = msgs[-1]["id"] if msgs else self.store.last_id(self.user_id)
+        self.window = ContextWindow(self.summarize, messages=msgs, summary=summary,
+                                    on_fold=self._on_fold)
+
+    def _sync(self):
+        """Catch up with other workers; caller holds the user lock"""
+        summary, until = self.store.memory(self.user_id)
+        if until != self._until:
+            print(f"[STORE] {self.user_id}: summary folded by another worker, reloading")
+            self._reload()
+            return
+        for m in self.store.messages(self.user_id, after_id=self._seen):
+            self.window.append(m["role"], m["content"], m["timestamp"])
+            self._seen = m["id"]
+
+    def _on_fold(self, summary, until):
+        with self.store.lock(self.user_id):
+            self.store.set_memory(self.user_id, summary, until)
+            if self.store.memory(self.user_id)[1] == until:
+                self._until = until
+            # else another worker's fold covers more: the next _sync() reloads it
+
+    def append(self, role, content):
+        with self.store.lock(self.user_id):
+            self._sync()
+            self._seen, timestamp = self.store.append(self.user_id, role, content)
+            self.window.append(role, content, timestamp)
+
+    def build(self, system_prompt, context=""):
+        return self.window.build(system_prompt, context)
+
+    def update(self):
+        self.window.update()
+
+    def stats(self):
+        return self.window.stats()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """This process's ConversationStore (a fresh connection after fork)"""
+    global _store
+    with _store_lock:
+        if _store is None or _store.pid != os.getpid():
+            _store = ConversationStore()
+        return _store
@@ -0,0 +1,278 @@
+"""
+Shared HTTP client layer for the xAI and Perplexity APIs.
+Flask mode: one keep-alive requests.Session per process with per-host
+connection pools, cached DNS and connect/TTFB metrics (also marked on the
+current turn_trace).
+ASGI mode: one pooled HTTP/2 httpx.AsyncClient per process, so concurrent
+streams are multiplexed over a few warm connections.
+Either way there is no new TCP+TLS handshake per turn.
+"""
+import os, json, contextlib, socket, threading, time
+from urllib.parse import urlparse
+import turn_trace
+
+# Total connections of the ASGI client; Flask mode caps per host with HTTP_HOST_LIMITS
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", 20))
+HTTP_KEEPALIVE_SECS = float(os.getenv("HTTP_KEEPALIVE_SECS", 60))
+# Connections per upstream host, e.g. "api.x.ai=32,api.perplexity.ai=8"
+HTTP_HOST_LIMITS = os.getenv("HTTP_HOST_LIMITS", "api.x.ai=32,api.perplexity.ai=8")
+# Seconds the Flask session keeps an HTTP_HOST_LIMITS host's address (0: no cache)
+HTTP_DNS_TTL = float(os.getenv("HTTP_DNS_TTL", 300))
+
+
+class UpstreamError(Exception):
+    def __init__(self, status, body=""):
+        super().__init__(f"{status}: {body[:200]}")
+        self.status = status
+
+
+SSE_END = object()
+
+
+def sse_delta(line):
+    """Content delta from one OpenAI-style SSE line: text, None, or SSE_END on [DONE]"""
+    if not line.startswith("data: "):
+        return None
+    d = line[6:]
+    if d == "[DONE]":
+        return SSE_END
+    try:
+        return json.loads(d).get("choices", [{}])[0].get("delta", {}).get("content", "") or None
+    except (ValueError, IndexError, AttributeError):
+        return None
+
+
+def auth_headers(api_key):
+    return {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+
+def parse_host_limits(spec):
+    limits = {}
+    for part in spec.split(","):
+        host, _, n = part.strip().partition("=")
+        if host and n.isdigit():
+            limits[host] = int(n)
+    return limits
+
+
+class HTTPMetrics:
+    """Per-host new-connection (TCP+TLS) time vs time to first byte"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _host(self, host):
+        return self._hosts.setdefault(host, {"requests": 0, "connects": 0,
+                                             "connect_ms": 0.0, "ttfb_ms": 0.0})
+
+    def connect(self, host, ms):
+        with self._lock:
+            h = self._host(host)
+            h["connects"] += 1
+            h["connect_ms"] += ms
+        turn_trace.observe_connect(host, ms)
+        turn_trace.mark("upstream_connect", host=host, ms=round(ms, 1))
+
+    def response(self, host, ttfb_ms):
+        with self._lock:
+            h = self._host(host)
+            h["requests"] += 1
+            h["ttfb_ms"] += ttfb_ms
+        turn_trace.mark("upstream_headers", host=host, ms=round(ttfb_ms, 1))
+
+    def stats(self):
+        with self._lock:
+            out = {}
+            for host, h in self._hosts.items():
+                out[host] = {
+                    "requests": h["requests"],
+                    "new_connections": h["connects"],
+                    "reuse_ratio": round(1 - h["connects"] / h["requests"], 3) if h["requests"] else 0.0,
+                    "avg_connect_ms": round(h["connect_ms"] / h["connects"], 1) if h["connects"] else 0.0,
+                    "avg_ttfb_ms": round(h["ttfb_ms"] / h["requests"], 1) if h["requests"] else 0.0,
+                }
+            return out
+
+
+metrics = HTTPMetrics()
+
+
+class DNSCache:
+    """Address per (host, port), re-resolved after ttl seconds or a failed
+    connect. Used by the session's upstream connections only; nothing else
+    in the process sees it."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def address(self, host, port, family=socket.AF_UNSPEC):
+        now = time.monotonic()
+        with self._lock:
+            hit = self._entries.get((host, port))
+        if hit and hit[0] > now:
+            return hit[1]
+        addr = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)[0][4][0]
+        with self._lock:
+            self._entries[(host, port)] = (now + self.ttl, addr)
+        return addr
+
+    def forget(self, host, port):
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+
+dns_cache = DNSCache(HTTP_DNS_TTL)
+
+
+def _build_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPSConnection
+    from urllib3.connectionpool import HTTPSConnectionPool
+    from urllib3.util.connection import allowed_gai_family
+
+    class TimedHTTPSConnection(HTTPSConnection):
+        def connect(self):
+            t = time.perf_counter()
+            super().connect()
+            metrics.connect(self.host, (time.perf_counter() - t) * 1000)
+
+    class CachedDNSConnection(TimedHTTPSConnection):
+        """Dials the cached address; TLS still checks the certificate against the hostname"""
+        def _new_conn(self):
+            host = self._dns_host
+            try:
+                self._dns_host = dns_cache.address(host, self.port, allowed_gai_family())
+            except OSError:
+                pass   # not cached: the normal lookup reports the error
+            try:
+                return super()._new_conn()
+            except Exception:
+                dns_cache.forget(host, self.port)
+                raise
+            finally:
+                self._dns_host = host
+
+    class TimedHTTPSPool(HTTPSConnectionPool):
+        ConnectionCls = TimedHTTPSConnection
+
+    class CachedDNSPool(HTTPSConnectionPool):
+        ConnectionCls = CachedDNSConnection
+
+    class PooledAdapter(HTTPAdapter):
+        def __init__(self, pool_cls=TimedHTTPSPool, **kw):
+            self.pool_cls = pool_cls
+            super().__init__(**kw)
+
+        def init_poolmanager(self, *args, **kw):
+            super().init_poolmanager(*args, **kw)
+            self.poolmanager.pool_classes_by_scheme = dict(
+                self.poolmanager.pool_classes_by_scheme, https=self.pool_cls)
+
+    session = requests.Session()
+    session.mount("https://", PooledAdapter(pool_connections=8, pool_maxsize=HTTP_MAX_KEEPALIVE))
+    upstream_pool = CachedDNSPool if HTTP_DNS_TTL > 0 else TimedHTTPSPool
+    for host, limit in parse_host_limits(HTTP_HOST_LIMITS).items():
+        # pool_block: a burst waits for a free connection instead of opening more
+        session.mount(f"https://{host}/", PooledAdapter(upstream_pool, pool_connections=1,
+                                                        pool_maxsize=limit, pool_block=True))
+    return session
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide keep-alive session (rebuilt after a fork)"""
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = _build_session()
+            _session_pid = os.getpid()
+        return _session
+
+
+def post(url, api_key, body, stream=False, timeout=30):
+    """POST JSON through the pooled session; records time to first byte"""
+    r = get_session().post(url, headers=auth_headers(api_key), json=body,
+                           stream=stream, timeout=timeout)
+    metrics.response(urlparse(url).hostname, r.elapsed.total_seconds() * 1000)
+    return r
+
+
+def iter_sse(r):
+    """Content deltas from a streaming chat completion response.
+    Reads to the end of the body so the connection goes back to the pool."""
+    try:
+        done = False
+        for ln in r.iter_lines():
+            if not ln or done:
+                continue
+            cnt = sse_delta(ln.decode("utf-8"))
+            if cnt is SSE_END:
+                done = True
+            elif cnt:
+                yield cnt
+    finally:
+        r.close()
+
+
+_async_client = None
+
+
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        import httpx
+        _async_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                                keepalive_expiry=HTTP_KEEPALIVE_SECS),
+            timeout=httpx.Timeout(60.0, connect=10.0))
+    return _async_client
+
+
+async def aclose():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Starlette lifespan: close the pooled client on shutdown"""
+    yield
+    await aclose()
+
+
+async def astream_chat(url, api_key, body, timeout=60):
+    """POST a streaming chat completion and yield content deltas"""
+    client = get_async_client()
+    t = time.perf_counter()
+    async with client.stream("POST", url, headers=auth_headers(api_key), json=body,
+                             timeout=timeout) as r:
+        metrics.response(urlparse(url).hostname, (time.perf_counter() - t) * 1000)
+        if r.status_code != 200:
+            raise UpstreamError(r.status_code, (await r.aread()).decode("utf-8", "replace"))
+        async for ln in r.aiter_lines():
+            cnt = sse_delta(ln)
+            if cnt is SSE_END:
+                break
+            if cnt:
+                yield cnt
+
+
+async def apost_json(url, api_key, body, timeout=30):
+    r = await get_async_client().post(url, headers=auth_headers(api_key), json=body,
+                                      timeout=timeout)
+    if r.status_code != 200:
+        raise UpstreamError(r.status_code, r.text)
+    return r.json()
@@ -0,0 +1,139 @@
+"""
+Incremental sentence segmenter for streaming TTS.
+Tokens are fed as they arrive and only the new text is scanned (a regex
+finds whitespace and punctuation), so the cost per token is O(token length)
+no matter how long the answer gets.
+
+The first chunk is kept short to get audio going: it ends at the first
+clause boundary (",;:" or a sentence end) once it has SEGMENT_FIRST_MIN_CHARS,
+or after SEGMENT_FIRST_WORDS words. Later chunks are whole sentences of at
+least min_len chars, which synthesize more efficiently and sound better.
+Decimals ("3.5", "3,5") and abbreviations ("t.y.", "pvz.", "Dr.") do not
+end a chunk; units that are also words ("min.", "val.") only after a number.
+"""
+import os, re, time
+
+SEGMENT_FIRST_WORDS = int(os.getenv("SEGMENT_FIRST_WORDS", 6))
+SEGMENT_FIRST_MIN_CHARS = int(os.getenv("SEGMENT_FIRST_MIN_CHARS", 8))
+# Cut a long run-on sentence at the next word once it gets this long
+SEGMENT_MAX_CHARS = int(os.getenv("SEGMENT_MAX_CHARS", 240))
+
+SENTENCE_END = frozenset(".!?…")
+CLAUSE_END = frozenset(",;:")
+# Whitespace, boundary marks and closing quotes/brackets; anything else between
+# a mark and the next whitespace cancels the boundary
+MARKS = re.compile(r"[\s.!?…,;:\"'»)\]}]")
+
+ABBREVIATIONS = frozenset("""
+pvz žr gim mln mlrd tūkst proc nr sek kt m d g pan plg lt
+mr mrs ms dr prof st vs jr sr approx
+г ул см стр тыс млн млрд др пр
+""".split())
+# Abbreviated only after a number ("5 min.", "8 val."); "a min." or "Val." ends a sentence
+UNITS = frozenset("min val".split())
+
+
+def is_abbreviation(word, prev=""):
+    """word is the text before a "." up to the previous whitespace, prev the word before it"""
+    w = word.lstrip("\"'«([{").lower()
+    if w in UNITS:
+        return prev[-1:].isdigit()
+    return not w or "." in w or len(w) == 1 or w in ABBREVIATIONS
+
+
+class Segmenter:
+    """feed(token) -> list of chunks ready for TTS; flush() -> the rest"""
+
+    def __init__(self, min_len=15, clauses=False, first_words=None,
+                 first_min_chars=None, max_len=None):
+        self.min_len = min_len
+        self.clauses = clauses
+        self.first_words = SEGMENT_FIRST_WORDS if first_words is None else first_words
+        self.first_min_chars = SEGMENT_FIRST_MIN_CHARS if first_min_chars is None else first_min_chars
+        self.max_len = max_len or SEGMENT_MAX_CHARS
+        self._buf = ""
+        self._start = 0        # start of the current chunk in _buf
+        self._word_start = 0   # start of the current word
+        self._words = 0        # complete words in the current chunk
+        self._pending = None   # boundary kind seen at the last mark, confirmed by whitespace
+        self._last = -1        # position of the last mark
+        self.chunks = 0
+        self.first_chunk_at = None
+        self.first_chunk_chars = 0
+
+    def _emit(self, end, out):
+        text = self._buf[self._start:end].strip()
+        self._start = end
+        self._words = 0
+        if not text:
+            return
+        out.append(text)
+        if self.chunks == 0:
+            self.first_chunk_at = time.perf_counter()
+            self.first_chunk_chars = len(text)
+        self.chunks += 1
+
+    def _boundary(self, end, kind, out):
+        """kind: "sentence", "clause" or "word" (plain whitespace)"""
+        n = end - self._start
+        if self.chunks == 0:
+            if kind != "word" and n >= self.first_min_chars:
+                self._emit(end, out)
+            elif self._words >= self.first_words:
+                self._emit(end, out)
+        elif kind == "sentence" and n >= self.min_len:
+            self._emit(end, out)
+        elif kind == "clause" and n >= (self.min_len if self.clauses else self.max_len // 2):
+            self._emit(end, out)
+        elif n >= self.max_len:
+            self._emit(end, out)
+
+    def _prev_word(self):
+        """The word before the current one, within the current chunk"""
+        words = self._buf[self._start:self._word_start].split()
+        return words[-1] if words else ""
+
+    def feed(self, tok):
+        out = []
+        base = len(self._buf)
+        self._buf += tok
+        buf = self._buf
+        for m in MARKS.finditer(buf, base):
+            i = m.start()
+            if i > self._last + 1:
+                self._pending = None   # a word char after the mark: "3.5", "3,5", "file.txt"
+            self._last = i
+            c = buf[i]
+            if c.isspace():
+                if i > self._word_start:
+                    self._words += 1
+                self._word_start = i + 1
+                if self._pending is not None:
+                    self._boundary(i, self._pending, out)
+                    self._pending = None
+                self._boundary(i, "word", out)
+            elif c in SENTENCE_END:
+                # "?!", "..." and 'end."' all end at the whitespace after them
+                if c != "." or self._pending or not is_abbreviation(
+                        buf[self._word_start:i], self._prev_word()):
+                    self._pending = "sentence"
+            elif c in CLAUSE_END:
+                self._pending = self._pending or "clause"
+        if self._last < len(buf) - 1:
+            self._pending = None
+        # Drop what has been emitted so the buffer stays one chunk long
+        if self._start:
+            self._buf = buf[self._start:]
+            self._word_start = max(self._word_start - self._start, 0)
+            self._last -= self._start
+            self._start = 0
+        return out
+
+    def flush(self):
+        out = []
+        self._pending = None
+        self._emit(len(self._buf), out)
+        self._buf = ""
+        self._start = self._word_start = 0
+        self._last = -1
+        return out
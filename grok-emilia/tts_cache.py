@@ -0,0 +1,107 @@
+"""
+Content-addressed cache for synthesized TTS audio.
+Key = sha256(normalized text, voice, rate, pitch, volume).
+Tier 1: in-memory LRU bounded by bytes.
+Tier 2 (optional): sharded directory of MP3s that survives restarts,
+    <dir>/<first 2 hex chars>/<sha256>.mp3
+"""
+import os, hashlib, threading, unicodedata, re
+from collections import OrderedDict
+from pathlib import Path
+
+TTS_CACHE_MB = float(os.getenv("TTS_CACHE_MB", 32))
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "")
+# Longer texts are almost never repeated - don't let them push out greetings
+TTS_CACHE_MAX_CHARS = int(os.getenv("TTS_CACHE_MAX_CHARS", 200))
+
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(text, voice, rate="+0%", pitch="+0Hz", volume="+0%"):
+    raw = "\x1f".join([normalize_text(text), voice, rate, pitch, volume])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    def __init__(self, max_bytes=None, disk_dir=None, max_chars=None):
+        self.max_bytes = int(TTS_CACHE_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        disk_dir = TTS_CACHE_DIR if disk_dir is None else disk_dir
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.max_chars = TTS_CACHE_MAX_CHARS if max_chars is None else max_chars
+        self._mem = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "stores": 0}
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    def cacheable(self, text):
+        return 0 < len(text) <= self.max_chars
+
+    def _path(self, key):
+        return self.disk_dir / key[:2] / f"{key}.mp3"
+
+    def _put_mem(self, key, audio):
+        # Caller holds the lock
+        if len(audio) > self.max_bytes:
+            return
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._mem[key] = audio
+        self._bytes += len(audio)
+        while self._bytes > self.max_bytes:
+            _, dropped = self._mem.popitem(last=False)
+            self._bytes -= len(dropped)
+            self.counters["evictions"] += 1
+
+    def get(self, key):
+        with self._lock:
+            audio = self._mem.get(key)
+            if audio is not None:
+                self._mem.move_to_end(key)
+                self.counters["hits"] += 1
+                return audio
+        if self.disk_dir:
+            try:
+                audio = self._path(key).read_bytes()
+            except OSError:
+                audio = None
+            if audio:
+                with self._lock:
+                    self.counters["disk_hits"] += 1
+                    self._put_mem(key, audio)
+                return audio
+        with self._lock:
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, key, audio):
+        if not audio:
+            return
+        with self._lock:
+            self._put_mem(key, audio)
+            self.counters["stores"] += 1
+        if self.disk_dir:
+            path = self._path(key)
+            try:
+                path.parent.mkdir(exist_ok=True)
+                tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+                tmp.write_bytes(audio)
+                os.replace(tmp, path)
+            except OSError as e:
+                print(f"[TTS CACHE ERR] {e}")
+
+    def stats(self):
+        with self._lock:
+            c = dict(self.counters)
+            c["entries"] = len(self._mem)
+            c["bytes"] = self._bytes
+        c["max_bytes"] = self.max_bytes
+        c["disk"] = str(self.disk_dir) if self.disk_dir else None
+        lookups = c["hits"] + c["disk_hits"] + c["misses"]
+        c["hit_ratio"] = round((c["hits"] + c["disk_hits"]) / lookups, 3) if lookups else 0.0
+        return c
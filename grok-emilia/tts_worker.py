@@ -0,0 +1,132 @@
+"""
+Long-lived edge-tts worker.
+One background thread owns a persistent asyncio loop; synthesis jobs are
+handed in from any thread and come back as TTSJob futures, which also
+deliver the audio chunk by chunk as edge-tts streams it.
+This replaces asyncio.run() (new loop + teardown) for every sentence.
+"""
+import os, asyncio, threading, time
+import edge_tts
+from tts_cache import TTSCache, cache_key
+from tts_pipeline import TTSJob
+
+# Max edge-tts websockets open at the same time per process
+TTS_MAX_CONNECTIONS = int(os.getenv("TTS_MAX_CONNECTIONS", 8))
+
+
+class TTSWorker:
+    def __init__(self, max_connections=TTS_MAX_CONNECTIONS, cache=None):
+        self.max_connections = max_connections
+        self.cache = cache
+        self.loop = asyncio.new_event_loop()
+        self._sem = None
+        self._lock = threading.Lock()
+        self._stats = {"jobs": 0, "errors": 0, "handshake_ms": 0.0, "synth_ms": 0.0,
+                       "bytes": 0, "last": None}
+        self.thread = threading.Thread(target=self._run, name="tts-loop", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self._sem = asyncio.Semaphore(self.max_connections)
+        self.loop.run_forever()
+
+    async def _synth(self, text, voice, rate, pitch, volume, job):
+        async with self._sem:
+            t0 = time.perf_counter()
+            first = None
+            chunks = []
+            try:
+                async for data in self._stream(text, voice, rate, pitch, volume):
+                    if first is None:
+                        first = time.perf_counter()
+                    chunks.append(data)
+                    job.push(data)
+            except Exception:
+                with self._lock:
+                    self._stats["errors"] += 1
+                raise
+            end = time.perf_counter()
+            first = first or end
+            audio = b"".join(chunks)
+            self._record(text, (first - t0) * 1000, (end - first) * 1000, len(audio))
+            return audio
+
+    async def _stream(self, text, voice, rate, pitch, volume):
+        """Audio chunks for one text"""
+        # edge-tts opens one websocket per Communicate and has no API to
+        # keep it open between texts, so reuse stops at the loop level
+        c = edge_tts.Communicate(text, voice, rate=rate, pitch=pitch, volume=volume)
+        async for ch in c.stream():
+            if ch["type"] == "audio":
+                yield ch["data"]
+
+    def _record(self, text, handshake_ms, synth_ms, size):
+        with self._lock:
+            s = self._stats
+            s["jobs"] += 1
+            s["handshake_ms"] += handshake_ms
+            s["synth_ms"] += synth_ms
+            s["bytes"] += size
+            s["last"] = {"chars": len(text), "handshake_ms": round(handshake_ms, 1),
+                         "synth_ms": round(synth_ms, 1), "bytes": size}
+
+    async def _run_job(self, job, *args):
+        try:
+            audio = await self._synth(*args, job)
+        except Exception as e:
+            job.finish(exc=e)
+        else:
+            job.finish(audio)
+
+    def submit(self, text, voice, rate="+0%", pitch="+0Hz", volume="+0%"):
+        """Queue a synthesis job from any thread -> TTSJob (Future[bytes])"""
+        job = TTSJob()
+        key = None
+        if self.cache and self.cache.cacheable(text):
+            key = cache_key(text, voice, rate, pitch, volume)
+            audio = self.cache.get(key)
+            if audio is not None:
+                job.push(audio)
+                job.finish(audio)
+                return job
+        task = asyncio.run_coroutine_threadsafe(
+            self._run_job(job, text, voice, rate, pitch, volume), self.loop)
+        job.on_cancel(task.cancel)
+        if key:
+            job.add_done_callback(lambda f: f.cancelled() or f.exception()
+                                  or self.cache.put(key, f.result()))
+        return job
+
+    def synthesize(self, text, voice, **kw):
+        return self.submit(text, voice, **kw).result()
+
+    def stats(self):
+        """Per-fragment handshake (time to first audio) and synthesis"""
+        with self._lock:
+            s = dict(self._stats)
+        n = s["jobs"] or 1
+        return {
+            "jobs": s["jobs"],
+            "errors": s["errors"],
+            "avg_handshake_ms": round(s["handshake_ms"] / n, 1),
+            "avg_synth_ms": round(s["synth_ms"] / n, 1),
+            "avg_bytes": s["bytes"] // n,
+            "last": s["last"],
+            "cache": self.cache.stats() if self.cache else None,
+        }
+
+
+_worker = None
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+
+def get_worker():
+    """Process-wide worker, started on first use (and again after a fork)"""
+    global _worker, _worker_pid
+    with _worker_lock:
+        if _worker is None or _worker_pid != os.getpid():
+            _worker = TTSWorker(cache=TTSCache())
+            _worker_pid = os.getpid()
+        return _worker
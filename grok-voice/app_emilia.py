@@ -4,21 +4,33 @@ EMILIJA AI - Asmeninis balso asistentas Emilijai
 Kalba: Lietuviu, Anglu, Rusu
 AI vardas: Krikšto tėtis - protingas ir rupestingas AI draugas
 """
-import os, json, asyncio, requests, edge_tts, base64, re
+import os, asyncio, re
 from flask import Flask, render_template_string, request, jsonify, Response
 from dotenv import load_dotenv
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from pathlib import Path
+from chat_stream import (Turn, stream_turn, astream_turn, start_search, pick_format, turn_stats,
+                         client_gone)
+from turn_trace import Trace, METRICS_MIMETYPE, metrics_text, recent
+import http_client
+from http_client import UpstreamError, astream_chat, apost_json, iter_sse, lifespan
+from tts_worker import get_worker
+from chat_log import open_log
+from context_window import ContextWindow, open_window, llm_summarizer
+from prompt_prefix import build_prompt, prefix_stats
+from search_cache import search_cache
+from lang_detect import detect, detect_language
 
 load_dotenv()
 app = Flask(__name__)
 
 # API Keys
 XAI_API_KEY = os.getenv("XAI_API_KEY")
-XAI_API_URL = "https://api.x.ai/v1/chat/completions"
+XAI_API_URL = os.getenv("XAI_API_URL", "https://api.x.ai/v1/chat/completions")
 PPLX_API_KEY = os.getenv("PPLX_API_KEY")
-PPLX_API_URL = "https://api.perplexity.ai/chat/completions"
+PPLX_API_URL = os.getenv("PPLX_API_URL", "https://api.perplexity.ai/chat/completions")
+# Below this detector confidence a sentence keeps the message language/voice
+LANG_SWITCH_CONFIDENCE = float(os.getenv("LANG_SWITCH_CONFIDENCE", 0.7))
 
 # Profile for Emilia
 PROFILE = {
@@ -31,88 +43,33 @@ PROFILE = {
     "voice_ru": "ru-RU-DmitryNeural"        # Male Russian voice
 }
 
+# Spoken while an internet search is still running
+ACK_PHRASES = {
+    "lt": "Tuoj pažiūrėsiu, Emilija.",
+    "en": "Let me check, Emilia.",
+    "ru": "Сейчас посмотрю, Эмилия."
+}
+
 # Conversation storage
-HISTORY_FILE = Path("history_emilia.json")
-conversation = []
+HISTORY = open_log("history_emilia.jsonl", legacy_path="history_emilia.json")
 
 def load_conversation():
+    """Recent messages within the token budget, older ones folded into a summary"""
+    summarize = llm_summarizer(XAI_API_URL, XAI_API_KEY, lambda msgs: grok_request(msgs))
     try:
-        if HISTORY_FILE.exists():
-            history = json.loads(HISTORY_FILE.read_text(encoding="utf-8"))
-            conv = [{"role": m["role"], "content": m["content"]} for m in history[-20:]]
-            print(f"[MEMORY] Loaded {len(conv)} messages")
-            return conv
+        conv = open_window(HISTORY, summarize)
+        print(f"[MEMORY] Loaded {conv.stats()['messages']} messages")
+        return conv
     except Exception as e:
         print(f"[MEMORY ERR] {e}")
-    return []
+    return ContextWindow(summarize)
 
 def save_message(role, content):
     try:
-        history = []
-        if HISTORY_FILE.exists():
-            history = json.loads(HISTORY_FILE.read_text(encoding="utf-8"))
-        history.append({
-            "timestamp": datetime.now().isoformat(),
-            "role": role,
-            "content": content
-        })
-        if len(history) > 500:
-            history = history[-500:]
-        HISTORY_FILE.write_text(json.dumps(history, ensure_ascii=False, indent=2), encoding="utf-8")
+        HISTORY.append(role, content)
     except Exception as e:
         print(f"[SAVE ERR] {e}")
 
-def detect_language(text):
-    text_lower = text.lower()
-    words = text_lower.split()
-
-    # Russian characters - check first (Cyrillic)
-    ru_chars = ['а', 'б', 'в', 'г', 'д', 'е', 'ё', 'ж', 'з', 'и', 'й', 'к', 'л', 'м',
-                'н', 'о', 'п', 'р', 'с', 'т', 'у', 'ф', 'х', 'ц', 'ч', 'ш', 'щ', 'ъ',
-                'ы', 'ь', 'э', 'ю', 'я']
-    if any(c in text_lower for c in ru_chars):
-        return "ru"
-
-    # Lithuanian special characters
-    lt_chars = ['ą', 'č', 'ę', 'ė', 'į', 'š', 'ų', 'ū', 'ž']
-    if any(c in text_lower for c in lt_chars):
-        return "lt"
-
-    # Common English words (check before Lithuanian)
-    en_words = ['the', 'is', 'are', 'was', 'were', 'have', 'has', 'had', 'do', 'does',
-                'did', 'will', 'would', 'could', 'should', 'can', 'may', 'might',
-                'hello', 'hi', 'hey', 'how', 'what', 'where', 'when', 'why', 'who',
-                'yes', 'no', 'please', 'thank', 'thanks', 'sorry', 'okay', 'ok',
-                'good', 'great', 'nice', 'well', 'very', 'much', 'more', 'less',
-                'this', 'that', 'these', 'those', 'here', 'there', 'now', 'then',
-                'i', 'you', 'he', 'she', 'it', 'we', 'they', 'my', 'your', 'his', 'her',
-                'and', 'but', 'or', 'if', 'because', 'so', 'just', 'only', 'also',
-                'about', 'with', 'for', 'from', 'into', 'like', 'want', 'need',
-                'know', 'think', 'feel', 'see', 'hear', 'say', 'tell', 'ask',
-                'help', 'let', 'make', 'get', 'go', 'come', 'take', 'give', 'find']
-
-    # Lithuanian words (without special chars)
-    lt_words = ['labas', 'kaip', 'aciu', 'prasau', 'gerai', 'taip', 'kas', 'kur',
-                'kodel', 'kada', 'man', 'tau', 'jis', 'ji', 'mes', 'jus', 'as', 'tu',
-                'noriu', 'galiu', 'reikia', 'zinau', 'suprantu', 'klausyk', 'pasakyk',
-                'kokios', 'kokia', 'koks', 'kokie', 'naujienos', 'dabar', 'siandien',
-                'sveiki', 'sveikas', 'sveika', 'laba', 'labai', 'gera', 'geras', 'gali',
-                'nori', 'turi', 'matau', 'zinai', 'sakyk', 'klausiu', 'atsakyk',
-                'emilija', 'tavo', 'mano', 'musu', 'jusu']
-
-    # Count matches
-    en_count = sum(1 for w in words if w in en_words)
-    lt_count = sum(1 for w in words if w in lt_words)
-
-    # If more English words, it's English
-    if en_count > lt_count:
-        return "en"
-    if lt_count > 0:
-        return "lt"
-
-    # Default to English for unknown
-    return "en"
-
 def get_voice(language):
     voices = {
         "lt": PROFILE["voice_lt"],
@@ -126,46 +83,56 @@ def clean_tts(text):
     text = re.sub(r"[\U0001F300-\U0001F9FF\U00002600-\U000027BF\U0001FA00-\U0001FAFF]", "", text)
     return text.strip()
 
+def submit_tts(text, voice, lang="en"):
+    # Higher pitch for English to sound younger
+    rate = "+10%" if lang == "en" else "+5%"
+    pitch = "+5Hz" if lang == "en" else "+0Hz"
+    return get_worker().submit(text, voice, rate=rate, pitch=pitch, volume="+50%")
+
 def gen_tts(text, voice, lang="en"):
-    async def _g():
-        # Higher pitch for English to sound younger
-        rate = "+10%" if lang == "en" else "+5%"
-        pitch = "+5Hz" if lang == "en" else "+0Hz"
-        c = edge_tts.Communicate(text, voice, rate=rate, pitch=pitch, volume="+50%")
-        d = b""
-        async for ch in c.stream():
-            if ch["type"] == "audio":
-                d += ch["data"]
-        return d
-    return asyncio.run(_g())
+    return submit_tts(text, voice, lang).result()
+
+def pplx_request(query):
+    return {
+        "model": "sonar",
+        "messages": [
+            {"role": "system", "content": "Find current information. Be brief, facts only."},
+            {"role": "user", "content": query}
+        ],
+        "max_tokens": 500,
+        "temperature": 0.2
+    }
 
-def search_perplexity(query):
+def fetch_perplexity(query):
     if not PPLX_API_KEY:
         return None
     try:
         print(f"[PPLX] Searching: {query[:50]}...")
-        r = requests.post(PPLX_API_URL,
-            headers={
-                "Authorization": f"Bearer {PPLX_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "sonar",
-                "messages": [
-                    {"role": "system", "content": "Find current information. Be brief, facts only."},
-                    {"role": "user", "content": query}
-                ],
-                "max_tokens": 500,
-                "temperature": 0.2
-            },
-            timeout=30
-        )
+        r = http_client.post(PPLX_API_URL, PPLX_API_KEY, pplx_request(query), timeout=30)
         if r.status_code == 200:
             return r.json().get("choices", [{}])[0].get("message", {}).get("content", "")
     except Exception as e:
         print(f"[PPLX ERROR] {e}")
     return None
 
+async def afetch_perplexity(query):
+    if not PPLX_API_KEY:
+        return None
+    try:
+        print(f"[PPLX] Searching: {query[:50]}...")
+        data = await apost_json(PPLX_API_URL, PPLX_API_KEY, pplx_request(query), timeout=30)
+        return data.get("choices", [{}])[0].get("message", {}).get("content", "")
+    except Exception as e:
+        print(f"[PPLX ERROR] {e}")
+    return None
+
+def search_perplexity(query):
+    """Cached search; identical queries in flight share one upstream call"""
+    return search_cache.get_or_fetch(query, fetch_perplexity, lang=detect_language(query))
+
+async def asearch_perplexity(query):
+    return await search_cache.aget_or_fetch(query, afetch_perplexity, lang=detect_language(query))
+
 def needs_search(text):
     keywords = [
         # English
@@ -184,39 +151,42 @@ def needs_search(text):
     text_lower = text.lower()
     return any(kw in text_lower for kw in keywords)
 
+def grok_request(msgs):
+    return {
+        "model": "grok-3-mini-fast",
+        "messages": msgs,
+        "max_tokens": 800,
+        "temperature": 0.7,
+        "reasoning_effort": "low",
+        "stream": True
+    }
+
 def stream_grok(msgs):
     if not XAI_API_KEY:
         yield "[NO API KEY]"
         return
     try:
-        r = requests.post(XAI_API_URL,
-            headers={"Authorization": f"Bearer {XAI_API_KEY}", "Content-Type": "application/json"},
-            json={
-                "model": "grok-3-mini-fast",
-                "messages": msgs,
-                "max_tokens": 800,
-                "temperature": 0.7,
-                "reasoning_effort": "low",
-                "stream": True
-            },
-            stream=True, timeout=60)
+        r = http_client.post(XAI_API_URL, XAI_API_KEY, grok_request(msgs), stream=True, timeout=60)
         if r.status_code != 200:
             print(f"[API ERROR] {r.status_code}: {r.text[:200]}")
             yield f"[Error {r.status_code}]"
             return
-        for ln in r.iter_lines():
-            if ln:
-                ln = ln.decode("utf-8")
-                if ln.startswith("data: "):
-                    d = ln[6:]
-                    if d == "[DONE]":
-                        break
-                    try:
-                        cnt = json.loads(d).get("choices", [{}])[0].get("delta", {}).get("content", "")
-                        if cnt:
-                            yield cnt
-                    except:
-                        pass
+        for cnt in iter_sse(r):
+            yield cnt
+    except Exception as e:
+        print(f"[ERROR] {e}")
+        yield "[Connection error]"
+
+async def astream_grok(msgs):
+    if not XAI_API_KEY:
+        yield "[NO API KEY]"
+        return
+    try:
+        async for cnt in astream_chat(XAI_API_URL, XAI_API_KEY, grok_request(msgs)):
+            yield cnt
+    except UpstreamError as e:
+        print(f"[API ERROR] {e}")
+        yield f"[Error {e.status}]"
     except Exception as e:
         print(f"[ERROR] {e}")
         yield "[Connection error]"
@@ -499,45 +469,48 @@ async function sendMessage(text){
     try{
         const response=await fetch('/chat-stream',{
             method:'POST',
-            headers:{'Content-Type':'application/json'},
-            body:JSON.stringify({message:text})
+            headers:{'Content-Type':'application/json','Accept':'application/x-chat-frames, text/event-stream'},
+            body:JSON.stringify({message:text,audio_chunks:chunkAudio})
         });
 
         if(!response.ok) throw new Error('HTTP '+response.status);
 
         const reader=response.body.getReader();
-        const decoder=new TextDecoder();
         let fullText='';
-        let buffer='';
+        const onText=(t)=>{
+            fullText+=t;
+            gm.querySelector('.txt').textContent=fullText;
+            chat.scrollTop=chat.scrollHeight;
+        };
+        // Chunked audio starts playing while the first sentence is synthesized
+        let player=null;
+        const onChunk=(bytes)=>{
+            if(!player){
+                player=streamPlayer(au,playNext);
+                isPlaying=true;
+                st.textContent='Kalbu...';
+                st.className='speak';
+                au.play().catch((e)=>{
+                    playBtn.style.display='block';
+                    st.textContent='Paspausk paleisti';
+                });
+            }
+            player.push(bytes);
+        };
+        // Binary frames when the server supports them, SSE otherwise
+        const feed=(response.headers.get('Content-Type')||'').includes('x-chat-frames')
+            ?frameReader(onText,(b)=>audioQueue.push(URL.createObjectURL(b)),onChunk)
+            :sseReader(onText,(a)=>audioQueue.push('data:audio/mp3;base64,'+a),onChunk);
 
         while(true){
             const{done,value}=await reader.read();
             if(done) break;
-
-            buffer+=decoder.decode(value,{stream:true});
-            const lines=buffer.split('\\n');
-            buffer=lines.pop()||'';
-
-            for(const line of lines){
-                if(line.startsWith('data: ')){
-                    const data=line.slice(6).trim();
-                    if(data==='[DONE]'||!data) continue;
-                    try{
-                        const p=JSON.parse(data);
-                        if(p.type==='text'&&p.content){
-                            fullText+=p.content;
-                            gm.querySelector('.txt').textContent=fullText;
-                            chat.scrollTop=chat.scrollHeight;
-                        }
-                        if(p.type==='audio'&&p.audio){
-                            audioQueue.push(p.audio);
-                        }
-                    }catch(e){}
-                }
-            }
+            feed(value);
         }
 
-        if(audioQueue.length>0){
+        if(player){
+            player.end();
+        }else if(audioQueue.length>0){
             st.textContent='Kalbu...';
             st.className='speak';
             playNext();
@@ -555,6 +528,81 @@ async function sendMessage(text){
     }
 }
 
+const chunkAudio=!!(window.MediaSource&&MediaSource.isTypeSupported('audio/mpeg'));
+
+function streamPlayer(au,onEnded){
+    // One MediaSource per answer; chunks arrive in sentence order, so just append
+    const ms=new MediaSource();
+    const url=URL.createObjectURL(ms);
+    const pending=[];
+    let sb=null,closed=false;
+    const pump=()=>{
+        if(!sb||sb.updating) return;
+        if(pending.length) sb.appendBuffer(pending.shift());
+        else if(closed&&ms.readyState==='open') ms.endOfStream();
+    };
+    ms.addEventListener('sourceopen',()=>{
+        sb=ms.addSourceBuffer('audio/mpeg');
+        sb.mode='sequence';
+        sb.addEventListener('updateend',pump);
+        pump();
+    });
+    au.src=url;
+    au.onended=()=>{ URL.revokeObjectURL(url); onEnded(); };
+    au.onerror=au.onended;
+    return {
+        push(bytes){ pending.push(bytes); pump(); },
+        end(){ closed=true; pump(); }
+    };
+}
+
+function sseReader(onText,onAudio,onChunk){
+    const decoder=new TextDecoder();
+    let buffer='';
+    return function(chunk){
+        buffer+=decoder.decode(chunk,{stream:true});
+        const lines=buffer.split('\\n');
+        buffer=lines.pop()||'';
+
+        for(const line of lines){
+            if(line.startsWith('data: ')){
+                const data=line.slice(6).trim();
+                if(data==='[DONE]'||!data) continue;
+                try{
+                    const p=JSON.parse(data);
+                    if(p.type==='text'&&p.content) onText(p.content);
+                    if(p.type==='audio'&&p.audio) onAudio(p.audio);
+                    if(p.type==='audio_chunk'&&p.audio) onChunk(Uint8Array.from(atob(p.audio),(c)=>c.charCodeAt(0)));
+                }catch(e){}
+            }
+        }
+    };
+}
+
+function frameReader(onText,onAudio,onChunk){
+    // [1 byte type][4 byte big-endian length][payload]
+    // 1=text 2=audio 3=done 4=audio chunk ([4 byte seq]+mp3) 5=sentence end
+    const decoder=new TextDecoder();
+    let buf=new Uint8Array(0);
+    return function(chunk){
+        const b=new Uint8Array(buf.length+chunk.length);
+        b.set(buf);
+        b.set(chunk,buf.length);
+        buf=b;
+        let off=0;
+        while(buf.length-off>=5){
+            const len=new DataView(buf.buffer,off+1,4).getUint32(0);
+            if(buf.length-off-5<len) break;
+            const payload=buf.subarray(off+5,off+5+len);
+            if(buf[off]===1) onText(decoder.decode(payload));
+            else if(buf[off]===2) onAudio(new Blob([payload],{type:'audio/mpeg'}));
+            else if(buf[off]===4) onChunk(payload.slice(4));
+            off+=5+len;
+        }
+        buf=buf.slice(off);
+    };
+}
+
 function playNext(){
     if(audioQueue.length===0){
         isPlaying=false;
@@ -565,12 +613,16 @@ function playNext(){
     }
 
     isPlaying=true;
-    const audioData=audioQueue.shift();
+    const src=audioQueue.shift();
+    const next=()=>{
+        if(src.startsWith('blob:')) URL.revokeObjectURL(src);
+        playNext();
+    };
 
-    au.src='data:audio/mp3;base64,'+audioData;
+    au.src=src;
     au.volume=1.0;
-    au.onended=playNext;
-    au.onerror=(e)=>{ playNext(); };
+    au.onended=next;
+    au.onerror=(e)=>{ next(); };
 
     au.play().then(()=>{
     }).catch((e)=>{
@@ -595,41 +647,37 @@ conversation = load_conversation()
 def index():
     return render_template_string(HTML)
 
-@app.route("/chat-stream", methods=["POST"])
-def chat_endpoint():
-    global conversation
+@app.route("/tts-stats")
+def tts_stats():
+    return jsonify(get_worker().stats())
 
-    msg = request.json.get("message", "")
-    if not msg:
-        return jsonify({"error": "empty"})
+@app.route("/http-stats")
+def http_stats():
+    return jsonify(http_client.metrics.stats())
 
-    print(f"[EMILIA] {msg}")
+@app.route("/search-stats")
+def search_stats():
+    return jsonify(search_cache.stats())
 
-    # Detect language
-    lang = detect_language(msg)
-    print(f"[LANG] {lang}")
+@app.route("/turn-stats")
+def turn_stats_route():
+    return jsonify(turn_stats.stats())
 
-    # Save message
-    save_message("user", msg)
-    conversation.append({"role": "user", "content": msg})
-    if len(conversation) > 20:
-        conversation = conversation[-20:]
+@app.route("/prompt-stats")
+def prompt_stats_route():
+    return jsonify(prefix_stats.stats())
 
-    # Search if needed
-    search_context = ""
-    if needs_search(msg):
-        print(f"[SEARCH] Query needs current info...")
-        result = search_perplexity(msg)
-        if result:
-            search_context = f"\n\n=== SVARBU: INFORMACIJA IŠ INTERNETO (naudok šią informaciją atsakymui!) ===\n{result}\n=== PABAIGA ===\n"
-            print(f"[SEARCH RESULT] Found: {result[:100]}...")
-        else:
-            print(f"[SEARCH] No results returned")
+@app.route("/metrics")
+def prometheus_metrics():
+    return Response(metrics_text(), content_type=METRICS_MIMETYPE)
 
-    # Build system prompt
-    today = datetime.now(ZoneInfo("Europe/Vilnius")).strftime("%Y-%m-%d %H:%M")
+@app.route("/traces")
+def traces():
+    return jsonify(recent(request.args.get("n", 20, type=int)))
 
-    system_prompt = f"""Tu esi Krikšto tėtis - protingas ir rupestingas AI draugas. Tu kalbi su Emilija (jai 11 metu).
+# Static part of the system prompt: byte-identical on every request, so the
+# upstream can reuse its prompt cache (time, language and search go last)
+SYSTEM_PROMPT = """Tu esi Krikšto tėtis - protingas ir rupestingas AI draugas. Tu kalbi su Emilija (jai 11 metu).
 
 SVARBU - KREIPIMASIS:
 - VISADA kreipkis i ja "Emilija"
@@ -646,63 +694,150 @@ TAISYKLES:
 - JOKIU emoji! Tai balso isvestis
 - Padek mokytis anglu kalbos - pagirti ir svelniai pataisyti klaidas
 - Emilijai yra 11 metu, ji mokosi 5 klaseje
-{search_context}
+
 INTERNETO PAIEŠKA:
-- Jei žemiau yra "INFORMACIJA IŠ INTERNETO" - BŪTINAI naudok tą informaciją atsakymui!
+- Jei paskutiniame sistemos pranešime yra "INFORMACIJA IŠ INTERNETO" - BŪTINAI naudok tą informaciją atsakymui!
 - Tai yra TIKRI, AKTUALŪS duomenys iš interneto paieškos
 - Atsakyk remiantis šia informacija, ne savo žiniomis
 
-Dabartinis laikas: {today}
-Aptikta kalba: {lang}
-
 SVARBU:
 - JOKIU emoji! Tai balso isvestis
 - Atsakymai TRUMPI (1-3 sakiniai)
 - Atitik vartotojo kalba
 - Jei yra interneto informacija - NAUDOK ją!"""
 
-    msgs = [{"role": "system", "content": system_prompt}] + conversation
+def prepare_turn(msg, search=None):
+    # Detect language
+    lang = detect_language(msg)
+    print(f"[LANG] {lang}")
+
+    # Save message
+    save_message("user", msg)
+    conversation.append("user", msg)
+
+    def build(search_result):
+        search_context = ""
+        if search_result:
+            search_context = f"\n\n=== SVARBU: INFORMACIJA IŠ INTERNETO (naudok šią informaciją atsakymui!) ===\n{search_result}\n=== PABAIGA ===\n"
+            print(f"[SEARCH RESULT] Found: {search_result[:100]}...")
+        elif search:
+            print(f"[SEARCH] No results returned")
+
+        # Per-turn context goes last, after the history, so the prefix stays cacheable
+        today = datetime.now(ZoneInfo("Europe/Vilnius")).strftime("%Y-%m-%d %H:%M")
+        context = f"""Dabartinis laikas: {today}
+Aptikta kalba: {lang}{search_context}"""
+
+        return build_prompt("emilia", conversation, SYSTEM_PROMPT, context)
 
     # Get voice for detected language
     voice = get_voice(lang)
     print(f"[VOICE] {voice}")
 
-    def gen():
-        full, buf = "", ""
-        for tok in stream_grok(msgs):
-            full += tok
-            buf += tok
-            yield f'data: {json.dumps({"type": "text", "content": tok})}\n\n'
-
-            if re.search(r"[.!?]\s*$", buf) and len(buf) > 15:
-                s = clean_tts(buf)
-                if s:
-                    try:
-                        # Detect language of response text for correct voice
-                        resp_lang = detect_language(s)
-                        resp_voice = get_voice(resp_lang)
-                        ad = gen_tts(s, resp_voice, resp_lang)
-                        yield f'data: {json.dumps({"type": "audio", "audio": base64.b64encode(ad).decode()})}\n\n'
-                    except Exception as e:
-                        print(f"[TTS ERROR] {e}")
-                buf = ""
-
-        if buf:
-            s = clean_tts(buf)
-            if s:
-                try:
-                    resp_lang = detect_language(s)
-                    resp_voice = get_voice(resp_lang)
-                    ad = gen_tts(s, resp_voice, resp_lang)
-                    yield f'data: {json.dumps({"type": "audio", "audio": base64.b64encode(ad).decode()})}\n\n'
-                except Exception as e:
-                    print(f"[TTS ERROR] {e}")
-
+    def sentence(buf):
+        s = clean_tts(buf)
+        if s:
+            # Detect language of response text for correct voice; keep the
+            # message language when a short sentence is ambiguous
+            resp_lang, conf = detect(s)
+            if conf < LANG_SWITCH_CONFIDENCE:
+                resp_lang = lang
+            resp_voice = get_voice(resp_lang)
+            return (s, resp_voice, resp_lang)
+
+    def finish(full):
         save_message("assistant", full)
-        conversation.append({"role": "assistant", "content": full})
-        yield "data: [DONE]\n\n"
+        conversation.append("assistant", full)
+        conversation.update()
 
-    return Response(gen(), mimetype="text/event-stream")
+    ack = (ACK_PHRASES.get(lang, ACK_PHRASES["en"]), voice, lang) if search else None
+    return Turn(build, sentence, finish, search=search, ack=ack)
+
+@app.route("/chat-stream", methods=["POST"])
+def chat_endpoint():
+    trace = Trace("emilia")
+    data = request.json
+    msg = data.get("message", "")
+    if not msg:
+        return jsonify({"error": "empty"})
+
+    print(f"[EMILIA] {msg}")
+
+    # Search if needed - runs while the acknowledgement is spoken
+    search = None
+    if needs_search(msg):
+        print(f"[SEARCH] Query needs current info...")
+        search = trace.track("search", start_search(search_perplexity, msg))
+
+    turn = prepare_turn(msg, search)
+    turn.trace = trace
+    turn.checks.append(client_gone(request.environ))
+    turn.audio_chunks = bool(data.get("audio_chunks"))
+    fmt = pick_format(request.headers.get("Accept"))
+    return Response(stream_turn(turn, stream_grok, submit_tts, fmt), mimetype=fmt.mimetype)
+
+def create_asgi_app():
+    """ASGI mode: uvicorn --factory app_emilia:create_asgi_app (or SERVE_MODE=asgi)"""
+    from starlette.applications import Starlette
+    from starlette.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+    from starlette.routing import Route
+
+    async def index(request):
+        return HTMLResponse(HTML)
+
+    async def stats(request):
+        return JSONResponse(get_worker().stats())
+
+    async def http_stats(request):
+        return JSONResponse(http_client.metrics.stats())
+
+    async def search_stats(request):
+        return JSONResponse(search_cache.stats())
+
+    async def turns(request):
+        return JSONResponse(turn_stats.stats())
+
+    async def prompt_stats(request):
+        return JSONResponse(prefix_stats.stats())
+
+    async def metrics(request):
+        return Response(metrics_text(), media_type=METRICS_MIMETYPE)
+
+    async def traces(request):
+        return JSONResponse(recent(int(request.query_params.get("n", 20))))
+
+    async def chat_stream(request):
+        trace = Trace("emilia")
+        data = await request.json()
+        msg = data.get("message", "")
+        if not msg:
+            return JSONResponse({"error": "empty"})
+
+        print(f"[EMILIA] {msg}")
+
+        search = None
+        if needs_search(msg):
+            print(f"[SEARCH] Query needs current info...")
+            search = trace.track("search", asyncio.ensure_future(asearch_perplexity(msg)))
+
+        turn = prepare_turn(msg, search)
+        turn.trace = trace
+        turn.audio_chunks = bool(data.get("audio_chunks"))
+        fmt = pick_format(request.headers.get("accept"))
+        return StreamingResponse(astream_turn(turn, astream_grok, submit_tts, fmt),
+                                 media_type=fmt.mimetype)
+
+    return Starlette(routes=[
+        Route("/", index),
+        Route("/tts-stats", stats),
+        Route("/http-stats", http_stats),
+        Route("/search-stats", search_stats),
+        Route("/turn-stats", turns),
+        Route("/prompt-stats", prompt_stats),
+        Route("/metrics", metrics),
+        Route("/traces", traces),
+        Route("/chat-stream", chat_stream, methods=["POST"]),
+    ], lifespan=lifespan)
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5565))
@@ -710,4 +845,8 @@ if __name__ == "__main__":
     print("EMILIA AI - Krikšto tėtis")
     print(f"http://localhost:{port}")
     print("=" * 50)
-    app.run(host="0.0.0.0", port=port, threaded=True)
+    if os.getenv("SERVE_MODE") == "asgi":
+        import uvicorn
+        uvicorn.run(create_asgi_app(), host="0.0.0.0", port=port)
+    else:
+        app.run(host="0.0.0.0", port=port, threaded=True)
@@ -1,47 +1,42 @@
 #!/usr/bin/env python3
-import os, json, asyncio, requests, edge_tts, base64, re
+import os, re
 from flask import Flask, render_template_string, request, jsonify, Response
 from dotenv import load_dotenv
 from datetime import datetime
-from pathlib import Path
+from chat_stream import Turn, stream_turn, astream_turn, pick_format, turn_stats, client_gone
+from turn_trace import Trace, METRICS_MIMETYPE, metrics_text, recent
+import http_client
+from http_client import UpstreamError, astream_chat, iter_sse, lifespan
+from tts_worker import get_worker
+from chat_log import open_log
+from prompt_prefix import build_prompt, prefix_stats
+from context_window import ContextWindow, open_window, llm_summarizer
 
 load_dotenv()
 app = Flask(__name__)
 XAI_API_KEY = os.getenv("XAI_API_KEY")
-XAI_API_URL = "https://api.x.ai/v1/chat/completions"
+XAI_API_URL = os.getenv("XAI_API_URL", "https://api.x.ai/v1/chat/completions")
 VOICE = "ru-RU-SvetlanaNeural"
-HISTORY_FILE = Path("conversation_history.json")
+HISTORY = open_log("conversation_history.jsonl", legacy_path="conversation_history.json")
 
-# Load conversation from file on startup
+# Load conversation from file on startup: recent messages within the token
+# budget, older ones folded into a summary
 def load_conversation():
+    summarize = llm_summarizer(XAI_API_URL, XAI_API_KEY, lambda msgs: grok_request(msgs))
     try:
-        if HISTORY_FILE.exists():
-            history = json.loads(HISTORY_FILE.read_text(encoding="utf-8"))
-            # Convert to API format, keep last 20 messages
-            conv = [{"role": m["role"], "content": m["content"]} for m in history[-20:]]
-            print(f"[MEMORY] Loaded {len(conv)} messages from history")
-            return conv
+        conv = open_window(HISTORY, summarize)
+        print(f"[MEMORY] Loaded {conv.stats()['messages']} messages from history")
+        return conv
     except Exception as e:
         print(f"[MEMORY ERR] {e}")
-    return []
+    return ContextWindow(summarize)
 
 conversation = load_conversation()
 
 def save_message(role, content):
-    """Save message to history file"""
+    """Append message to history log (compacted to the last 500)"""
     try:
-        history = []
-        if HISTORY_FILE.exists():
-            history = json.loads(HISTORY_FILE.read_text(encoding="utf-8"))
-        history.append({
-            "timestamp": datetime.now().isoformat(),
-            "role": role,
-            "content": content
-        })
-        # Keep last 500 messages
-        if len(history) > 500:
-            history = history[-500:]
-        HISTORY_FILE.write_text(json.dumps(history, ensure_ascii=False, indent=2), encoding="utf-8")
+        HISTORY.append(role, content)
     except Exception as e:
         print(f"[SAVE ERR] {e}")
 
@@ -52,44 +47,49 @@ def clean_tts(text):
     text = re.sub(r"[\U0001F300-\U0001F9FF\U00002600-\U000027BF\U0001FA00-\U0001FAFF]", "", text)
     return text.strip()
 
+def submit_tts(text):
+    return get_worker().submit(text, VOICE)
+
 def gen_tts(text):
-    async def _g():
-        c = edge_tts.Communicate(text, VOICE)
-        d = b""
-        async for ch in c.stream():
-            if ch["type"] == "audio": d += ch["data"]
-        return d
-    return asyncio.run(_g())
+    return submit_tts(text).result()
+
+def grok_request(msgs):
+    return {
+        "model": "grok-3-mini-fast",
+        "messages": msgs,
+        "max_tokens": 800,
+        "temperature": 0.7,
+        "reasoning_effort": "low",
+        "stream": True
+    }
 
 def stream_grok(msgs):
     if not XAI_API_KEY:
         yield "[NO KEY]"
         return
     try:
-        request_body = {
-            "model": "grok-3-mini-fast",
-            "messages": msgs,
-            "max_tokens": 800,
-            "temperature": 0.7,
-            "reasoning_effort": "low",
-            "stream": True
-        }
-        r = requests.post(XAI_API_URL, headers={"Authorization": f"Bearer {XAI_API_KEY}", "Content-Type": "application/json"},
-            json=request_body, stream=True, timeout=60)
+        r = http_client.post(XAI_API_URL, XAI_API_KEY, grok_request(msgs), stream=True, timeout=60)
         print(f"[API] Status: {r.status_code}")
         if r.status_code != 200:
+            r.close()
             yield f"[ERR {r.status_code}]"
             return
-        for ln in r.iter_lines():
-            if ln:
-                ln = ln.decode("utf-8")
-                if ln.startswith("data: "):
-                    d = ln[6:]
-                    if d == "[DONE]": break
-                    try:
-                        cnt = json.loads(d).get("choices", [{}])[0].get("delta", {}).get("content", "")
-                        if cnt: yield cnt
-                    except: pass
+        for cnt in iter_sse(r):
+            yield cnt
+    except Exception as e:
+        print(f"[ERROR] {e}")
+        yield f"[ERR]"
+
+async def astream_grok(msgs):
+    if not XAI_API_KEY:
+        yield "[NO KEY]"
+        return
+    try:
+        async for cnt in astream_chat(XAI_API_URL, XAI_API_KEY, grok_request(msgs)):
+            yield cnt
+    except UpstreamError as e:
+        print(f"[API] Status: {e.status}")
+        yield f"[ERR {e.status}]"
     except Exception as e:
         print(f"[ERROR] {e}")
         yield f"[ERR]"
@@ -258,16 +258,96 @@ function toggleAuto(){
     }
 }
 
-// AUDIO QUEUE - FIXED
-function addAudio(base64){
-    log("Audio queued ("+Math.round(base64.length/1024)+"KB)");
-    audioQueue.push(base64);
+// AUDIO QUEUE - FIXED (entries are data: or blob: URLs)
+function addAudio(src,size){
+    log("Audio queued ("+Math.round(size/1024)+"KB)");
+    audioQueue.push(src);
     q.textContent="Queue: "+audioQueue.length;
     if(!isPlaying){
         playNext();
     }
 }
 
+const chunkAudio=!!(window.MediaSource&&MediaSource.isTypeSupported("audio/mpeg"));
+
+function streamPlayer(au,onEnded){
+    // One MediaSource per answer; chunks arrive in sentence order, so just append
+    const ms=new MediaSource();
+    const url=URL.createObjectURL(ms);
+    const pending=[];
+    let sb=null,closed=false;
+    const pump=function(){
+        if(!sb||sb.updating) return;
+        if(pending.length) sb.appendBuffer(pending.shift());
+        else if(closed&&ms.readyState==="open") ms.endOfStream();
+    };
+    ms.addEventListener("sourceopen",function(){
+        sb=ms.addSourceBuffer("audio/mpeg");
+        sb.mode="sequence";
+        sb.addEventListener("updateend",pump);
+        pump();
+    });
+    au.src=url;
+    au.onended=function(){
+        log("Audio ended");
+        URL.revokeObjectURL(url);
+        onEnded();
+    };
+    au.onerror=au.onended;
+    return {
+        push:function(bytes){ pending.push(bytes); pump(); },
+        end:function(){ closed=true; pump(); }
+    };
+}
+
+function sseReader(onText,onAudio,onChunk){
+    const decoder=new TextDecoder();
+    let sseBuffer="";
+    return function(chunk){
+        sseBuffer+=decoder.decode(chunk,{stream:true});
+        const parts=sseBuffer.split(/\\r?\\n/);
+        sseBuffer=parts.pop()||"";
+
+        for(const line of parts){
+            if(line.startsWith("data: ")){
+                const data=line.slice(6).trim();
+                if(data=="[DONE]"||!data) continue;
+
+                try{
+                    const parsed=JSON.parse(data);
+                    if(parsed.type=="text"&&parsed.content) onText(parsed.content);
+                    if(parsed.type=="audio"&&parsed.audio) onAudio(parsed.audio);
+                    if(parsed.type=="audio_chunk"&&parsed.audio) onChunk(Uint8Array.from(atob(parsed.audio),(c)=>c.charCodeAt(0)));
+                }catch(e){log("JSON err",true);}
+            }
+        }
+    };
+}
+
+function frameReader(onText,onAudio,onChunk){
+    // [1 byte type][4 byte big-endian length][payload]
+    // 1=text 2=audio 3=done 4=audio chunk ([4 byte seq]+mp3) 5=sentence end
+    const decoder=new TextDecoder();
+    let buf=new Uint8Array(0);
+    return function(chunk){
+        const b=new Uint8Array(buf.length+chunk.length);
+        b.set(buf);
+        b.set(chunk,buf.length);
+        buf=b;
+        let off=0;
+        while(buf.length-off>=5){
+            const len=new DataView(buf.buffer,off+1,4).getUint32(0);
+            if(buf.length-off-5<len) break;
+            const payload=buf.subarray(off+5,off+5+len);
+            if(buf[off]===1) onText(decoder.decode(payload));
+            else if(buf[off]===2) onAudio(new Blob([payload],{type:"audio/mpeg"}));
+            else if(buf[off]===4) onChunk(payload.slice(4));
+            off+=5+len;
+        }
+        buf=buf.slice(off);
+    };
+}
+
 function playNext(){
     if(audioQueue.length===0){
         isPlaying=false;
@@ -290,19 +370,24 @@ function playNext(){
     st.textContent="Speaking...";
     st.className="speak";
 
-    const audioData=audioQueue.shift();
+    const src=audioQueue.shift();
     q.textContent="Queue: "+audioQueue.length;
+    const release=function(){
+        if(src.startsWith("blob:")) URL.revokeObjectURL(src);
+    };
 
     log("Playing audio...");
-    au.src="data:audio/mp3;base64,"+audioData;
+    au.src=src;
 
     au.onended=function(){
         log("Audio ended");
+        release();
         playNext();
     };
 
     au.onerror=function(e){
         log("Audio error: "+e.type,true);
+        release();
         playNext();
     };
 
@@ -350,8 +435,8 @@ async function sendMessage(text){
     try{
         const response=await fetch("/chat-stream",{
             method:"POST",
-            headers:{"Content-Type":"application/json"},
-            body:JSON.stringify({message:text}),
+            headers:{"Content-Type":"application/json","Accept":"application/x-chat-frames, text/event-stream"},
+            body:JSON.stringify({message:text,audio_chunks:chunkAudio}),
             signal:abortController.signal
         });
 
@@ -364,37 +449,38 @@ async function sendMessage(text){
         }
 
         const reader=response.body.getReader();
-        const decoder=new TextDecoder();
         let fullText="";
-        let sseBuffer="";
+        const onText=function(t){
+            fullText+=t;
+            gm.querySelector(".c").textContent=fullText;
+        };
+        // Chunked audio starts playing while the first sentence is synthesized
+        let player=null;
+        const onChunk=function(bytes){
+            if(!player){
+                log("Streaming audio");
+                player=streamPlayer(au,playNext);
+                isPlaying=true;
+                stopListen();
+                st.textContent="Speaking...";
+                st.className="speak";
+                au.play().catch((e)=>{ log("Play failed: "+e.message,true); });
+            }
+            player.push(bytes);
+        };
+        const frames=(response.headers.get("Content-Type")||"").includes("x-chat-frames");
+        log(frames?"Binary frames":"SSE");
+        const feed=frames
+            ?frameReader(onText,function(b){ addAudio(URL.createObjectURL(b),b.size); },onChunk)
+            :sseReader(onText,function(a){ addAudio("data:audio/mp3;base64,"+a,a.length*3/4); },onChunk);
 
         while(true){
             const{done,value}=await reader.read();
             if(done) break;
-
-            sseBuffer+=decoder.decode(value,{stream:true});
-            const parts=sseBuffer.split(/\\r?\\n/);
-            sseBuffer=parts.pop()||"";
-
-            for(const line of parts){
-                if(line.startsWith("data: ")){
-                    const data=line.slice(6).trim();
-                    if(data=="[DONE]"||!data) continue;
-
-                    try{
-                        const parsed=JSON.parse(data);
-                        if(parsed.type=="text"&&parsed.content){
-                            fullText+=parsed.content;
-                            gm.querySelector(".c").textContent=fullText;
-                        }
-                        if(parsed.type=="audio"&&parsed.audio){
-                            addAudio(parsed.audio);
-                        }
-                    }catch(e){log("JSON err",true);}
-                }
-            }
+            feed(value);
         }
 
+        if(player) player.end();
         log("Stream done, text: "+fullText.length+" chars");
 
     }catch(e){
@@ -427,21 +513,27 @@ st.textContent="Click mic to start";
 @app.route("/")
 def idx(): return render_template_string(HTML)
 
-@app.route("/chat-stream", methods=["POST"])
-def chat():
-    global conversation
-    msg = request.json.get("message", "")
-    print(f"[CHAT] {msg}")
-    if not msg: return jsonify({"error": "empty"})
+@app.route("/tts-stats")
+def tts_stats(): return jsonify(get_worker().stats())
 
-    # Save user message
-    save_message("user", msg)
-    conversation.append({"role": "user", "content": msg})
-    if len(conversation) > 20: conversation = conversation[-20:]
+@app.route("/http-stats")
+def http_stats(): return jsonify(http_client.metrics.stats())
 
-    today = datetime.now().strftime("%Y-%m-%d %H:%M")
-    system_prompt = f"""You are Grok, a smart voice assistant with MEMORY.
-Current date and time: {today}
+@app.route("/turn-stats")
+def turn_stats_route(): return jsonify(turn_stats.stats())
+
+@app.route("/prompt-stats")
+def prompt_stats_route(): return jsonify(prefix_stats.stats())
+
+@app.route("/metrics")
+def prometheus_metrics(): return Response(metrics_text(), content_type=METRICS_MIMETYPE)
+
+@app.route("/traces")
+def traces(): return jsonify(recent(request.args.get("n", 20, type=int)))
+
+# Static system prompt: byte-identical on every request, so the upstream can
+# reuse its prompt cache (the time goes in a last system message)
+SYSTEM_PROMPT = """You are Grok, a smart voice assistant with MEMORY.
 
 IMPORTANT: You HAVE conversation memory! The previous messages in this chat are your memory.
 If user asks about previous topics - refer to the chat history, you remember everything!
@@ -457,39 +549,102 @@ STRICT RULES:
 - Don't over-explain simple things!
 - Be concise, friendly and natural"""
 
-    msgs = [{"role": "system", "content": system_prompt}] + conversation
-    def gen():
-        full, buf = "", ""
-        for tok in stream_grok(msgs):
-            full += tok
-            buf += tok
-            yield f'data: {json.dumps({"type": "text", "content": tok})}\n\n'
-            # Split ONLY at sentence endings or comma - never mid-word!
-            if re.search(r"[.!?,:;]\s*$", buf) and len(buf) > 20:
-                s = clean_tts(buf)
-                if s:
-                    print(f"[TTS] {s[:50]}")
-                    try:
-                        ad = gen_tts(s)
-                        yield f'data: {json.dumps({"type": "audio", "audio": base64.b64encode(ad).decode()})}\n\n'
-                    except Exception as e: print(f"[TTS ERR] {e}")
-                buf = ""
-        if buf:
-            s = clean_tts(buf)
-            if s:
-                try:
-                    ad = gen_tts(s)
-                    yield f'data: {json.dumps({"type": "audio", "audio": base64.b64encode(ad).decode()})}\n\n'
-                except: pass
+def prepare_turn(msg):
+    # Save user message
+    save_message("user", msg)
+    conversation.append("user", msg)
+
+    today = datetime.now().strftime("%Y-%m-%d %H:%M")
+    msgs = build_prompt("grok", conversation, SYSTEM_PROMPT, f"Current date and time: {today}")
+
+    def sentence(buf):
+        s = clean_tts(buf)
+        if s:
+            print(f"[TTS] {s[:50]}")
+            return (s,)
+
+    def finish(full):
         # Save assistant response
         save_message("assistant", full)
-        conversation.append({"role": "assistant", "content": full})
-        yield "data: [DONE]\n\n"
-    return Response(gen(), mimetype="text/event-stream")
+        conversation.append("assistant", full)
+        conversation.update()
+
+    # Split ONLY at sentence endings or comma - never mid-word!
+    return Turn(lambda _: msgs, sentence, finish, min_len=20, clauses=True)
+
+@app.route("/chat-stream", methods=["POST"])
+def chat():
+    trace = Trace("grok")
+    data = request.json
+    msg = data.get("message", "")
+    print(f"[CHAT] {msg}")
+    if not msg: return jsonify({"error": "empty"})
+    turn = prepare_turn(msg)
+    turn.trace = trace
+    turn.checks.append(client_gone(request.environ))
+    turn.audio_chunks = bool(data.get("audio_chunks"))
+    fmt = pick_format(request.headers.get("Accept"))
+    return Response(stream_turn(turn, stream_grok, submit_tts, fmt), mimetype=fmt.mimetype)
+
+def create_asgi_app():
+    """ASGI mode: uvicorn --factory grok_stream:create_asgi_app (or SERVE_MODE=asgi)"""
+    from starlette.applications import Starlette
+    from starlette.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+    from starlette.routing import Route
+
+    async def index(request):
+        return HTMLResponse(HTML)
+
+    async def stats(request):
+        return JSONResponse(get_worker().stats())
+
+    async def http_stats(request):
+        return JSONResponse(http_client.metrics.stats())
+
+    async def turns(request):
+        return JSONResponse(turn_stats.stats())
+
+    async def prompt_stats(request):
+        return JSONResponse(prefix_stats.stats())
+
+    async def metrics(request):
+        return Response(metrics_text(), media_type=METRICS_MIMETYPE)
+
+    async def traces(request):
+        return JSONResponse(recent(int(request.query_params.get("n", 20))))
+
+    async def chat_stream(request):
+        trace = Trace("grok")
+        data = await request.json()
+        msg = data.get("message", "")
+        print(f"[CHAT] {msg}")
+        if not msg: return JSONResponse({"error": "empty"})
+        turn = prepare_turn(msg)
+        turn.trace = trace
+        turn.audio_chunks = bool(data.get("audio_chunks"))
+        fmt = pick_format(request.headers.get("accept"))
+        return StreamingResponse(astream_turn(turn, astream_grok, submit_tts, fmt),
+                                 media_type=fmt.mimetype)
+
+    return Starlette(routes=[
+        Route("/", index),
+        Route("/tts-stats", stats),
+        Route("/http-stats", http_stats),
+        Route("/turn-stats", turns),
+        Route("/prompt-stats", prompt_stats),
+        Route("/metrics", metrics),
+        Route("/traces", traces),
+        Route("/chat-stream", chat_stream, methods=["POST"]),
+    ], lifespan=lifespan)
 
 if __name__ == "__main__":
+    port = int(os.getenv("PORT", 5556))
     print("="*40)
     print("GROK STREAM")
-    print("http://localhost:5556")
+    print(f"http://localhost:{port}")
     print("="*40)
-    app.run(host="0.0.0.0", port=5556, threaded=True)
+    if os.getenv("SERVE_MODE") == "asgi":
+        import uvicorn
+        uvicorn.run(create_asgi_app(), host="0.0.0.0", port=port)
+    else:
+        app.run(host="0.0.0.0", port=port, threaded=True)
@@ -3,21 +3,37 @@
 Personal AI Assistant - Multi-user architecture
 Each user gets their own URL, voice, personality, and conversation history
 """
-import os, json, asyncio, requests, edge_tts, base64, re
+import os, json, asyncio, re, threading
 from flask import Flask, render_template_string, request, jsonify, Response
 from dotenv import load_dotenv
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from pathlib import Path
+from chat_stream import (Turn, UserTurns, stream_turn, astream_turn, start_search, pick_format,
+                         turn_stats, client_gone)
+from turn_trace import Trace, METRICS_MIMETYPE, metrics_text, recent
+import http_client
+from http_client import UpstreamError, astream_chat, apost_json, iter_sse, lifespan
+from tts_worker import get_worker
+from chat_log import open_log
+from prompt_prefix import build_prompt, prefix_stats
+from context_window import ContextWindow, llm_summarizer
+from conversation_store import SharedConversation, get_store
+from search_cache import search_cache
+from lang_detect import detect_language
 
 load_dotenv()
 app = Flask(__name__)
 
 # API Keys
 XAI_API_KEY = os.getenv("XAI_API_KEY")
-XAI_API_URL = "https://api.x.ai/v1/chat/completions"
+XAI_API_URL = os.getenv("XAI_API_URL", "https://api.x.ai/v1/chat/completions")
 PPLX_API_KEY = os.getenv("PPLX_API_KEY")
-PPLX_API_URL = "https://api.perplexity.ai/chat/completions"
+PPLX_API_URL = os.getenv("PPLX_API_URL", "https://api.perplexity.ai/chat/completions")
+
+# Pre-fork worker processes (gunicorn, or uvicorn in ASGI mode); 1 = single process
+WORKERS = int(os.getenv("WORKERS", 1))
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", 16))
 
 # Load profiles
 PROFILES_FILE = Path("profiles.json")
@@ -26,77 +42,67 @@ if PROFILES_FILE.exists():
     PROFILES = json.loads(PROFILES_FILE.read_text(encoding="utf-8"))
     print(f"[PROFILES] Loaded {len(PROFILES)} profiles")
 
-# Conversation storage per user
+# Spoken while an internet search is still running
+ACK_PHRASES = {
+    "lt": "Tuoj patikrinsiu.",
+    "en": "Let me check.",
+    "ru": "Сейчас посмотрю."
+}
+
+# One answer in flight per user, across all workers: a new request cancels the
+# previous one (the page aborts it, but the server would keep generating)
+user_turns = UserTurns(shared=get_store)
+
+def begin_turn(user_id, turn, msg):
+    """Cancel the user's previous turn, then record the new message"""
+    user_turns.start(user_id, turn)
+    save_message(user_id, "user", msg)
+
+async def abegin_turn(user_id, turn, msg):
+    await user_turns.astart(user_id, turn)
+    await asyncio.to_thread(save_message, user_id, "user", msg)
+
+# Conversation memory per user in this process, kept in step with the
+# shared store (conversation_store) that all worker processes write to
 CONVERSATIONS = {}
+conversations_lock = threading.Lock()
 
-def get_history_file(user_id):
-    return Path(f"history_{user_id}.json")
+def get_history(user_id):
+    """Pre-store JSONL history, imported into the store on first use"""
+    return open_log(f"history_{user_id}.jsonl", legacy_path=f"history_{user_id}.json")
 
 def load_conversation(user_id):
-    """Load conversation history for specific user"""
+    """Token-budgeted memory for specific user (older turns summarized)"""
+    summarize = llm_summarizer(XAI_API_URL, XAI_API_KEY, lambda msgs: grok_request(msgs))
     try:
-        history_file = get_history_file(user_id)
-        if history_file.exists():
-            history = json.loads(history_file.read_text(encoding="utf-8"))
-            conv = [{"role": m["role"], "content": m["content"]} for m in history[-20:]]
-            print(f"[{user_id}] Loaded {len(conv)} messages")
-            return conv
+        store = get_store()
+        with store.lock(user_id):
+            if not store.last_id(user_id) and any(Path(f"history_{user_id}{ext}").exists()
+                                                  for ext in (".jsonl", ".json")):
+                log = get_history(user_id)
+                store.import_log(user_id, log, Path(log.path).with_suffix(".summary.json"))
+        conv = SharedConversation(store, user_id, summarize)
+        print(f"[{user_id}] Loaded {conv.stats()['messages']} messages")
+        return conv
     except Exception as e:
         print(f"[{user_id}] Memory error: {e}")
-    return []
+    return ContextWindow(summarize)
+
+def get_conversation(user_id):
+    """The user's memory in this process, loaded on first use (once, however
+    many requests race for it)"""
+    with conversations_lock:
+        if user_id not in CONVERSATIONS:
+            CONVERSATIONS[user_id] = load_conversation(user_id)
+        return CONVERSATIONS[user_id]
 
 def save_message(user_id, role, content):
-    """Save message to user's history"""
+    """Save message to user's history and memory"""
     try:
-        history_file = get_history_file(user_id)
-        history = []
-        if history_file.exists():
-            history = json.loads(history_file.read_text(encoding="utf-8"))
-        history.append({
-            "timestamp": datetime.now().isoformat(),
-            "role": role,
-            "content": content
-        })
-        if len(history) > 500:
-            history = history[-500:]
-        history_file.write_text(json.dumps(history, ensure_ascii=False, indent=2), encoding="utf-8")
+        get_conversation(user_id).append(role, content)
     except Exception as e:
         print(f"[{user_id}] Save error: {e}")
 
-def detect_language(text):
-    """Detect if text is Lithuanian, English, or Russian"""
-    text_lower = text.lower()
-
-    # Lithuanian specific characters and words
-    lt_chars = ['ą', 'č', 'ę', 'ė', 'į', 'š', 'ų', 'ū', 'ž']
-    lt_words = ['labas', 'kaip', 'ačiū', 'prašau', 'gerai', 'taip', 'ne', 'kas', 'kur',
-                'kodėl', 'kada', 'man', 'tau', 'jis', 'ji', 'mes', 'jūs', 'aš', 'tu',
-                'noriu', 'galiu', 'reikia', 'žinau', 'suprantu', 'klausyk', 'pasakyk',
-                # Common words without diacritics
-                'kokios', 'kokia', 'koks', 'kokie', 'naujienos', 'dabar', 'siandien',
-                'vakar', 'rytoj', 'yra', 'esi', 'esu', 'esame', 'ar', 'bet', 'ir', 'tai',
-                'tik', 'cia', 'ten', 'kiek', 'del', 'nuo', 'iki', 'apie', 'prie', 'po',
-                'sveiki', 'sveikas', 'sveika', 'laba', 'labai', 'gera', 'geras', 'gali',
-                'nori', 'turi', 'matau', 'zinai', 'sakyk', 'klausiu', 'atsakyk']
-
-    # Russian specific
-    ru_chars = ['а', 'б', 'в', 'г', 'д', 'е', 'ё', 'ж', 'з', 'и', 'й', 'к', 'л', 'м',
-                'н', 'о', 'п', 'р', 'с', 'т', 'у', 'ф', 'х', 'ц', 'ч', 'ш', 'щ', 'ъ',
-                'ы', 'ь', 'э', 'ю', 'я']
-
-    # Check for Cyrillic (Russian)
-    if any(c in text_lower for c in ru_chars):
-        return "ru"
-
-    # Check for Lithuanian
-    if any(c in text_lower for c in lt_chars):
-        return "lt"
-    if any(word in text_lower.split() for word in lt_words):
-        return "lt"
-
-    # Default to English
-    return "en"
-
 def get_voice(profile, language):
     """Get appropriate voice for language"""
     voice_key = f"voice_{language}"
@@ -108,45 +114,57 @@ def clean_tts(text):
     text = re.sub(r"[\U0001F300-\U0001F9FF\U00002600-\U000027BF\U0001FA00-\U0001FAFF]", "", text)
     return text.strip()
 
+def submit_tts(text, voice):
+    """Queue TTS audio with specified voice on the shared worker"""
+    return get_worker().submit(text, voice, rate="+5%", volume="+50%")
+
 def gen_tts(text, voice):
     """Generate TTS audio with specified voice"""
-    async def _g():
-        c = edge_tts.Communicate(text, voice, rate="+5%", volume="+50%")
-        d = b""
-        async for ch in c.stream():
-            if ch["type"] == "audio":
-                d += ch["data"]
-        return d
-    return asyncio.run(_g())
-
-def search_perplexity(query):
+    return submit_tts(text, voice).result()
+
+def pplx_request(query):
+    return {
+        "model": "sonar",
+        "messages": [
+            {"role": "system", "content": "Find current information. Be brief, facts only."},
+            {"role": "user", "content": query}
+        ],
+        "max_tokens": 500,
+        "temperature": 0.2
+    }
+
+def fetch_perplexity(query):
     """Search current info via Perplexity"""
     if not PPLX_API_KEY:
         return None
     try:
         print(f"[PPLX] Searching: {query[:50]}...")
-        r = requests.post(PPLX_API_URL,
-            headers={
-                "Authorization": f"Bearer {PPLX_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "sonar",
-                "messages": [
-                    {"role": "system", "content": "Find current information. Be brief, facts only."},
-                    {"role": "user", "content": query}
-                ],
-                "max_tokens": 500,
-                "temperature": 0.2
-            },
-            timeout=30
-        )
+        r = http_client.post(PPLX_API_URL, PPLX_API_KEY, pplx_request(query), timeout=30)
         if r.status_code == 200:
             return r.json().get("choices", [{}])[0].get("message", {}).get("content", "")
     except Exception as e:
         print(f"[PPLX ERROR] {e}")
     return None
 
+async def afetch_perplexity(query):
+    """Search current info via Perplexity (ASGI mode, pooled client)"""
+    if not PPLX_API_KEY:
+        return None
+    try:
+        print(f"[PPLX] Searching: {query[:50]}...")
+        data = await apost_json(PPLX_API_URL, PPLX_API_KEY, pplx_request(query), timeout=30)
+        return data.get("choices", [{}])[0].get("message", {}).get("content", "")
+    except Exception as e:
+        print(f"[PPLX ERROR] {e}")
+    return None
+
+def search_perplexity(query):
+    """Cached search; identical queries in flight share one upstream call"""
+    return search_cache.get_or_fetch(query, fetch_perplexity, lang=detect_language(query))
+
+async def asearch_perplexity(query):
+    return await search_cache.aget_or_fetch(query, afetch_perplexity, lang=detect_language(query))
+
 def needs_search(text):
     """Check if query needs internet search"""
     keywords = [
@@ -161,42 +179,44 @@ def needs_search(text):
     ]
     return any(kw in text.lower() for kw in keywords)
 
+def grok_request(msgs):
+    return {
+        "model": "grok-3-mini-fast",
+        "messages": msgs,
+        "max_tokens": 800,
+        "temperature": 0.7,
+        "reasoning_effort": "low",
+        "stream": True
+    }
+
 def stream_grok(msgs):
     """Stream response from Grok"""
     if not XAI_API_KEY:
         yield "[NO API KEY]"
         return
     try:
-        r = requests.post(XAI_API_URL,
-            headers={"Authorization": f"Bearer {XAI_API_KEY}", "Content-Type": "application/json"},
-            json={
-                "model": "grok-3-mini-fast",
-                "messages": msgs,
-                "max_tokens": 800,
-                "temperature": 0.7,
-                "reasoning_effort": "low",
-                "stream": True
-            },
-            stream=True, timeout=60)
-
+        r = http_client.post(XAI_API_URL, XAI_API_KEY, grok_request(msgs), stream=True, timeout=60)
         if r.status_code != 200:
             print(f"[API ERROR] {r.status_code}: {r.text[:200]}")
             yield f"[Error {r.status_code}]"
             return
+        for cnt in iter_sse(r):
+            yield cnt
+    except Exception as e:
+        print(f"[ERROR] {e}")
+        yield "[Connection error]"
 
-        for ln in r.iter_lines():
-            if ln:
-                ln = ln.decode("utf-8")
-                if ln.startswith("data: "):
-                    d = ln[6:]
-                    if d == "[DONE]":
-                        break
-                    try:
-                        cnt = json.loads(d).get("choices", [{}])[0].get("delta", {}).get("content", "")
-                        if cnt:
-                            yield cnt
-                    except:
-                        pass
+async def astream_grok(msgs):
+    """Stream response from Grok (ASGI mode, pooled client)"""
+    if not XAI_API_KEY:
+        yield "[NO API KEY]"
+        return
+    try:
+        async for cnt in astream_chat(XAI_API_URL, XAI_API_KEY, grok_request(msgs)):
+            yield cnt
+    except UpstreamError as e:
+        print(f"[API ERROR] {e}")
+        yield f"[Error {e.status}]"
     except Exception as e:
         print(f"[ERROR] {e}")
         yield "[Connection error]"
@@ -414,45 +434,48 @@ async function sendMessage(text){{
     try{{
         const response=await fetch('{chat_url}',{{
             method:'POST',
-            headers:{{'Content-Type':'application/json'}},
-            body:JSON.stringify({{message:text}})
+            headers:{{'Content-Type':'application/json','Accept':'application/x-chat-frames, text/event-stream'}},
+            body:JSON.stringify({{message:text,audio_chunks:chunkAudio}})
         }});
 
         if(!response.ok) throw new Error('HTTP '+response.status);
 
         const reader=response.body.getReader();
-        const decoder=new TextDecoder();
         let fullText='';
-        let buffer='';
+        const onText=(t)=>{{
+            fullText+=t;
+            gm.querySelector('.txt').textContent=fullText;
+            chat.scrollTop=chat.scrollHeight;
+        }};
+        // Chunked audio starts playing while the first sentence is synthesized
+        let player=null;
+        const onChunk=(bytes)=>{{
+            if(!player){{
+                player=streamPlayer(au,playNext);
+                isPlaying=true;
+                st.textContent='Kalbu...';
+                st.className='speak';
+                au.play().catch((e)=>{{
+                    playBtn.style.display='block';
+                    st.textContent='Paspausk paleisti';
+                }});
+            }}
+            player.push(bytes);
+        }};
+        // Binary frames when the server supports them, SSE otherwise
+        const feed=(response.headers.get('Content-Type')||'').includes('x-chat-frames')
+            ?frameReader(onText,(b)=>audioQueue.push(URL.createObjectURL(b)),onChunk)
+            :sseReader(onText,(a)=>audioQueue.push('data:audio/mp3;base64,'+a),onChunk);
 
         while(true){{
             const{{done,value}}=await reader.read();
             if(done) break;
-
-            buffer+=decoder.decode(value,{{stream:true}});
-            const lines=buffer.split('\\n');
-            buffer=lines.pop()||'';
-
-            for(const line of lines){{
-                if(line.startsWith('data: ')){{
-                    const data=line.slice(6).trim();
-                    if(data==='[DONE]'||!data) continue;
-                    try{{
-                        const p=JSON.parse(data);
-                        if(p.type==='text'&&p.content){{
-                            fullText+=p.content;
-                            gm.querySelector('.txt').textContent=fullText;
-                            chat.scrollTop=chat.scrollHeight;
-                        }}
-                        if(p.type==='audio'&&p.audio){{
-                            audioQueue.push(p.audio);
-                        }}
-                    }}catch(e){{}}
-                }}
-            }}
+            feed(value);
         }}
 
-        if(audioQueue.length>0){{
+        if(player){{
+            player.end();
+        }}else if(audioQueue.length>0){{
             st.textContent='Kalbu...';
             st.className='speak';
             playNext();
@@ -470,6 +493,81 @@ async function sendMessage(text){{
     }}
 }}
 
+const chunkAudio=!!(window.MediaSource&&MediaSource.isTypeSupported('audio/mpeg'));
+
+function streamPlayer(au,onEnded){{
+    // One MediaSource per answer; chunks arrive in sentence order, so just append
+    const ms=new MediaSource();
+    const url=URL.createObjectURL(ms);
+    const pending=[];
+    let sb=null,closed=false;
+    const pump=()=>{{
+        if(!sb||sb.updating) return;
+        if(pending.length) sb.appendBuffer(pending.shift());
+        else if(closed&&ms.readyState==='open') ms.endOfStream();
+    }};
+    ms.addEventListener('sourceopen',()=>{{
+        sb=ms.addSourceBuffer('audio/mpeg');
+        sb.mode='sequence';
+        sb.addEventListener('updateend',pump);
+        pump();
+    }});
+    au.src=url;
+    au.onended=()=>{{ URL.revokeObjectURL(url); onEnded(); }};
+    au.onerror=au.onended;
+    return {{
+        push(bytes){{ pending.push(bytes); pump(); }},
+        end(){{ closed=true; pump(); }}
+    }};
+}}
+
+function sseReader(onText,onAudio,onChunk){{
+    const decoder=new TextDecoder();
+    let buffer='';
+    return function(chunk){{
+        buffer+=decoder.decode(chunk,{{stream:true}});
+        const lines=buffer.split('\\n');
+        buffer=lines.pop()||'';
+
+        for(const line of lines){{
+            if(line.startsWith('data: ')){{
+                const data=line.slice(6).trim();
+                if(data==='[DONE]'||!data) continue;
+                try{{
+                    const p=JSON.parse(data);
+                    if(p.type==='text'&&p.content) onText(p.content);
+                    if(p.type==='audio'&&p.audio) onAudio(p.audio);
+                    if(p.type==='audio_chunk'&&p.audio) onChunk(Uint8Array.from(atob(p.audio),(c)=>c.charCodeAt(0)));
+                }}catch(e){{}}
+            }}
+        }}
+    }};
+}}
+
+function frameReader(onText,onAudio,onChunk){{
+    // [1 byte type][4 byte big-endian length][payload]
+    // 1=text 2=audio 3=done 4=audio chunk ([4 byte seq]+mp3) 5=sentence end
+    const decoder=new TextDecoder();
+    let buf=new Uint8Array(0);
+    return function(chunk){{
+        const b=new Uint8Array(buf.length+chunk.length);
+        b.set(buf);
+        b.set(chunk,buf.length);
+        buf=b;
+        let off=0;
+        while(buf.length-off>=5){{
+            const len=new DataView(buf.buffer,off+1,4).getUint32(0);
+            if(buf.length-off-5<len) break;
+            const payload=buf.subarray(off+5,off+5+len);
+            if(buf[off]===1) onText(decoder.decode(payload));
+            else if(buf[off]===2) onAudio(new Blob([payload],{{type:'audio/mpeg'}}));
+            else if(buf[off]===4) onChunk(payload.slice(4));
+            off+=5+len;
+        }}
+        buf=buf.slice(off);
+    }};
+}}
+
 function playNext(){{
     if(audioQueue.length===0){{
         isPlaying=false;
@@ -480,12 +578,16 @@ function playNext(){{
     }}
 
     isPlaying=true;
-    const audioData=audioQueue.shift();
+    const src=audioQueue.shift();
+    const next=()=>{{
+        if(src.startsWith('blob:')) URL.revokeObjectURL(src);
+        playNext();
+    }};
 
-    au.src='data:audio/mp3;base64,'+audioData;
+    au.src=src;
     au.volume=1.0;
-    au.onended=playNext;
-    au.onerror=(e)=>{{ playNext(); }};
+    au.onended=next;
+    au.onerror=(e)=>{{ next(); }};
 
     au.play().then(()=>{{
     }}).catch((e)=>{{
@@ -504,51 +606,37 @@ function playAudio(){{
 </html>
 """
 
-def create_user_app(user_id, profile):
-    """Create routes for specific user"""
-
-    @app.route(f"/{user_id}")
-    def user_index():
-        return get_html(profile, user_id)
-
-    @app.route(f"/{user_id}/chat-stream", methods=["POST"])
-    def user_chat():
-        global CONVERSATIONS
-
-        if user_id not in CONVERSATIONS:
-            CONVERSATIONS[user_id] = load_conversation(user_id)
+def system_prompt(profile):
+    """Static part of the system prompt: byte-identical for a profile, so the
+    upstream can reuse its prompt cache (time, language and search go last)"""
+    base_prompt = profile.get("system_prompt", "You are a helpful assistant.")
+    return f"""{base_prompt}
 
-        msg = request.json.get("message", "")
-        if not msg:
-            return jsonify({"error": "empty"})
-
-        print(f"[{user_id}] {msg}")
+IMPORTANT:
+- NO emojis! This is voice output
+- Keep answers SHORT (1-3 sentences)
+- Match the user's language"""
 
-        # Detect language
-        lang = detect_language(msg)
-        print(f"[{user_id}] Language: {lang}")
+def prepare_turn(user_id, profile, msg, search=None):
+    """Build the prompt + TTS hooks for one answer; the caller records the
+    user message with begin_turn() once the user's previous turn has stopped.
+    Loads the user's memory on first use: call it from a thread in ASGI mode"""
+    conversation = get_conversation(user_id)
 
-        # Save message
-        save_message(user_id, "user", msg)
-        CONVERSATIONS[user_id].append({"role": "user", "content": msg})
-        if len(CONVERSATIONS[user_id]) > 20:
-            CONVERSATIONS[user_id] = CONVERSATIONS[user_id][-20:]
+    # Detect language
+    lang = detect_language(msg)
+    print(f"[{user_id}] Language: {lang}")
 
-        # Search if needed
+    def build(search_result):
         search_context = ""
-        print(f"[{user_id}] Checking search for: {msg[:50]}")
-        if needs_search(msg):
-            print(f"[{user_id}] SEARCH TRIGGERED!")
-            result = search_perplexity(msg)
-            if result:
-                print(f"[{user_id}] Got search result: {len(result)} chars")
-                search_context = f"\n\nCURRENT INFO FROM INTERNET:\n{result}\n"
-            else:
-                print(f"[{user_id}] No search result")
-
-        # Build system prompt
+        if search_result:
+            print(f"[{user_id}] Got search result: {len(search_result)} chars")
+            search_context = f"\n\nCURRENT INFO FROM INTERNET:\n{search_result}\n"
+        elif search:
+            print(f"[{user_id}] No search result")
+
+        # Per-turn context goes last, after the history, so the prefix stays cacheable
         today = datetime.now(ZoneInfo("Europe/Vilnius")).strftime("%Y-%m-%d %H:%M")
-        base_prompt = profile.get("system_prompt", "You are a helpful assistant.")
 
         # Add English teacher instructions if enabled
         english_mode = ""
@@ -562,55 +650,62 @@ ENGLISH TEACHING MODE:
 - Example: If user says "I go yesterday", respond with something like "Nice try! You mean 'I went yesterday'. So, where did you go?"
 """
 
-        system_prompt = f"""{base_prompt}
-{english_mode}
-{search_context}
-Current time: {today}
+        context = f"""Current time: {today}
 Detected language: {lang}
+{english_mode}{search_context}"""
 
-IMPORTANT:
-- NO emojis! This is voice output
-- Keep answers SHORT (1-3 sentences)
-- Match the user's language
-"""
+        return build_prompt(f"personal:{user_id}", conversation,
+                            system_prompt(profile), context.strip())
+
+    # Get voice for detected language
+    voice = get_voice(profile, lang)
+    print(f"[{user_id}] Using voice: {voice}")
+
+    def sentence(buf):
+        s = clean_tts(buf)
+        if s:
+            return (s, voice)
+
+    def finish(full):
+        save_message(user_id, "assistant", full)
+        conversation.update()
 
-        msgs = [{"role": "system", "content": system_prompt}] + CONVERSATIONS[user_id]
-
-        # Get voice for detected language
-        voice = get_voice(profile, lang)
-        print(f"[{user_id}] Using voice: {voice}")
-
-        def gen():
-            full, buf = "", ""
-            for tok in stream_grok(msgs):
-                full += tok
-                buf += tok
-                yield f'data: {json.dumps({"type": "text", "content": tok})}\n\n'
-
-                if re.search(r"[.!?]\s*$", buf) and len(buf) > 15:
-                    s = clean_tts(buf)
-                    if s:
-                        try:
-                            ad = gen_tts(s, voice)
-                            yield f'data: {json.dumps({"type": "audio", "audio": base64.b64encode(ad).decode()})}\n\n'
-                        except Exception as e:
-                            print(f"[TTS ERROR] {e}")
-                    buf = ""
-
-            if buf:
-                s = clean_tts(buf)
-                if s:
-                    try:
-                        ad = gen_tts(s, voice)
-                        yield f'data: {json.dumps({"type": "audio", "audio": base64.b64encode(ad).decode()})}\n\n'
-                    except Exception as e:
-                        print(f"[TTS ERROR] {e}")
-
-            save_message(user_id, "assistant", full)
-            CONVERSATIONS[user_id].append({"role": "assistant", "content": full})
-            yield "data: [DONE]\n\n"
-
-        return Response(gen(), mimetype="text/event-stream")
+    ack = (ACK_PHRASES.get(lang, ACK_PHRASES["en"]), voice) if search else None
+    return Turn(build, sentence, finish, search=search, ack=ack)
+
+def create_user_app(user_id, profile):
+    """Create routes for specific user"""
+
+    @app.route(f"/{user_id}", endpoint=f"{user_id}_index")
+    def user_index():
+        return get_html(profile, user_id)
+
+    @app.route(f"/{user_id}/chat-stream", methods=["POST"], endpoint=f"{user_id}_chat")
+    def user_chat():
+        trace = Trace("personal", user=user_id)
+        data = request.json
+        msg = data.get("message", "")
+        if not msg:
+            return jsonify({"error": "empty"})
+
+        print(f"[{user_id}] {msg}")
+
+        # Search if needed - runs while the acknowledgement is spoken
+        search = None
+        print(f"[{user_id}] Checking search for: {msg[:50]}")
+        if needs_search(msg):
+            print(f"[{user_id}] SEARCH TRIGGERED!")
+            search = trace.track("search", start_search(search_perplexity, msg))
+
+        turn = prepare_turn(user_id, profile, msg, search)
+        turn.trace = trace
+        turn.checks.append(client_gone(request.environ))
+        turn.audio_chunks = bool(data.get("audio_chunks"))
+        fmt = pick_format(request.headers.get("Accept"))
+        # Claimed once the response is read: a client gone before that leaves no claim behind
+        return Response(stream_turn(turn, stream_grok, submit_tts, fmt,
+                                    begin=lambda: begin_turn(user_id, turn, msg)),
+                        mimetype=fmt.mimetype)
 
     return user_index, user_chat
 
@@ -620,6 +715,41 @@ for user_id, profile in PROFILES.items():
         create_user_app(user_id, profile)
         print(f"[ROUTES] Created /{user_id} for {profile.get('name', user_id)}")
 
+@app.route("/tts-stats")
+def tts_stats():
+    """edge-tts worker timings"""
+    return jsonify(get_worker().stats())
+
+@app.route("/http-stats")
+def http_stats():
+    """Pooled upstream connections: connect time vs time to first byte"""
+    return jsonify(http_client.metrics.stats())
+
+@app.route("/search-stats")
+def search_stats():
+    """Search cache hit ratio and upstream time saved"""
+    return jsonify(search_cache.stats())
+
+@app.route("/turn-stats")
+def turn_stats_route():
+    """Time to first audio and sentence chunking per turn"""
+    return jsonify(turn_stats.stats())
+
+@app.route("/prompt-stats")
+def prompt_stats_route():
+    """How stable the prompt prefix is, for upstream prompt caching"""
+    return jsonify(prefix_stats.stats())
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Latency histograms in Prometheus text format"""
+    return Response(metrics_text(), content_type=METRICS_MIMETYPE)
+
+@app.route("/traces")
+def traces():
+    """Recent per-turn timing traces, newest first"""
+    return jsonify(recent(request.args.get("n", 20, type=int)))
+
 @app.route("/")
 def index():
     """List all available profiles"""
@@ -635,10 +765,119 @@ def index():
     </html>
     """
 
+def create_asgi_app():
+    """ASGI mode: uvicorn --factory app_personal:create_asgi_app (or SERVE_MODE=asgi)"""
+    from starlette.applications import Starlette
+    from starlette.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+    from starlette.routing import Route
+
+    def get_profile(request):
+        user_id = request.path_params["user_id"]
+        if user_id.startswith("_"):
+            return user_id, None
+        return user_id, PROFILES.get(user_id)
+
+    async def home(request):
+        return HTMLResponse(index())
+
+    async def stats(request):
+        return JSONResponse(get_worker().stats())
+
+    async def http_stats(request):
+        return JSONResponse(http_client.metrics.stats())
+
+    async def search_stats(request):
+        return JSONResponse(search_cache.stats())
+
+    async def turns(request):
+        return JSONResponse(turn_stats.stats())
+
+    async def prompt_stats(request):
+        return JSONResponse(prefix_stats.stats())
+
+    async def metrics(request):
+        return Response(metrics_text(), media_type=METRICS_MIMETYPE)
+
+    async def traces(request):
+        return JSONResponse(recent(int(request.query_params.get("n", 20))))
+
+    async def user_index(request):
+        user_id, profile = get_profile(request)
+        if profile is None:
+            return HTMLResponse("Not found", status_code=404)
+        return HTMLResponse(get_html(profile, user_id))
+
+    async def user_chat(request):
+        user_id, profile = get_profile(request)
+        if profile is None:
+            return JSONResponse({"error": "not found"}, status_code=404)
+        trace = Trace("personal", user=user_id)
+        data = await request.json()
+        msg = data.get("message", "")
+        if not msg:
+            return JSONResponse({"error": "empty"})
+
+        print(f"[{user_id}] {msg}")
+
+        search = None
+        if needs_search(msg):
+            print(f"[{user_id}] SEARCH TRIGGERED!")
+            search = trace.track("search", asyncio.ensure_future(asearch_perplexity(msg)))
+
+        turn = await asyncio.to_thread(prepare_turn, user_id, profile, msg, search)
+        turn.trace = trace
+        turn.audio_chunks = bool(data.get("audio_chunks"))
+        fmt = pick_format(request.headers.get("accept"))
+        return StreamingResponse(astream_turn(turn, astream_grok, submit_tts, fmt,
+                                              begin=lambda: abegin_turn(user_id, turn, msg)),
+                                 media_type=fmt.mimetype)
+
+    return Starlette(routes=[
+        Route("/", home),
+        Route("/tts-stats", stats),
+        Route("/http-stats", http_stats),
+        Route("/search-stats", search_stats),
+        Route("/turn-stats", turns),
+        Route("/prompt-stats", prompt_stats),
+        Route("/metrics", metrics),
+        Route("/traces", traces),
+        Route("/{user_id}", user_index),
+        Route("/{user_id}/chat-stream", user_chat, methods=["POST"]),
+    ], lifespan=lifespan)
+
+def serve_prefork(port):
+    """Flask app on gunicorn: WORKERS processes with WORKER_THREADS threads each"""
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in {"bind": f"0.0.0.0:{port}", "workers": WORKERS,
+                               "threads": WORKER_THREADS, "worker_class": "gthread",
+                               "timeout": 120, "accesslog": "-"}.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # Imported in each worker after the fork, so nothing (threads, sockets,
+            # SQLite) is shared with the master
+            from app_personal import app as worker_app
+            return worker_app
+
+    Server().run()
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5560))
     print("=" * 50)
     print("PERSONAL AI ASSISTANT SERVER")
     print(f"http://localhost:{port}")
     print("=" * 50)
-    app.run(host="0.0.0.0", port=port, threaded=True)
+    if os.getenv("SERVE_MODE") == "asgi":
+        import uvicorn
+        if WORKERS > 1:
+            uvicorn.run("app_personal:create_asgi_app", factory=True, host="0.0.0.0", port=port,
+                        workers=WORKERS)
+        else:
+            uvicorn.run(create_asgi_app(), host="0.0.0.0", port=port)
+    elif WORKERS > 1:
+        serve_prefork(port)
+    else:
+        app.run(host="0.0.0.0", port=port, threaded=True)
@@ -0,0 +1,154 @@
+"""
+Append-only JSONL conversation log.
+Each message is one line; appends are O(1) and fsync'd in batches.
+The file is compacted to the last `keep` entries once it grows past
+keep + CHAT_LOG_SLACK lines. load_conversation() reads only the tail.
+"""
+import os, json, threading
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines - in-process lock only
+    fcntl = None
+
+CHAT_LOG_KEEP = int(os.getenv("CHAT_LOG_KEEP", 500))
+CHAT_LOG_SLACK = int(os.getenv("CHAT_LOG_SLACK", 250))
+# fsync after this many appends, or this many seconds after the first unsynced one
+CHAT_LOG_FSYNC_EVERY = int(os.getenv("CHAT_LOG_FSYNC_EVERY", 16))
+CHAT_LOG_FSYNC_SECS = float(os.getenv("CHAT_LOG_FSYNC_SECS", 2.0))
+
+
+class ConversationLog:
+    def __init__(self, path, keep=CHAT_LOG_KEEP, legacy_path=None):
+        self.path = Path(path)
+        self.keep = keep
+        self._lock = threading.RLock()
+        self._unsynced = 0
+        self._timer = None
+        if legacy_path and not self.path.exists() and Path(legacy_path).exists():
+            self._import_legacy(Path(legacy_path))
+        self._f = open(self.path, "a", encoding="utf-8")
+        self._lines = self._count_lines()
+
+    def _import_legacy(self, legacy):
+        """One-time copy of an old pretty-printed history_*.json"""
+        try:
+            history = json.loads(legacy.read_text(encoding="utf-8"))
+            self._write_all(history[-self.keep:])
+            print(f"[LOG] Imported {len(history)} messages from {legacy}")
+        except Exception as e:
+            print(f"[LOG ERR] {legacy}: {e}")
+
+    def _count_lines(self):
+        n = 0
+        with open(self.path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 16), b""):
+                n += block.count(b"\n")
+        return n
+
+    def _flock(self, locked):
+        """Cross-process lock on the open file (other workers append too)"""
+        if fcntl:
+            fcntl.flock(self._f.fileno(), fcntl.LOCK_EX if locked else fcntl.LOCK_UN)
+
+    def _reopen_if_replaced(self):
+        # Another process compacted the file: our handle points at the old inode
+        try:
+            if os.fstat(self._f.fileno()).st_ino == os.stat(self.path).st_ino:
+                return
+        except FileNotFoundError:
+            pass
+        self._flock(False)
+        self._f.close()
+        self._f = open(self.path, "a", encoding="utf-8")
+        self._flock(True)
+        self._lines = self._count_lines()
+
+    def append(self, role, content):
+        entry = {"timestamp": datetime.now().isoformat(), "role": role, "content": content}
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._flock(True)
+            try:
+                self._reopen_if_replaced()
+                self._f.write(line)
+                self._f.flush()
+            finally:
+                self._flock(False)
+            self._lines += 1
+            self._unsynced += 1
+            if self._unsynced >= CHAT_LOG_FSYNC_EVERY:
+                self.sync()
+            elif self._timer is None:
+                self._timer = threading.Timer(CHAT_LOG_FSYNC_SECS, self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+            if self._lines > self.keep + CHAT_LOG_SLACK:
+                self.compact()
+
+    def sync(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._unsynced:
+                os.fsync(self._f.fileno())
+                self._unsynced = 0
+
+    def tail(self, n):
+        """Last n entries, reading backwards from the end of the file"""
+        with self._lock, open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell()
+            data = b""
+            while pos > 0 and data.count(b"\n") <= n:
+                step = min(1 << 14, pos)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step) + data
+        entries = []
+        for ln in data.splitlines()[-n:] if n else []:
+            try:
+                entries.append(json.loads(ln))
+            except ValueError:
+                pass  # partial first line of the window, or a torn write
+        return entries
+
+    def _write_all(self, entries):
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for e in entries:
+                f.write(json.dumps(e, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def compact(self):
+        """Rewrite the file with only the last `keep` entries"""
+        with self._lock:
+            self._flock(True)
+            try:
+                self._reopen_if_replaced()
+                entries = self.tail(self.keep)
+                self._write_all(entries)
+            finally:
+                self._flock(False)
+            self._f.close()
+            self._f = open(self.path, "a", encoding="utf-8")
+            self._lines = len(entries)
+            self._unsynced = 0
+
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def open_log(path, legacy_path=None):
+    """Shared ConversationLog per file"""
+    key = str(path)
+    with _logs_lock:
+        if key not in _logs:
+            _logs[key] = ConversationLog(path, legacy_path=legacy_path)
+        return _logs[key]
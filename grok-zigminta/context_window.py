@@ -0,0 +1,200 @@
+"""
+Token-budgeted conversation memory.
+The prompt is the system prompt, a running summary of older turns and as
+many recent messages as fit in CONTEXT_MAX_TOKENS (estimated, no
+tokenizer). After each turn, once the recent messages pass their share of
+the budget, the oldest ones are folded into the summary in a background
+thread, so the request path never waits for summarization. Until the fold
+lands, build() simply leaves the oldest messages out.
+
+The summary is written by the chat model (llm_summarizer); if that fails
+it falls back to a clipped transcript of the folded messages.
+"""
+import os, json, threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import http_client
+
+# Ceiling for system prompt + summary + recent messages
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", 2000))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", 250))
+# Messages read back from the history log on startup
+CONTEXT_LOAD_MESSAGES = int(os.getenv("CONTEXT_LOAD_MESSAGES", 60))
+# Per-message overhead of the chat format
+MESSAGE_TOKENS = 4
+
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+SUMMARY_PROMPT = ("You maintain the memory of a voice assistant's conversation. Merge the new "
+                  "messages into the summary. Keep names, facts about the user, preferences, "
+                  "decisions and open questions; drop small talk. Write in the language of the "
+                  "conversation, plain text, at most {words} words.")
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary")
+
+
+def estimate_tokens(text):
+    """UTF-8 bytes / 4: close to BPE counts for Latin text, and Cyrillic or
+    diacritics count more, as they do for the tokenizer"""
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+def transcript(messages, clip=None):
+    lines = []
+    for m in messages:
+        text = m["content"] if clip is None or len(m["content"]) <= clip else m["content"][:clip] + "..."
+        lines.append(f"{'User' if m['role'] == 'user' else 'Assistant'}: {text}")
+    return "\n".join(lines)
+
+
+def clipped_summary(summary, messages, max_tokens=CONTEXT_SUMMARY_TOKENS):
+    """Fallback: the old summary plus a clipped transcript, oldest lines dropped to fit"""
+    lines = [ln for ln in (summary.splitlines() + transcript(messages, clip=120).splitlines()) if ln]
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def llm_summarizer(url, api_key, make_request, max_tokens=CONTEXT_SUMMARY_TOKENS):
+    """summarize(summary, messages) -> new summary, written by the chat model.
+    make_request(msgs) -> request body (the app's own, streaming is turned off)"""
+    def summarize(summary, messages):
+        prompt = SUMMARY_PROMPT.format(words=max_tokens * 3 // 5)
+        content = f"Summary so far:\n{summary or '(empty)'}\n\nNew messages:\n{transcript(messages)}"
+        body = dict(make_request([{"role": "system", "content": prompt},
+                                  {"role": "user", "content": content}]),
+                    stream=False, max_tokens=max_tokens * 2)
+        r = http_client.post(url, api_key, body, timeout=60)
+        if r.status_code != 200:
+            raise http_client.UpstreamError(r.status_code, r.text)
+        return r.json()["choices"][0]["message"]["content"].strip()
+    return summarize
+
+
+class ContextWindow:
+    def __init__(self, summarize=None, max_tokens=CONTEXT_MAX_TOKENS,
+                 summary_tokens=CONTEXT_SUMMARY_TOKENS, messages=(), summary="", on_fold=None):
+        """on_fold(summary, until) is called after each fold; until is the
+        timestamp of the last message folded in"""
+        self.summarize = summarize
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.on_fold = on_fold
+        self.summary = summary
+        self._lock = threading.Lock()
+        self._messages = []   # {"role", "content", "tokens", "timestamp"}
+        self._tokens = 0
+        self._folding = False
+        self._system_tokens = 0
+        self._stats = {"folds": 0, "fallbacks": 0, "folded_messages": 0}
+        for m in messages:
+            self.append(m["role"], m["content"], m.get("timestamp"))
+
+    def append(self, role, content, timestamp=None):
+        tokens = estimate_tokens(content) + MESSAGE_TOKENS
+        with self._lock:
+            self._messages.append({"role": role, "content": content, "tokens": tokens,
+                                   "timestamp": timestamp or datetime.now().isoformat()})
+            self._tokens += tokens
+
+    def _recent_budget(self):
+        return max(self.max_tokens - self._system_tokens - self.summary_tokens, 0)
+
+    def window(self, reserved=0):
+        """(summary, recent messages) that fit next to `reserved` tokens of system prompt.
+        The newest message is always included."""
+        with self._lock:
+            self._system_tokens = reserved
+            budget = self.max_tokens - reserved - (estimate_tokens(self.summary) if self.summary else 0)
+            n, used = 0, 0
+            for m in reversed(self._messages):
+                if n and used + m["tokens"] > budget:
+                    break
+                used += m["tokens"]
+                n += 1
+            msgs = [{"role": m["role"], "content": m["content"]} for m in self._messages[len(self._messages) - n:]]
+            return self.summary, msgs
+
+    def build(self, system_prompt, context=""):
+        """Chat API messages: system prompt, summary, recent messages and, if
+        given, a last system message with per-turn context"""
+        reserved = estimate_tokens(system_prompt) + MESSAGE_TOKENS
+        if context:
+            reserved += estimate_tokens(context) + MESSAGE_TOKENS
+        summary, msgs = self.window(reserved)
+        head = [{"role": "system", "content": system_prompt}]
+        if summary:
+            head.append({"role": "system", "content": f"{SUMMARY_HEADER}\n{summary}"})
+        tail = [{"role": "system", "content": context}] if context else []
+        return head + msgs + tail
+
+    def update(self):
+        """After a turn: fold the oldest messages in the background once the
+        recent ones pass their budget (down to half of it, so folds are rare)"""
+        with self._lock:
+            budget = self._recent_budget()
+            if self._folding or self._tokens <= budget or len(self._messages) <= 2:
+                return
+            # The last exchange always stays verbatim
+            fold, tokens = [], self._tokens
+            for m in self._messages[:-2]:
+                if tokens <= budget // 2:
+                    break
+                fold.append(m)
+                tokens -= m["tokens"]
+            if not fold:
+                return
+            self._folding = True
+        _executor.submit(self._fold, fold)
+
+    def _fold(self, fold):
+        try:
+            summary = None
+            if self.summarize:
+                try:
+                    summary = self.summarize(self.summary, fold)
+                except Exception as e:
+                    print(f"[MEMORY] Summary failed, keeping a clipped transcript: {e}")
+            fallback = not summary
+            if fallback:
+                summary = clipped_summary(self.summary, fold, self.summary_tokens)
+            with self._lock:
+                self.summary = summary
+                self._stats["fallbacks"] += fallback
+                del self._messages[:len(fold)]
+                self._tokens -= sum(m["tokens"] for m in fold)
+                self._stats["folds"] += 1
+                self._stats["folded_messages"] += len(fold)
+            print(f"[MEMORY] Folded {len(fold)} messages into the summary "
+                  f"({estimate_tokens(summary)} tokens)")
+            if self.on_fold:
+                self.on_fold(summary, fold[-1]["timestamp"])
+        finally:
+            self._folding = False
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, messages=len(self._messages), recent_tokens=self._tokens,
+                        summary_tokens=estimate_tokens(self.summary) if self.summary else 0,
+                        max_tokens=self.max_tokens)
+
+
+def open_window(log, summarize=None):
+    """ContextWindow over a chat_log.ConversationLog; the summary is kept in
+    <log>.summary.json next to it, with the timestamp it covers up to"""
+    path = Path(log.path).with_suffix(".summary.json")
+    summary, until = "", ""
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        summary, until = data.get("summary", ""), data.get("until", "")
+    except (OSError, ValueError):
+        pass
+    messages = [m for m in log.tail(CONTEXT_LOAD_MESSAGES) if m.get("timestamp", "") > until]
+
+    def save(summary, until):
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"summary": summary, "until": until}, ensure_ascii=False),
+                       encoding="utf-8")
+        os.replace(tmp, path)
+
+    return ContextWindow(summarize, messages=messages, summary=summary, on_fold=save)
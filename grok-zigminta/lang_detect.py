@@ -0,0 +1,145 @@
+"""
+Language detection for LT / EN / RU voice switching.
+Cyrillic and Lithuanian diacritics are counted with precompiled character
+classes. Latin text is split into words and each word is scored with
+character trigram profiles (built once at import from the samples below)
+plus frozenset word lists. A word's score is computed on first sight and
+memoised, so the common words of a conversation cost one dict lookup.
+Lithuanian is folded to ASCII before scoring, so "siandien" scores like
+"šiandien".
+"""
+import math, re
+from collections import Counter
+
+WORD = re.compile(r"[^\W\d_]+")
+CYRILLIC = re.compile(r"[а-яё]")
+LATIN = re.compile(r"[a-ząčęėįšųūž]")
+LT_CHARS = re.compile(r"[ąčęėįšųūž]")
+_FOLD = str.maketrans("ąčęėįšųūž", "aceeisuuz")
+
+# Log-likelihood bonus per matched word / per Lithuanian diacritic
+WORD_WEIGHT = 3.0
+DIACRITIC_WEIGHT = 4.0
+# Words scored per text; a sentence is far shorter, a long message has enough evidence by then
+MAX_WORDS = 400
+# Memoised word scores; the memo is emptied when it reaches this size
+MAX_CACHED_WORDS = 20000
+
+LT_WORDS = frozenset("""
+labas laba labai kaip aciu prasau gerai taip ne kas kur kodel kada man tau jis ji mes jus
+as tu noriu galiu reikia zinau suprantu klausyk pasakyk kokios kokia koks kokie naujienos
+dabar siandien vakar rytoj yra esi esu esame ar bet ir tai tik cia ten kiek del nuo iki apie
+prie po sveiki sveikas sveika gera geras gali nori turi matau zinai sakyk klausiu atsakyk
+emilija tavo mano musu jusu oras kaina sekasi labanakt iki viso dekoju nieko visai
+""".split())
+
+EN_WORDS = frozenset("""
+the is are was were have has had do does did will would could should can may might hello
+hi hey how what where when why who yes no please thank thanks sorry okay ok good great nice
+well very much more less this that these those here there now then i you he she it we they
+my your his her and but or if because so just only also about with for from into like want
+need know think feel see hear say tell ask help let make get go come take give find of to
+in on at an a be not
+""".split())
+
+# Trigram training text, kept conversational like the apps' traffic
+_SAMPLES = {
+    "lt": """
+Labas, kaip sekasi? Šiandien labai graži diena, saulė šviečia ir šilta. Ką veiki
+šiandien po pamokų? Aš noriu sužinoti, koks bus oras rytoj Vilniuje. Ar gali man
+pasakyti naujausias naujienas? Kiek kainuoja bilietas į kiną? Mano mama dirba
+ligoninėje, o tėtis vairuoja autobusą. Mes gyvename name prie ežero. Emilija mokosi
+penktoje klasėje ir labai mėgsta piešti. Kodėl dangus yra mėlynas? Papasakok man
+įdomią istoriją apie drakonus. Ačiū, tu esi labai protingas. Gerai, suprantu. Ne,
+aš to nežinau. Kur yra artimiausia parduotuvė? Kada prasideda vasaros atostogos?
+Mokykloje šiandien turėjome matematikos kontrolinį, bet viskas buvo gerai. Rytoj
+važiuosime pas močiutę į kaimą. Ar tu moki lietuviškai? Žinoma, Emilija, aš padėsiu
+tau su namų darbais. Pasakyk, kokia šiandien data ir kiek dabar valandų. Sveiki,
+norėčiau užsisakyti picą su sūriu. Labanakt, iki pasimatymo rytoj. Kaip tau sekasi
+mokytis anglų kalbos? Šuo bėgioja kieme, o katė miega ant palangės.
+""",
+    "en": """
+Hello, how are you doing today? The weather is really nice, the sun is shining and
+it is warm. What are you doing after school? I want to know what the weather will
+be like tomorrow in Vilnius. Can you tell me the latest news? How much does a
+movie ticket cost? My mother works at the hospital and my father drives a bus. We
+live in a house near the lake. She is in the fifth grade and she really likes to
+draw. Why is the sky blue? Tell me an interesting story about dragons. Thank you,
+you are very smart. Okay, I understand. No, I don't know that. Where is the nearest
+shop? When does the summer holiday start? We had a math test at school today, but
+everything went well. Tomorrow we are going to visit grandmother in the village.
+Of course, I will help you with your homework. Tell me what the date is today and
+what time it is now. Hi, I would like to order a pizza with cheese. Good night,
+see you tomorrow. How is your English going? The dog is running in the yard and
+the cat is sleeping on the windowsill. Let me check that for you.
+""",
+}
+
+
+def _trigrams(word):
+    """Letter trigrams of a lowercased, folded word padded with one space"""
+    s = f" {word} "
+    return [s[i:i + 3] for i in range(len(s) - 2)]
+
+
+def _profile(text):
+    """Trigram log-probabilities with add-one smoothing -> (table, unseen)"""
+    counts = Counter(g for w in WORD.findall(text.lower().translate(_FOLD)) for g in _trigrams(w))
+    total = sum(counts.values()) + len(counts) + 1
+    return {g: math.log((c + 1) / total) for g, c in counts.items()}, math.log(1 / total)
+
+
+def _llr_table():
+    """One table of log P(g|lt) - log P(g|en), so scoring is a single lookup per trigram"""
+    (lt, lt_unseen), (en, en_unseen) = _profile(_SAMPLES["lt"]), _profile(_SAMPLES["en"])
+    table = {g: lt.get(g, lt_unseen) - en.get(g, en_unseen) for g in lt.keys() | en.keys()}
+    return table, lt_unseen - en_unseen
+
+
+_LLR, _LLR_UNSEEN = _llr_table()
+
+
+class _WordScores(dict):
+    """folded word -> log-likelihood ratio lt vs en, scored on first lookup"""
+    def __missing__(self, word):
+        if len(self) >= MAX_CACHED_WORDS:
+            self.clear()
+        score = (sum(_LLR.get(g, _LLR_UNSEEN) for g in _trigrams(word))
+                 + WORD_WEIGHT * ((word in LT_WORDS) - (word in EN_WORDS)))
+        self[word] = score
+        return score
+
+
+_SCORES = _WordScores()
+
+
+def _posterior(margin):
+    return round(1 / (1 + math.exp(-min(abs(margin), 50))), 3)
+
+
+def detect(text):
+    """(lang, confidence) - confidence is the posterior of the winner, 0.5..1
+    (0.0 when there is nothing to go on)"""
+    low = text.lower()
+    if CYRILLIC.search(low):
+        if not LATIN.search(low):
+            return "ru", 1.0
+        cyr, latin = len(CYRILLIC.findall(low)), len(LATIN.findall(low))
+        if cyr >= latin:
+            return "ru", round(0.5 + cyr / (cyr + latin) / 2, 3)
+    diacritics = len(LT_CHARS.findall(low))
+    if diacritics >= 2:
+        return "lt", _posterior(DIACRITIC_WEIGHT * diacritics)
+    folded = low.translate(_FOLD) if diacritics else low
+    words = WORD.findall(folded)
+    if not words:
+        return "en", 0.0
+
+    # log-likelihood ratio lt vs en; > 0 means Lithuanian
+    margin = sum(map(_SCORES.__getitem__, words[:MAX_WORDS])) + DIACRITIC_WEIGHT * diacritics
+    return ("lt" if margin > 0 else "en"), _posterior(margin)
+
+
+def detect_language(text):
+    """Detect if text is Lithuanian, English, or Russian"""
+    return detect(text)[0]
@@ -0,0 +1,73 @@
+"""
+Stable prompt prefixes for upstream prompt caching.
+Providers cache the longest prompt prefix they have seen before, so a
+request is laid out as: static system prompt (byte-identical for a given
+app or profile), conversation summary, history, and last a system message
+with the volatile context (time, detected language, search results).
+Compared with the previous request for the same key, only the new
+messages and that last message differ.
+
+PrefixStats keeps score: how often the static prompt changed and what
+share of each prompt (in estimated tokens) repeats the previous one.
+"""
+import hashlib, threading
+from context_window import estimate_tokens
+
+
+def _digest(m):
+    return hashlib.sha1(f"{m['role']}\0{m['content']}".encode("utf-8")).digest()
+
+
+class PrefixStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last = {}    # key -> digests of the cacheable messages of the last request
+        self._stats = {}   # key -> counters
+
+    def observe(self, key, messages, volatile=0):
+        """Record a request; the last `volatile` messages are not expected to repeat.
+        -> share of this prompt's tokens that repeat the previous request's prefix"""
+        digests = [_digest(m) for m in messages[:len(messages) - volatile]]
+        tokens = [estimate_tokens(m["content"]) for m in messages]
+        with self._lock:
+            last = self._last.get(key)
+            s = self._stats.setdefault(key, {"requests": 0, "static_changes": 0,
+                                             "prompt_tokens": 0, "reused_tokens": 0})
+            s["requests"] += 1
+            s["prompt_tokens"] += sum(tokens)
+            reused = 0
+            if last is not None:
+                if not digests or not last or digests[0] != last[0]:
+                    s["static_changes"] += 1
+                    print(f"[PROMPT] {key}: static prefix changed, upstream cache starts over")
+                for i, (a, b) in enumerate(zip(digests, last)):
+                    if a != b:
+                        break
+                    reused += tokens[i]
+            s["reused_tokens"] += reused
+            self._last[key] = digests
+        return reused / max(sum(tokens), 1)
+
+    def stats(self):
+        """Per key and overall: static prefix stability and reused prompt share"""
+        with self._lock:
+            keys = {k: dict(s) for k, s in self._stats.items()}
+        total = {"requests": 0, "static_changes": 0, "prompt_tokens": 0, "reused_tokens": 0}
+        for s in keys.values():
+            for k in total:
+                total[k] += s[k]
+        for s in list(keys.values()) + [total]:
+            repeats = max(s["requests"] - 1, 0) if s is not total else max(s["requests"] - len(keys), 0)
+            s["static_stable_pct"] = round(100 * (1 - s["static_changes"] / repeats), 1) if repeats else None
+            s["reused_pct"] = round(100 * s["reused_tokens"] / s["prompt_tokens"], 1) if s["prompt_tokens"] else None
+        return dict(total, keys=keys)
+
+
+prefix_stats = PrefixStats()
+
+
+def build_prompt(key, window, static, context=""):
+    """Chat API messages from a ContextWindow, with the volatile context last"""
+    msgs = window.build(static, context)
+    prefix_stats.observe(key, msgs, volatile=1 if context else 0)
+    return msgs
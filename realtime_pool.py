@@ -0,0 +1,237 @@
+"""
+Warm pool of realtime API sessions for web_voice_chat.py.
+Starting a call used to cost a TLS websocket handshake plus a
+session.update round trip before the user could speak. The pool keeps
+REALTIME_POOL_SIZE sessions per voice connected and configured with the
+base instructions; a call claims one and sends its own instructions in a
+single session.update without waiting for the reply (the API applies
+events in order, so audio sent right after is heard with them).
+
+Idle sessions are pinged every REALTIME_POOL_PING_SECS and closed after
+REALTIME_POOL_IDLE_SECS. A claim that finds no warm session for its
+voice returns None and the caller connects as before. After a failed
+connect (a 429, say) the pool waits a ping interval before trying again.
+
+Upkeep runs in a thread (start(), Flask mode) or a task on the running
+loop (astart(), ASGI mode), with sync or async sessions to match.
+"""
+import os, asyncio, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+REALTIME_POOL_SIZE = int(os.getenv("REALTIME_POOL_SIZE", 2))
+# Comma-separated voices to keep warm
+REALTIME_POOL_VOICES = os.getenv("REALTIME_POOL_VOICES", "Ara")
+REALTIME_POOL_IDLE_SECS = float(os.getenv("REALTIME_POOL_IDLE_SECS", 300))
+REALTIME_POOL_PING_SECS = float(os.getenv("REALTIME_POOL_PING_SECS", 20))
+# Sessions opened at once when topping up
+POOL_CONNECTS = 8
+
+
+class SessionPool:
+    def __init__(self, new_session, voices=None, size=REALTIME_POOL_SIZE,
+                 idle_secs=REALTIME_POOL_IDLE_SECS, ping_secs=REALTIME_POOL_PING_SECS):
+        """new_session(voice) -> an unconnected GrokSession (start) or
+        AsyncGrokSession (astart) with the base instructions"""
+        if voices is None:
+            voices = [v.strip() for v in REALTIME_POOL_VOICES.split(",") if v.strip()]
+        self.new_session = new_session
+        self.size = size
+        self.idle_secs = idle_secs
+        self.ping_secs = ping_secs
+        self._lock = threading.Lock()
+        self._idle = {v: [] for v in voices}   # voice -> [(session, idle since)]
+        self._wake = None
+        self._started = False
+        self._retry_at = 0
+        self._stats = {"hits": 0, "misses": 0, "connects": 0, "connect_failures": 0,
+                       "expired": 0, "dead": 0, "connect_ms": 0.0}
+
+    def claim(self, voice):
+        """A warm session for `voice`, now owned by the caller, or None"""
+        with self._lock:
+            idle = self._idle.get(voice)
+            entry = max(idle, key=lambda e: e[1]) if idle else None   # the freshest
+            if entry:
+                idle.remove(entry)
+            self._stats["hits" if entry else "misses"] += 1
+        if entry and self._wake:
+            self._wake()
+        return entry[0] if entry else None
+
+    def _expire(self):
+        """Take out the sessions idle too long -> to close"""
+        now = time.monotonic()
+        stale = []
+        with self._lock:
+            for voice, idle in self._idle.items():
+                stale += [e[0] for e in idle if now - e[1] > self.idle_secs]
+                idle[:] = [e for e in idle if now - e[1] <= self.idle_secs]
+            self._stats["expired"] += len(stale)
+        return stale
+
+    def _entries(self):
+        with self._lock:
+            return [(voice, e) for voice, idle in self._idle.items() for e in idle]
+
+    def _checkout(self, voice, entry):
+        """Take an idle entry out -> False if a call claimed it meanwhile"""
+        with self._lock:
+            if entry not in self._idle[voice]:
+                return False
+            self._idle[voice].remove(entry)
+            return True
+
+    def _checkin(self, voice, entry):
+        with self._lock:
+            self._idle[voice].append(entry)
+
+    def _dead(self, voice):
+        print(f"[POOL] Idle {voice} session failed its ping, dropped")
+        with self._lock:
+            self._stats["dead"] += 1
+
+    def _missing(self):
+        """-> [voice] once per session to open, [] while backing off"""
+        if time.monotonic() < self._retry_at:
+            return []
+        with self._lock:
+            return [v for v, idle in self._idle.items() for _ in range(self.size - len(idle))]
+
+    def _connected(self, voice, session, t):
+        with self._lock:
+            self._idle[voice].append((session, time.monotonic()))
+            self._stats["connects"] += 1
+            self._stats["connect_ms"] += (time.perf_counter() - t) * 1000
+
+    def _failed(self, voice, e):
+        print(f"[POOL] Warming a {voice} session failed, retrying in {self.ping_secs:.0f}s: {e}")
+        self._retry_at = time.monotonic() + self.ping_secs
+        with self._lock:
+            self._stats["connect_failures"] += 1
+
+    # --- Flask mode: sync sessions, upkeep thread ---
+
+    def maintain(self):
+        """One upkeep round: close stale sessions, ping the rest, top up"""
+        for session in self._expire():
+            session.close()
+        for voice, entry in self._entries():
+            # Checked out while pinging: ping() reads the socket, the new owner must not
+            if not self._checkout(voice, entry):
+                continue
+            if entry[0].ping():
+                self._checkin(voice, entry)
+            else:
+                self._dead(voice)
+                entry[0].close()
+
+        def warm(voice):
+            if time.monotonic() < self._retry_at:
+                return
+            t = time.perf_counter()
+            session = self.new_session(voice)
+            try:
+                session.connect()
+            except Exception as e:
+                self._failed(voice, e)
+                session.close()
+                return
+            self._connected(voice, session, t)
+
+        missing = self._missing()
+        if missing:
+            with ThreadPoolExecutor(min(len(missing), POOL_CONNECTS),
+                                    thread_name_prefix="pool-connect") as ex:
+                list(ex.map(warm, missing))
+
+    def start(self):
+        """Keep the pool warm from a background thread (once)"""
+        with self._lock:
+            if self._started or not self.size or not self._idle:
+                return self
+            self._started = True
+        wake = threading.Event()
+        self._wake = wake.set
+
+        def run():
+            while True:
+                wake.clear()
+                try:
+                    self.maintain()
+                except Exception as e:
+                    print(f"[POOL] Upkeep failed: {e}")
+                wake.wait(self.ping_secs)
+
+        threading.Thread(target=run, name="realtime-pool", daemon=True).start()
+        print(f"[POOL] Keeping {self.size} sessions warm for {', '.join(self._idle)}")
+        return self
+
+    # --- ASGI mode: async sessions, upkeep task ---
+
+    async def amaintain(self):
+        for session in self._expire():
+            await session.close()
+        # The websockets library reads in the background, so pings need no checkout
+        entries = self._entries()
+        alive = await asyncio.gather(*(e[0].ping() for _, e in entries))
+        for (voice, entry), ok in zip(entries, alive):
+            if not ok and self._checkout(voice, entry):
+                self._dead(voice)
+                await entry[0].close()
+
+        async def warm(voice):
+            if time.monotonic() < self._retry_at:
+                return
+            t = time.perf_counter()
+            session = self.new_session(voice)
+            try:
+                await session.connect()
+            except Exception as e:
+                self._failed(voice, e)
+                await session.close()
+                return
+            self._connected(voice, session, t)
+
+        missing = self._missing()
+        for i in range(0, len(missing), POOL_CONNECTS):
+            await asyncio.gather(*(warm(v) for v in missing[i:i + POOL_CONNECTS]))
+
+    def astart(self):
+        """Keep the pool warm from a task on the running loop -> the task, or None"""
+        if self._started or not self.size or not self._idle:
+            return None
+        self._started = True
+        wake = asyncio.Event()
+        self._wake = wake.set
+
+        async def run():
+            while True:
+                wake.clear()
+                try:
+                    await self.amaintain()
+                except Exception as e:
+                    print(f"[POOL] Upkeep failed: {e}")
+                try:
+                    await asyncio.wait_for(wake.wait(), self.ping_secs)
+                except asyncio.TimeoutError:
+                    pass
+
+        print(f"[POOL] Keeping {self.size} sessions warm for {', '.join(self._idle)}")
+        return asyncio.create_task(run())
+
+    async def aclose(self):
+        with self._lock:
+            sessions = [e[0] for idle in self._idle.values() for e in idle]
+            for idle in self._idle.values():
+                idle.clear()
+        await asyncio.gather(*(s.close() for s in sessions), return_exceptions=True)
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["idle"] = {v: len(idle) for v, idle in self._idle.items()}
+        claims = s["hits"] + s["misses"]
+        s["hit_ratio"] = round(s["hits"] / claims, 3) if claims else 0.0
+        s["avg_connect_ms"] = round(s.pop("connect_ms") / s["connects"], 1) if s["connects"] else 0.0
+        s["size"] = self.size
+        return s
@@ -0,0 +1,178 @@
+"""
+TTL cache for Perplexity search results.
+Keyed by language + normalized query, so "Koks oras?" and "koks  oras"
+share one entry. Each query falls into a category (weather, news, price,
+time...) with its own TTL; time questions are never cached.
+Concurrent identical queries share one upstream call (single-flight).
+"""
+import os, re, asyncio, threading, time, unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 512))
+# Seconds per category; "default" covers queries that match no category
+SEARCH_CACHE_TTLS = os.getenv("SEARCH_CACHE_TTLS",
+                              "weather=900,news=300,price=300,time=0,default=600")
+
+# First match wins. Keywords match whole words of the normalized query (a
+# phrase only as consecutive words); a trailing "*" also matches longer
+# words starting with the stem, for inflected forms.
+CATEGORIES = [
+    ("time", ["what time", "what date", "koks laikas", "kokia data", "kelinta valanda",
+              "который час", "какое число", "сколько времени"]),
+    ("weather", ["weather", "temperature*", "forecast*", "rain", "rainy", "raining", "oras", "orai",
+                 "orų", "temperatūr*", "prognoz*", "lietus", "lietaus", "погод*", "температур*",
+                 "прогноз*", "дожд*"]),
+    ("news", ["news", "latest", "happening", "naujien*", "naujausi*", "kas vyksta",
+              "новост*", "что происходит"]),
+    ("price", ["price*", "exchange", "rate", "rates", "stock", "stocks", "bitcoin*", "kain*",
+               "kursas", "kurso", "kiek kainuoja", "цена", "цены", "цену", "курс", "курса",
+               "сколько стоит"]),
+]
+
+
+def _keyword_pattern(words):
+    alts = [re.escape(w[:-1]) + r"\w*" if w.endswith("*") else re.escape(w) for w in words]
+    return re.compile(r"\b(?:" + "|".join(alts) + r")\b")
+
+
+_PATTERNS = [(name, _keyword_pattern(words)) for name, words in CATEGORIES]
+
+
+def parse_ttls(spec):
+    ttls = {}
+    for part in spec.split(","):
+        name, _, secs = part.strip().partition("=")
+        try:
+            ttls[name] = float(secs)
+        except ValueError:
+            pass
+    return ttls
+
+
+def normalize_query(query):
+    q = unicodedata.normalize("NFKC", query).lower()
+    q = re.sub(r"[^\w\s]", " ", q)
+    return " ".join(q.split())
+
+
+def categorize(norm):
+    for name, pattern in _PATTERNS:
+        if pattern.search(norm):
+            return name
+    return "default"
+
+
+class SearchCache:
+    def __init__(self, max_entries=SEARCH_CACHE_SIZE, ttls=None):
+        self.max_entries = max_entries
+        self.ttls = ttls if ttls is not None else parse_ttls(SEARCH_CACHE_TTLS)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (expires, result, fetch_ms)
+        self._inflight = {}             # key -> Future (thread callers)
+        self._ainflight = {}            # key -> asyncio.Task (ASGI callers)
+        self._stats = {"hits": 0, "misses": 0, "shared": 0, "saved_ms": 0.0,
+                       "fetch_ms": 0.0, "by_category": {}}
+
+    def _key(self, query, lang):
+        norm = normalize_query(query)
+        cat = categorize(norm)
+        return (lang or "", norm), cat
+
+    def _lookup(self, key, cat):
+        """Cached result or None; counts the hit"""
+        now = time.monotonic()
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit and hit[0] > now:
+                self._entries.move_to_end(key)
+                self._count(cat, "hits")
+                self._stats["saved_ms"] += hit[2]
+                return hit[1]
+            if hit:
+                del self._entries[key]
+            return None
+
+    def _count(self, cat, what):
+        """what: hits, misses (upstream fetches) or shared (joined a fetch in flight)"""
+        self._stats[what] += 1
+        c = self._stats["by_category"].setdefault(cat, {"hits": 0, "misses": 0, "shared": 0})
+        c[what] += 1
+
+    def _store(self, key, cat, result, fetch_ms):
+        ttl = self.ttls.get(cat, self.ttls.get("default", 0))
+        with self._lock:
+            self._stats["fetch_ms"] += fetch_ms
+            if not result or ttl <= 0:
+                return
+            self._entries[key] = (time.monotonic() + ttl, result, fetch_ms)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_fetch(self, query, fetch, lang=None):
+        """fetch(query) -> result; empty results (errors) are not cached"""
+        key, cat = self._key(query, lang)
+        result = self._lookup(key, cat)
+        if result is not None:
+            print(f"[SEARCH CACHE] Hit ({cat}): {query[:50]}")
+            return result
+        with self._lock:
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._inflight[key] = Future()
+            self._count(cat, "misses" if owner else "shared")
+        if not owner:
+            return fut.result()
+        t = time.perf_counter()
+        try:
+            result = fetch(query)
+            self._store(key, cat, result, (time.perf_counter() - t) * 1000)
+            fut.set_result(result)
+            return result
+        except Exception as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def aget_or_fetch(self, query, fetch, lang=None):
+        """Async version: fetch(query) is a coroutine function"""
+        key, cat = self._key(query, lang)
+        result = self._lookup(key, cat)
+        if result is not None:
+            print(f"[SEARCH CACHE] Hit ({cat}): {query[:50]}")
+            return result
+        task = self._ainflight.get(key)
+        with self._lock:
+            self._count(cat, "shared" if task is not None else "misses")
+        if task is not None:
+            # shield: one waiter giving up must not cancel the others
+            return await asyncio.shield(task)
+
+        async def run():
+            t = time.perf_counter()
+            try:
+                result = await fetch(query)
+                self._store(key, cat, result, (time.perf_counter() - t) * 1000)
+                return result
+            finally:
+                self._ainflight.pop(key, None)
+
+        task = self._ainflight[key] = asyncio.ensure_future(run())
+        return await asyncio.shield(task)
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats, by_category=dict(self._stats["by_category"]))
+            s["entries"] = len(self._entries)
+        lookups = s["hits"] + s["misses"] + s["shared"]
+        s["hit_ratio"] = round(s["hits"] / lookups, 3) if lookups else 0.0
+        s["avg_fetch_ms"] = round(s.pop("fetch_ms") / s["misses"], 1) if s["misses"] else 0.0
+        s["saved_ms"] = round(s["saved_ms"], 1)
+        return s
+
+
+search_cache = SearchCache()
@@ -0,0 +1,154 @@
+"""
+Session storage for web_voice_chat.py.
+Sessions live in an in-memory dict indexed by id; SQLite (WAL mode) is the
+durable copy. Appending a message is one INSERT, not a rewrite of every
+session, so per-utterance cost stays flat as sessions pile up.
+Each session also keeps its conversation memory (the context_window
+summary and the message time it covers up to).
+"""
+import os, json, sqlite3, threading
+from datetime import datetime
+
+SESSIONS_DB = os.getenv("SESSIONS_DB", "chat_sessions.db")
+SESSION_MAX_MESSAGES = 50
+
+
+class SessionStore:
+    def __init__(self, db_path=SESSIONS_DB, legacy_json=None, max_messages=SESSION_MAX_MESSAGES):
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY, created TEXT, name TEXT, summary TEXT);
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT, role TEXT, text TEXT, time TEXT);
+            CREATE INDEX IF NOT EXISTS messages_session ON messages(session_id, id);
+        """)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(sessions)")}
+        for col in ("memory", "memory_until"):
+            if col not in columns:
+                self._db.execute(f"ALTER TABLE sessions ADD COLUMN {col} TEXT")
+        self._sessions = {}   # id -> session dict, insertion (= creation) order
+        self._stored = {}     # id -> message rows in SQLite, for pruning
+        self._load()
+        if not self._sessions and legacy_json and os.path.exists(legacy_json):
+            self._import_legacy(legacy_json)
+
+    def _load(self):
+        for sid, created, name, summary, memory, until in self._db.execute(
+                "SELECT id, created, name, summary, memory, memory_until FROM sessions ORDER BY rowid"):
+            self._sessions[sid] = {"id": sid, "created": created, "name": name,
+                                   "messages": [], "summary": summary or "",
+                                   "memory": memory or "", "memory_until": until or ""}
+        for sid, role, text, time in self._db.execute(
+                "SELECT session_id, role, text, time FROM messages ORDER BY id"):
+            if sid in self._sessions:
+                self._sessions[sid]["messages"].append({"role": role, "text": text, "time": time})
+        for sid, s in self._sessions.items():
+            self._stored[sid] = len(s["messages"])
+            s["messages"] = s["messages"][-self.max_messages:]
+
+    def _import_legacy(self, path):
+        """One-time import of the old chat_sessions.json"""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with self._lock, self._db:
+            for s in data.get("sessions", []):
+                self._db.execute("INSERT OR IGNORE INTO sessions (id, created, name, summary) "
+                                 "VALUES (?, ?, ?, ?)",
+                                 (s["id"], s.get("created"), s.get("name"), s.get("summary", "")))
+                msgs = s.get("messages", [])[-self.max_messages:]
+                self._db.executemany(
+                    "INSERT INTO messages (session_id, role, text, time) VALUES (?, ?, ?, ?)",
+                    [(s["id"], m["role"], m["text"], m.get("time")) for m in msgs])
+                self._sessions[s["id"]] = {"id": s["id"], "created": s.get("created"),
+                                           "name": s.get("name"), "messages": list(msgs),
+                                           "summary": s.get("summary", ""),
+                                           "memory": "", "memory_until": ""}
+                self._stored[s["id"]] = len(msgs)
+        print(f"[SESSIONS] Imported {len(self._sessions)} sessions from {path}")
+
+    @staticmethod
+    def _copy(session, with_messages=True):
+        s = dict(session)
+        if with_messages:
+            s["messages"] = list(session["messages"])
+        else:
+            s.pop("messages")
+            s.pop("memory", None)
+            s.pop("memory_until", None)
+            s["message_count"] = len(session["messages"])
+        return s
+
+    def get(self, session_id):
+        with self._lock:
+            s = self._sessions.get(session_id)
+            return self._copy(s) if s else None
+
+    def create(self):
+        with self._lock:
+            now = datetime.now()
+            session_id = base = now.strftime("%Y%m%d_%H%M%S")
+            n = 1
+            while session_id in self._sessions:
+                n += 1
+                session_id = f"{base}_{n}"
+            s = {"id": session_id, "created": now.isoformat(),
+                 "name": f"Chat {len(self._sessions) + 1}", "messages": [], "summary": "",
+                 "memory": "", "memory_until": ""}
+            with self._db:
+                self._db.execute("INSERT INTO sessions (id, created, name, summary) VALUES (?, ?, ?, ?)",
+                                 (s["id"], s["created"], s["name"], s["summary"]))
+            self._sessions[session_id] = s
+            self._stored[session_id] = 0
+            return self._copy(s)
+
+    def add_message(self, session_id, role, text):
+        with self._lock:
+            s = self._sessions.get(session_id)
+            if s is None:
+                return
+            m = {"role": role, "text": text, "time": datetime.now().isoformat()}
+            s["messages"].append(m)
+            if len(s["messages"]) > self.max_messages:
+                del s["messages"][0]
+            if len(s["messages"]) >= 3:
+                s["summary"] = " | ".join([x["text"][:30] for x in s["messages"][-5:]])
+            with self._db:
+                self._db.execute(
+                    "INSERT INTO messages (session_id, role, text, time) VALUES (?, ?, ?, ?)",
+                    (session_id, role, text, m["time"]))
+                self._db.execute("UPDATE sessions SET summary = ? WHERE id = ?",
+                                 (s["summary"], session_id))
+                self._stored[session_id] += 1
+                # Prune in batches rather than on every message
+                if self._stored[session_id] > self.max_messages * 2:
+                    self._db.execute(
+                        "DELETE FROM messages WHERE session_id = ? AND id NOT IN "
+                        "(SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?)",
+                        (session_id, session_id, self.max_messages))
+                    self._stored[session_id] = self.max_messages
+
+    def set_memory(self, session_id, memory, until):
+        """Conversation summary covering the messages up to time `until`"""
+        with self._lock:
+            s = self._sessions.get(session_id)
+            if s is None:
+                return
+            s["memory"], s["memory_until"] = memory, until
+            with self._db:
+                self._db.execute("UPDATE sessions SET memory = ?, memory_until = ? WHERE id = ?",
+                                 (memory, until, session_id))
+
+    def list(self, offset=0, limit=20):
+        """Newest first, without message bodies"""
+        with self._lock:
+            ids = list(self._sessions)
+            total = len(ids)
+            page = ids[::-1][offset:offset + limit]
+            sessions = [self._copy(self._sessions[i], with_messages=False) for i in page]
+        return {"sessions": sessions, "total": total, "offset": offset, "limit": limit}
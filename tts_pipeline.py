@@ -0,0 +1,266 @@
+"""
+Pipelined TTS for the /chat-stream generators.
+Sentences are synthesized concurrently (N in flight) while text deltas keep
+flowing to the client; audio always comes back out in sentence order.
+
+Jobs are started through a submit(*args) -> Future[bytes] function such as
+TTSWorker.submit; plain blocking functions can be adapted with threaded().
+
+With chunks=True the pipeline forwards audio while a sentence is still
+being synthesized: TTSJob futures hand out their chunks as they arrive,
+and the leading sentence's chunks go out immediately, tagged with the
+sentence's sequence id.
+"""
+import os, asyncio, queue, threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, InvalidStateError
+
+# Sentences synthesized at the same time for one answer (0 = old inline mode)
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", 3))
+# Sentences allowed to wait for synthesis before the token stream is held back
+TTS_QUEUE_SIZE = int(os.getenv("TTS_QUEUE_SIZE", 8))
+# Threads for threaded() synth functions, shared by all requests of the process
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", 16))
+
+_executor = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+
+
+def threaded(synth):
+    """Adapt a blocking synth(*args) -> bytes into a Future-returning submit"""
+    return lambda *args: _executor.submit(synth, *args)
+
+
+class TTSJob(Future):
+    """Future[bytes] that also hands out the audio while it is synthesized.
+    chunks gets each piece of audio, then None once the job is finished."""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = queue.SimpleQueue()
+        self._listeners = []
+        self._listeners_lock = threading.Lock()
+        self._stop = None
+
+    def on_cancel(self, fn):
+        """fn() stops the producer when the job is cancelled"""
+        self._stop = fn
+
+    def cancel(self):
+        if self.done():
+            return False
+        if self._stop is not None:
+            self._stop()
+        cancelled = super().cancel()
+        self.chunks.put(None)
+        self._notify()
+        return cancelled
+
+    def add_listener(self, fn):
+        """fn() is called (from the producing thread) after every chunk and at the end"""
+        with self._listeners_lock:
+            self._listeners.append(fn)
+
+    def _notify(self):
+        with self._listeners_lock:
+            listeners = list(self._listeners)
+        for fn in listeners:
+            fn()
+
+    def push(self, chunk):
+        self.chunks.put(chunk)
+        self._notify()
+
+    def finish(self, result=None, exc=None):
+        self.chunks.put(None)
+        try:
+            if exc is not None:
+                self.set_exception(exc)
+            else:
+                self.set_result(result)
+        except InvalidStateError:
+            return  # cancelled meanwhile
+        self._notify()
+
+
+def as_job(fut):
+    """A plain Future[bytes] as a TTSJob that delivers everything in one chunk"""
+    if isinstance(fut, TTSJob):
+        return fut
+    job = TTSJob()
+    job.on_cancel(fut.cancel)
+
+    def done(f):
+        if f.cancelled():
+            return
+        try:
+            ad = f.result()
+        except Exception as e:
+            job.finish(exc=e)
+            return
+        if ad:
+            job.push(ad)
+        job.finish(ad)
+
+    fut.add_done_callback(done)
+    return job
+
+
+class TTSPipeline:
+    """Ordered, bounded TTS queue for one answer.
+
+    submit() / ready() return lists of audio bytes that are ready to be
+    sent, always in the order the sentences were submitted; drain() yields
+    them as each remaining sentence completes. With
+    chunks=True they return (seq, audio, final) tuples instead: pieces of
+    a sentence as they arrive, then (seq, b"", True) when it is complete.
+    """
+
+    def __init__(self, submit, concurrency=None, queue_size=None, chunks=False):
+        self.start = submit
+        self.concurrency = TTS_CONCURRENCY if concurrency is None else concurrency
+        self.queue_size = max(queue_size or TTS_QUEUE_SIZE, self.concurrency, 1)
+        self.chunks = chunks
+        self._waiting = deque()   # sentences not yet handed to a worker
+        self._running = deque()   # futures, in sentence order
+        self._seq = 0             # sequence id of self._running[0]
+        self._wake = None         # asyncio.Event for chunk waits (ASGI mode)
+        self._listening = set()   # jobs that set self._wake
+
+    @staticmethod
+    def _result(fut):
+        try:
+            return fut.result()
+        except Exception as e:
+            print(f"[TTS ERR] {e}")
+            return None
+
+    def _fill(self):
+        active = sum(1 for f in self._running if not f.done())
+        while self._waiting and active < self.concurrency:
+            fut = self.start(*self._waiting.popleft())
+            self._running.append(as_job(fut) if self.chunks else fut)
+            active += 1
+
+    def _whole(self, ad):
+        """Output for one finished sentence"""
+        seq = self._seq
+        self._seq += 1
+        if not self.chunks:
+            return [ad] if ad else []
+        return ([(seq, ad, False)] if ad else []) + [(seq, b"", True)]
+
+    @staticmethod
+    def _take(job, block):
+        """Audio the job has produced so far -> (bytes, finished)"""
+        parts = []
+        try:
+            c = job.chunks.get(block=block)
+            while c is not None:
+                parts.append(c)
+                c = job.chunks.get_nowait()
+        except queue.Empty:
+            return b"".join(parts), False
+        return b"".join(parts), True
+
+    def _pop_chunks(self, block):
+        out = []
+        while self._running:
+            data, end = self._take(self._running[0], block)
+            block = False
+            if data:
+                out.append((self._seq, data, False))
+            if not end:
+                break
+            self._result(self._running.popleft())
+            out.append((self._seq, b"", True))
+            self._seq += 1
+            self._fill()
+        return out
+
+    def _pop(self, block):
+        if self.chunks:
+            return self._pop_chunks(block)
+        out = []
+        while self._running and (block or self._running[0].done()):
+            ad = self._result(self._running.popleft())
+            self._seq += 1
+            if ad:
+                out.append(ad)
+            self._fill()
+            if block:
+                break
+        return out
+
+    def submit(self, *args):
+        """Queue one sentence for synthesis"""
+        if self.concurrency <= 0:
+            return self._whole(self._result(self.start(*args)))
+        out = []
+        # Bounded queue: wait for the oldest sentence before taking a new one
+        while len(self._waiting) + len(self._running) >= self.queue_size:
+            out.extend(self._pop(block=True))
+        self._waiting.append(args)
+        self._fill()
+        return out + self._pop(block=False)
+
+    def ready(self):
+        """Audio for the leading sentences that are already synthesized"""
+        return self._pop(block=False)
+
+    def cancel(self):
+        """Drop the sentences not synthesized yet and stop the ones in flight
+        -> number of sentences dropped"""
+        dropped = len(self._waiting)
+        self._waiting.clear()
+        while self._running:
+            fut = self._running.popleft()
+            if not fut.done():
+                fut.cancel()
+                dropped += 1
+        return dropped
+
+    def drain(self):
+        """Wait for everything still queued, yielding audio as it completes"""
+        while self._running or self._waiting:
+            self._fill()
+            yield from self._pop(block=True)
+
+    # asyncio variants for the ASGI mode - same ordering, but waiting on the
+    # oldest sentence yields to the event loop instead of blocking it
+
+    async def _achunk(self, job):
+        """Wait until the job has a new chunk (or has finished)"""
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        if job not in self._listening:
+            self._listening.add(job)
+            job.add_listener(lambda: loop.call_soon_threadsafe(self._wake.set))
+        self._wake.clear()
+        if job.chunks.empty():
+            await self._wake.wait()
+
+    async def _apop(self):
+        if self.chunks:
+            await self._achunk(self._running[0])
+        else:
+            await asyncio.wait([asyncio.wrap_future(self._running[0])])
+        return self._pop(block=False)
+
+    async def asubmit(self, *args):
+        if self.concurrency <= 0:
+            fut = self.start(*args)
+            await asyncio.wait([asyncio.wrap_future(fut)])
+            return self._whole(self._result(fut))
+        out = []
+        while len(self._waiting) + len(self._running) >= self.queue_size:
+            out.extend(await self._apop())
+        self._waiting.append(args)
+        self._fill()
+        return out + self._pop(block=False)
+
+    async def adrain(self):
+        while self._running or self._waiting:
+            self._fill()
+            for item in await self._apop():
+                yield item
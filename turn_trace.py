@@ -0,0 +1,235 @@
+"""
+Per-turn latency traces and Prometheus metrics for the voice apps.
+
+A Trace starts when a request (or, in realtime mode, the end of the user's
+speech) arrives. The pipeline puts marks (first_token, chunk, first_audio,
+done) and spans (search, tts per chunk) on it, in ms since the start.
+A finished trace is kept in memory for /traces, appended to TRACE_LOG
+(JSON lines) when that is set, and folded into the histograms that
+/metrics serves in Prometheus text format.
+
+While a turn streams, its trace is the current one for the thread or
+asyncio task, so http_client can mark upstream connects and first bytes
+without the trace being passed around.
+"""
+import os, json, threading, time, uuid
+from collections import deque
+from contextvars import ContextVar
+from itertools import count
+
+TRACE_KEEP = int(os.getenv("TRACE_KEEP", 200))
+# Append every finished trace to this file as one JSON line (off when empty)
+TRACE_LOG = os.getenv("TRACE_LOG", "")
+
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 8, 13, 20, 30)
+METRICS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_current = ContextVar("turn_trace", default=None)
+
+
+def mark(name, **attrs):
+    """Mark on the current turn's trace, if there is one"""
+    trace = _current.get()
+    if trace is not None:
+        trace.mark(name, **attrs)
+
+
+class Trace:
+    def __init__(self, app, **attrs):
+        self.id = uuid.uuid4().hex[:12]
+        self.app = app
+        self.attrs = attrs
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.events = []   # (name, at_ms, dur_ms or None, attrs); appended from any thread
+        self._seen = set()
+        self.finished = False
+        self.mark("request")
+
+    def _ms(self, t):
+        return round((t - self.t0) * 1000, 1)
+
+    def mark(self, name, **attrs):
+        self.events.append((name, self._ms(time.perf_counter()), None, attrs))
+
+    def first(self, name, **attrs):
+        """mark() the first time only"""
+        if name not in self._seen:
+            self._seen.add(name)
+            self.mark(name, **attrs)
+
+    def begin(self, name, **attrs):
+        """Open a span -> end(**more) closes it (from any thread)"""
+        t = time.perf_counter()
+
+        def end(**more):
+            now = time.perf_counter()
+            self.events.append((name, self._ms(t), round((now - t) * 1000, 1), dict(attrs, **more)))
+        return end
+
+    def track(self, name, fut, **attrs):
+        """Span from now until fut (concurrent or asyncio future) is done -> fut"""
+        end = self.begin(name, **attrs)
+        fut.add_done_callback(lambda f: end(ok=not f.cancelled() and f.exception() is None))
+        return fut
+
+    def traced_submit(self, submit):
+        """A TTS submit function that records a "tts" span per chunk"""
+        seq = count()
+        return lambda *args: self.track("tts", submit(*args), seq=next(seq))
+
+    def activate(self):
+        """Make this the current trace of the thread / asyncio task"""
+        _current.set(self)
+
+    def at(self, name):
+        """ms of the first event called name, or None"""
+        for ev in self.events:
+            if ev[0] == name:
+                return ev[1]
+        return None
+
+    def spans(self, name):
+        return [ev[2] for ev in self.events if ev[0] == name and ev[2] is not None]
+
+    def finish(self, **attrs):
+        if self.finished:
+            return
+        self.finished = True
+        self.attrs.update(attrs)
+        self.mark("done")
+        if _current.get() is self:
+            _current.set(None)
+        registry.observe_trace(self)
+        data = self.to_dict()
+        _recent.append(data)
+        if TRACE_LOG:
+            with _log_lock, open(TRACE_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(data, ensure_ascii=False) + "\n")
+        ttfa = self.at("first_audio")
+        print(f"[TRACE] {self.app} {self.id}: first token {self.at('first_token')} ms, "
+              f"first audio {ttfa} ms, done {self.at('done')} ms")
+
+    def to_dict(self):
+        events = []
+        for name, at, dur, attrs in sorted(list(self.events), key=lambda ev: ev[1]):
+            ev = {"name": name, "at_ms": at}
+            if dur is not None:
+                ev["dur_ms"] = dur
+            ev.update(attrs)
+            events.append(ev)
+        return {"id": self.id, "app": self.app, "started": round(self.started, 3),
+                **self.attrs, "events": events}
+
+
+class Histogram:
+    def __init__(self, name, help, labels=("app",), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}   # label values -> [bucket counts..., sum, count]
+
+    def observe(self, secs, *values):
+        s = self._series.setdefault(values, [0] * len(self.buckets) + [0.0, 0])
+        for i, le in enumerate(self.buckets):
+            if secs <= le:
+                s[i] += 1
+        s[-2] += secs
+        s[-1] += 1
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, s in sorted(self._series.items()):
+            labels = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, values))
+            sep = "," if labels else ""
+            for le, n in zip(self.buckets, s):
+                out.append(f'{self.name}_bucket{{{labels}{sep}le="{le}"}} {n}')
+            out.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {s[-1]}')
+            out.append(f"{self.name}_sum{{{labels}}} {round(s[-2], 6)}")
+            out.append(f"{self.name}_count{{{labels}}} {s[-1]}")
+        return out
+
+
+class Registry:
+    """Histograms fed by finished traces (and a few direct observations)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ttfa = Histogram("voice_ttfa_seconds", "Request received to first audio sent")
+        self.first_token = Histogram("voice_first_token_seconds", "Request received to first LLM token")
+        self.llm_first_byte = Histogram("voice_llm_first_byte_seconds",
+                                        "LLM request sent to response headers")
+        self.search = Histogram("voice_search_seconds", "Search started to result")
+        self.tts = Histogram("voice_tts_seconds", "TTS synthesis per chunk")
+        self.turn = Histogram("voice_turn_seconds", "Request received to done")
+        self.connect = Histogram("voice_upstream_connect_seconds",
+                                 "New upstream connection (TCP+TLS or websocket handshake)",
+                                 labels=("host",))
+        self._turns = {}
+        self._cancelled = {}   # (app, reason) -> turns
+
+    def observe(self, hist, secs, *values):
+        with self._lock:
+            hist.observe(secs, *values)
+
+    def observe_trace(self, trace):
+        ms = {name: trace.at(name) for name in ("first_audio", "first_token", "llm_start",
+                                                "upstream_headers", "done")}
+        with self._lock:
+            app = trace.app
+            self._turns[app] = self._turns.get(app, 0) + 1
+            reason = trace.attrs.get("cancelled")
+            if reason:
+                self._cancelled[(app, reason)] = self._cancelled.get((app, reason), 0) + 1
+            if ms["first_audio"] is not None:
+                self.ttfa.observe(ms["first_audio"] / 1000, app)
+            if ms["first_token"] is not None:
+                self.first_token.observe(ms["first_token"] / 1000, app)
+            if ms["llm_start"] is not None and ms["upstream_headers"] is not None:
+                self.llm_first_byte.observe(max(ms["upstream_headers"] - ms["llm_start"], 0) / 1000, app)
+            for dur in trace.spans("search"):
+                self.search.observe(dur / 1000, app)
+            for dur in trace.spans("tts"):
+                self.tts.observe(dur / 1000, app)
+            self.turn.observe(ms["done"] / 1000, app)
+
+    def render(self):
+        with self._lock:
+            out = ["# HELP voice_turns_total Finished turns", "# TYPE voice_turns_total counter"]
+            out += [f'voice_turns_total{{app="{app}"}} {n}' for app, n in sorted(self._turns.items())]
+            out += ["# HELP voice_turns_cancelled_total Turns stopped before the answer was done",
+                    "# TYPE voice_turns_cancelled_total counter"]
+            out += [f'voice_turns_cancelled_total{{app="{app}",reason="{reason}"}} {n}'
+                    for (app, reason), n in sorted(self._cancelled.items())]
+            for h in (self.ttfa, self.first_token, self.llm_first_byte, self.search,
+                      self.tts, self.turn, self.connect):
+                out += h.render()
+        return "\n".join(out) + "\n"
+
+
+registry = Registry()
+_recent = deque(maxlen=TRACE_KEEP)
+_log_lock = threading.Lock()
+
+
+def observe_connect(host, ms):
+    registry.observe(registry.connect, ms / 1000, host)
+
+
+def metrics_text():
+    """/metrics body"""
+    return registry.render()
+
+
+def _quantile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)] if values else None
+
+
+def recent(n=20):
+    """/traces body: the last n traces plus p50/p95 time to first audio over all kept ones"""
+    traces = list(_recent)
+    ttfa = [ev["at_ms"] for t in traces for ev in t["events"] if ev["name"] == "first_audio"]
+    return {"kept": len(traces), "p50_ttfa_ms": _quantile(ttfa, 0.5),
+            "p95_ttfa_ms": _quantile(ttfa, 0.95), "traces": traces[-n:][::-1]}
@@ -2,16 +2,38 @@
 """
 Grok Voice Chat - Auto VAD with Wave Visualization + Session Memory
 Open http://localhost:5555 in browser
+
+Two ways to serve the /ws bridge to the xAI realtime API:
+    python web_voice_chat.py                   Flask: a thread per browser socket
+                                               plus one reading the upstream
+    SERVE_MODE=asgi python web_voice_chat.py   asyncio gateway: a task pair per call
+                                               (uvicorn --factory web_voice_chat:create_asgi_app)
+
+Calls start on a pre-connected session from realtime_pool when one is warm
+for the caller's voice (REALTIME_POOL_SIZE, REALTIME_POOL_VOICES).
+The page sends its AudioContext rate with the voice; microphone audio at
+any other rate than AUDIO_RATE is resampled here (resample.py).
 """
 
 import os
 import json
 import base64
-from datetime import datetime
-from flask import Flask, render_template_string, request, jsonify
+import time
+import asyncio
+import select
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from flask import Flask, render_template_string, request, jsonify, Response
 from flask_sock import Sock
 from dotenv import load_dotenv
 import websocket
+from session_store import SessionStore
+from context_window import ContextWindow, llm_summarizer, estimate_tokens
+from turn_trace import Trace, METRICS_MIMETYPE, metrics_text, recent, observe_connect
+from realtime_pool import SessionPool
+from resample import make_resampler
 
 load_dotenv()
 
@@ -19,71 +41,71 @@ app = Flask(__name__)
 sock = Sock(app)
 
 XAI_API_KEY = os.getenv("XAI_API_KEY")
-GROK_WS_URL = "wss://api.x.ai/v1/realtime"
+GROK_WS_URL = os.getenv("GROK_WS_URL", "wss://api.x.ai/v1/realtime")
+# Chat completions endpoint, used to summarize older turns
+XAI_API_URL = os.getenv("XAI_API_URL", "https://api.x.ai/v1/chat/completions")
 SESSIONS_FILE = "chat_sessions.json"
-
-def load_sessions():
-    if os.path.exists(SESSIONS_FILE):
-        with open(SESSIONS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {"sessions": []}
-
-def save_sessions(data):
-    with open(SESSIONS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+# Indexed in memory, persisted to SQLite; imports SESSIONS_FILE on first run
+sessions = SessionStore(legacy_json=SESSIONS_FILE)
+
+BASE_INSTRUCTIONS = "You are a helpful voice assistant. Always respond in Russian (русский язык). Be concise and natural. Отвечай коротко и по делу."
+# Token-budgeted memory per session, for the sessions this process has seen lately
+windows = OrderedDict()
+windows_lock = threading.Lock()
+MAX_WINDOWS = 256
+summarize = llm_summarizer(XAI_API_URL, XAI_API_KEY,
+                           lambda msgs: {"model": "grok-3-mini-fast", "messages": msgs})
+# ASGI mode: session store calls run here, one at a time and in order, off the event loop
+store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sessions")
 
 def get_session_context(session_id):
-    data = load_sessions()
-    for session in data["sessions"]:
-        if session["id"] == session_id:
-            return session
-    return None
+    return sessions.get(session_id)
+
+def get_window(session_id):
+    """Recent messages within the token budget plus the session's summary"""
+    with windows_lock:
+        window = windows.get(session_id)
+        if window is not None:
+            windows.move_to_end(session_id)
+            return window
+        session = get_session_context(session_id) or {"messages": []}
+        until = session.get("memory_until") or ""
+        msgs = [{"role": "user" if m["role"] == "user" else "assistant", "content": m["text"],
+                 "timestamp": m.get("time")}
+                for m in session["messages"] if (m.get("time") or "") > until]
+        window = windows[session_id] = ContextWindow(
+            summarize, messages=msgs, summary=session.get("memory") or "",
+            on_fold=lambda memory, until: sessions.set_memory(session_id, memory, until))
+        if len(windows) > MAX_WINDOWS:
+            windows.popitem(last=False)
+        return window
 
 def create_new_session():
-    data = load_sessions()
-    session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-    new_session = {
-        "id": session_id,
-        "created": datetime.now().isoformat(),
-        "name": f"Chat {len(data['sessions']) + 1}",
-        "messages": [],
-        "summary": ""
-    }
-    data["sessions"].append(new_session)
-    save_sessions(data)
-    return new_session
+    return sessions.create()
 
 def add_message_to_session(session_id, role, text):
-    data = load_sessions()
-    for session in data["sessions"]:
-        if session["id"] == session_id:
-            session["messages"].append({
-                "role": role,
-                "text": text,
-                "time": datetime.now().isoformat()
-            })
-            if len(session["messages"]) > 50:
-                session["messages"] = session["messages"][-50:]
-            if len(session["messages"]) >= 3:
-                last_msgs = session["messages"][-5:]
-                session["summary"] = " | ".join([m["text"][:30] for m in last_msgs])
-            save_sessions(data)
-            return
+    # Window first: one rebuilt from the store after the save would already hold the message
+    window = get_window(session_id)
+    window.append("user" if role == "user" else "assistant", text)
+    sessions.add_message(session_id, role, text)
+    if role != "user":
+        window.update()
 
 def build_context_instructions(session_id):
-    session = get_session_context(session_id)
-    if not session or not session["messages"]:
-        return "You are a helpful voice assistant. Always respond in Russian (русский язык). Be concise and natural. Отвечай коротко и по делу."
+    summary, recent = get_window(session_id).window(estimate_tokens(BASE_INSTRUCTIONS) + 60)
+    if not summary and not recent:
+        return BASE_INSTRUCTIONS
 
     history = []
-    for msg in session["messages"][-10:]:
+    for msg in recent:
         role = "User" if msg["role"] == "user" else "You"
-        history.append(f"{role}: {msg['text']}")
+        history.append(f"{role}: {msg['content']}")
 
     history_text = "\n".join(history)
+    memory = f"\nSummary of the earlier conversation:\n{summary}\n" if summary else ""
 
     return f"""You are a helpful voice assistant. Always respond in Russian (русский язык). Be concise and natural.
-
+{memory}
 IMPORTANT: This is a continuing conversation. Here is the recent history:
 {history_text}
 
@@ -419,17 +441,6 @@ HTML_TEMPLATE = """
             animationId = requestAnimationFrame(drawWave);
         }
 
-        function arrayBufferToBase64(buffer) {
-            let binary = '';
-            const bytes = new Uint8Array(buffer);
-            const chunkSize = 8192;
-            for (let i = 0; i < bytes.length; i += chunkSize) {
-                const chunk = bytes.subarray(i, i + chunkSize);
-                binary += String.fromCharCode.apply(null, chunk);
-            }
-            return btoa(binary);
-        }
-
         // Initialize audio (must be triggered by user interaction on mobile)
         async function initAudio() {
             log('initAudio() called', 'info');
@@ -487,8 +498,8 @@ HTML_TEMPLATE = """
                         int16[i] = Math.max(-32768, Math.min(32767, float32[i] * 32768));
                     }
 
-                    const base64 = arrayBufferToBase64(int16.buffer);
-                    ws.send(JSON.stringify({type: 'audio', audio: base64}));
+                    // Raw PCM in a binary frame; the server base64-encodes it once for Grok
+                    ws.send(int16.buffer);
                     chunkCount++;
                     if (chunkCount % 25 === 0) {
                         log('Audio chunks sent: ' + chunkCount, 'info');
@@ -519,11 +530,16 @@ HTML_TEMPLATE = """
         }
 
         // Session management
-        async function loadSessions() {
-            const resp = await fetch('/api/sessions');
+        async function loadSessions(offset = 0, limit = 20) {
+            const resp = await fetch('/api/sessions?offset=' + offset + '&limit=' + limit);
             return await resp.json();
         }
 
+        async function loadSession(sessionId) {
+            const resp = await fetch('/api/sessions/' + encodeURIComponent(sessionId));
+            return resp.ok ? await resp.json() : null;
+        }
+
         async function startNewChat() {
             log('Starting new chat...', 'info');
             const resp = await fetch('/api/sessions/new', {method: 'POST'});
@@ -536,8 +552,7 @@ HTML_TEMPLATE = """
 
         async function continueSession(sessionId) {
             currentSessionId = sessionId;
-            const sessions = await loadSessions();
-            const session = sessions.sessions.find(s => s.id === sessionId);
+            const session = await loadSession(sessionId);
             if (session) {
                 sessionInfoEl.textContent = 'Session: ' + session.name;
                 transcriptEl.innerHTML = '';
@@ -562,7 +577,11 @@ HTML_TEMPLATE = """
         }
 
         function connect() {
-            const sessionParam = currentSessionId ? '?session=' + currentSessionId : '';
+            // The voice goes in the URL so the server can claim a warm session for it,
+            // the capture rate so it can resample the microphone to 24 kHz
+            const sessionParam = '?voice=' + encodeURIComponent(voiceSelect.value) +
+                '&rate=' + (audioContext ? audioContext.sampleRate : 24000) +
+                (currentSessionId ? '&session=' + currentSessionId : '');
             // Auto-detect protocol: wss:// for HTTPS, ws:// for HTTP
             const wsProtocol = location.protocol === 'https:' ? 'wss://' : 'ws://';
             const wsUrl = wsProtocol + location.host + '/ws' + sessionParam;
@@ -573,7 +592,6 @@ HTML_TEMPLATE = """
             ws.onopen = () => {
                 log('WebSocket connected!', 'success');
                 // Don't reset reconnectAttempts here - wait for session_id
-                ws.send(JSON.stringify({type: 'set_voice', voice: voiceSelect.value}));
                 statusEl.textContent = 'Connecting to Grok...';
                 statusEl.className = 'status connecting';
             };
@@ -710,68 +728,332 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# PCM rate of the realtime session, both ways
+AUDIO_RATE = 24000
+
+
+def input_rate(value):
+    """Microphone rate from the /ws URL; pages that don't send one capture at AUDIO_RATE"""
+    try:
+        rate = int(value or AUDIO_RATE)
+    except ValueError:
+        rate = 0
+    if not 8000 <= rate <= 192000:
+        print(f"[AUDIO] Ignoring input rate {value!r}, assuming {AUDIO_RATE}", flush=True)
+        return AUDIO_RATE
+    return rate
+
+
+# Session settings a call can change in place, with a session.update on the live connection
+SESSION_SETTINGS = ("voice", "instructions", "turn_detection")
+# Voices the page offers
+VOICES = ("Ara", "Rex", "Sal", "Eve", "Leo")
+# VAD fields the page may tune, with their allowed ranges
+TURN_DETECTION_LIMITS = {"threshold": (0.0, 1.0), "prefix_padding_ms": (0, 2000),
+                         "silence_duration_ms": (0, 5000)}
+
+
+def valid_turn_detection(value):
+    """A server_vad dict with only known, in-range numeric fields -> it, else None"""
+    if not isinstance(value, dict) or value.get("type") != "server_vad":
+        return None
+    for k, v in value.items():
+        if k == "type":
+            continue
+        limits = TURN_DETECTION_LIMITS.get(k)
+        if (limits is None or isinstance(v, bool) or not isinstance(v, (int, float))
+                or not limits[0] <= v <= limits[1]):
+            return None
+    return value
+
+
+def session_changes(data, session):
+    """Browser set_voice / update_session message -> the settings that differ.
+    The page may change the voice and the VAD settings; the instructions are
+    always built here, from the chat session's context."""
+    if data['type'] == 'set_voice':
+        data = {"voice": data.get('voice')}
+    changes = {}
+    if "voice" in data:
+        if data["voice"] in VOICES:
+            changes["voice"] = data["voice"]
+        else:
+            print(f"[WS] Ignoring unknown voice {data['voice']!r}", flush=True)
+    if "turn_detection" in data:
+        turn_detection = valid_turn_detection(data["turn_detection"])
+        if turn_detection is not None:
+            changes["turn_detection"] = turn_detection
+        else:
+            print(f"[WS] Ignoring invalid turn_detection {data['turn_detection']!r}", flush=True)
+    if "instructions" in data:
+        print("[WS] Ignoring instructions from the page", flush=True)
+    return {k: v for k, v in changes.items() if v != getattr(session, k)}
+
+
+def audio_append(pcm=None, audio_b64=None):
+    """input_audio_buffer.append for raw PCM (or base64 from old pages), built
+    without a JSON pass over the audio: base64 needs no escaping"""
+    if audio_b64 is None:
+        audio_b64 = base64.b64encode(pcm).decode("ascii")
+    return '{"type": "input_audio_buffer.append", "audio": "' + audio_b64 + '"}'
+
+
 class GrokSession:
     def __init__(self, voice="Ara", instructions=None):
         self.voice = voice
         self.ws = None
-        self.instructions = instructions or "You are a helpful voice assistant. Always respond in Russian (русский язык). Be concise and natural. Отвечай коротко и по делу."
+        self.instructions = instructions or BASE_INSTRUCTIONS
+        self.turn_detection = {"type": "server_vad"}
 
-    def connect(self):
-        self.ws = websocket.create_connection(
-            GROK_WS_URL,
-            header={
-                "Authorization": f"Bearer {XAI_API_KEY}",
-                "Content-Type": "application/json"
-            }
-        )
-
-        config = {
+    def config(self):
+        return {
             "type": "session.update",
             "session": {
                 "instructions": self.instructions,
                 "voice": self.voice,
-                "turn_detection": {"type": "server_vad"},
+                "turn_detection": self.turn_detection,
                 "input_audio_transcription": {"model": "whisper-1"},
                 "audio": {
-                    "input": {"format": {"type": "audio/pcm", "rate": 24000}},
-                    "output": {"format": {"type": "audio/pcm", "rate": 24000}}
+                    "input": {"format": {"type": "audio/pcm", "rate": AUDIO_RATE}},
+                    "output": {"format": {"type": "audio/pcm", "rate": AUDIO_RATE}}
                 }
             }
         }
-        self.ws.send(json.dumps(config))
+
+    def connect(self):
+        t = time.perf_counter()
+        self.ws = websocket.create_connection(
+            GROK_WS_URL,
+            header={
+                "Authorization": f"Bearer {XAI_API_KEY}",
+                "Content-Type": "application/json"
+            }
+        )
+        self.ws.send(json.dumps(self.config()))
 
         while True:
             data = json.loads(self.ws.recv())
             if data.get("type") == "session.updated":
                 break
+        observe_connect(urlparse(GROK_WS_URL).hostname, (time.perf_counter() - t) * 1000)
 
         print(f"Grok session ready with voice: {self.voice}")
 
-    def send_audio(self, audio_b64):
+    def send_audio(self, pcm=None, audio_b64=None):
         if self.ws:
-            self.ws.send(json.dumps({
-                "type": "input_audio_buffer.append",
-                "audio": audio_b64
-            }))
+            self.ws.send(audio_append(pcm, audio_b64))
 
     def recv(self):
         if self.ws:
             return json.loads(self.ws.recv())
         return None
 
+    def update(self, **changes):
+        """Change SESSION_SETTINGS on the live connection; session.updated is not
+        waited for, the API applies it before any audio sent after it"""
+        for k, v in changes.items():
+            setattr(self, k, v)
+        self.ws.send(json.dumps({"type": "session.update", "session": changes}))
+
+    def ping(self, timeout=1):
+        """Health check while idle in the pool: sends a ping, answers the
+        server's and drops anything else pending -> False if the socket is gone.
+        A frame that doesn't arrive whole within timeout counts as gone, so a
+        stalled server can't hang the pool's upkeep thread"""
+        blocking = self.ws.gettimeout()
+        try:
+            self.ws.settimeout(timeout)
+            self.ws.ping()
+            while select.select([self.ws.sock], [], [], 0)[0]:
+                opcode, _ = self.ws.recv_data(control_frame=True)
+                if opcode == websocket.ABNF.OPCODE_CLOSE:
+                    return False
+            return True
+        except Exception:
+            return False
+        finally:
+            self.ws.settimeout(blocking)
+
     def close(self):
         if self.ws:
             self.ws.close()
 
 
+class AsyncGrokSession(GrokSession):
+    """GrokSession over an asyncio websocket, for the ASGI gateway"""
+
+    async def connect(self):
+        from websockets.asyncio.client import connect
+        t = time.perf_counter()
+        # No permessage-deflate: base64 PCM barely compresses and each
+        # compressor keeps its own zlib buffers per connection
+        self.ws = await connect(
+            GROK_WS_URL,
+            additional_headers={
+                "Authorization": f"Bearer {XAI_API_KEY}",
+                "Content-Type": "application/json"
+            },
+            compression=None
+        )
+        await self.ws.send(json.dumps(self.config()))
+
+        while True:
+            data = json.loads(await self.ws.recv())
+            if data.get("type") == "session.updated":
+                break
+        observe_connect(urlparse(GROK_WS_URL).hostname, (time.perf_counter() - t) * 1000)
+
+        print(f"Grok session ready with voice: {self.voice}")
+
+    async def send_audio(self, pcm=None, audio_b64=None):
+        if self.ws:
+            await self.ws.send(audio_append(pcm, audio_b64))
+
+    async def recv(self):
+        if self.ws:
+            return json.loads(await self.ws.recv())
+        return None
+
+    async def update(self, **changes):
+        for k, v in changes.items():
+            setattr(self, k, v)
+        await self.ws.send(json.dumps({"type": "session.update", "session": changes}))
+
+    async def ping(self, timeout=5):
+        try:
+            await asyncio.wait_for(await self.ws.ping(), timeout)
+            return True
+        except Exception:
+            return False
+
+    async def close(self):
+        if self.ws:
+            await self.ws.close()
+
+
+pool = SessionPool(GrokSession)
+
+
+def open_session(voice, instructions):
+    """A warm session from the pool with the call's instructions, else a new one"""
+    pool.start()
+    session = pool.claim(voice)
+    if session:
+        try:
+            session.update(instructions=instructions)
+            return session
+        except Exception as e:
+            print(f"[POOL] Warm session was dead, connecting: {e}", flush=True)
+            session.close()
+    session = GrokSession(voice, instructions)
+    session.connect()
+    return session
+
+
+class RealtimeCall:
+    """One call's state in either serving mode: turns realtime API events
+    into messages for the browser and saves the transcripts"""
+
+    def __init__(self, chat_session_id, save=add_message_to_session):
+        self.chat_session_id = chat_session_id
+        self.save = save
+        self.response = []
+        # One trace per turn, from the end of the user's speech to response.done
+        self.trace = None
+
+    def handle(self, resp):
+        """-> messages for the browser"""
+        msg_type = resp.get("type")
+        out = []
+
+        if msg_type == "input_audio_buffer.speech_started":
+            out.append({"type": "speech_started"})
+            self.response = []
+            if self.trace:
+                self.trace.finish(interrupted=True)
+                self.trace = None
+
+        elif msg_type == "input_audio_buffer.speech_stopped":
+            self.trace = Trace("realtime", session=self.chat_session_id)
+
+        elif msg_type == "response.created":
+            self.trace = self.trace or Trace("realtime", session=self.chat_session_id)
+            self.trace.mark("llm_start")
+
+        elif msg_type == "conversation.item.input_audio_transcription.completed":
+            if self.trace:
+                self.trace.mark("transcript")
+            user_text = resp.get("transcript", "")
+            if user_text:
+                out.append({"type": "user_transcript", "text": user_text})
+                self.save(self.chat_session_id, "user", user_text)
+
+        elif msg_type == "response.output_audio_transcript.delta":
+            delta = resp.get("delta", "")
+            if delta:
+                self.response.append(delta)
+                if self.trace:
+                    self.trace.first("first_token")
+
+        elif msg_type == "response.output_audio.delta":
+            out.append({"type": "speaking"})
+            audio = resp.get("delta", "")
+            if audio:
+                out.append({"type": "audio", "audio": audio})
+                if self.trace:
+                    self.trace.first("first_audio")
+
+        elif msg_type == "response.done":
+            full_response = "".join(self.response)
+            if full_response:
+                out.append({"type": "grok_transcript", "text": full_response})
+                self.save(self.chat_session_id, "grok", full_response)
+            self.response = []
+            out.append({"type": "done"})
+            if self.trace:
+                self.trace.finish()
+                self.trace = None
+
+        elif msg_type == "error":
+            error_msg = resp.get("error", {}).get("message", "Unknown error")
+            out.append({"type": "error", "message": error_msg})
+
+        return out
+
+
 @app.route('/')
 def index():
     return render_template_string(HTML_TEMPLATE)
 
 
+@app.route('/pool-stats')
+def pool_stats():
+    return jsonify(pool.stats())
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics_text(), content_type=METRICS_MIMETYPE)
+
+
+@app.route('/traces')
+def traces():
+    return jsonify(recent(request.args.get('n', 20, type=int)))
+
+
 @app.route('/api/sessions')
 def get_sessions():
-    return jsonify(load_sessions())
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    return jsonify(sessions.list(offset, limit))
+
+
+@app.route('/api/sessions/<session_id>')
+def get_session(session_id):
+    session = get_session_context(session_id)
+    if not session:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(session)
 
 
 @app.route('/api/sessions/new', methods=['POST'])
@@ -783,8 +1065,9 @@ def new_session():
 @sock.route('/ws')
 def websocket_handler(ws):
     print(f"[WS] New WebSocket connection from {request.remote_addr}", flush=True)
-    session = None
-    voice = "Ara"
+    session = recv_thread = None
+    voice = request.args.get('voice') or "Ara"
+    resampler = make_resampler(input_rate(request.args.get('rate')), AUDIO_RATE)
     chat_session_id = request.args.get('session')
     print(f"[WS] Session ID: {chat_session_id}", flush=True)
 
@@ -796,9 +1079,8 @@ def websocket_handler(ws):
     try:
         instructions = build_context_instructions(chat_session_id)
         print(f"[WS] Connecting to Grok...", flush=True)
-        session = GrokSession(voice, instructions)
         try:
-            session.connect()
+            session = open_session(voice, instructions)
         except Exception as conn_error:
             error_str = str(conn_error)
             if "429" in error_str:
@@ -818,77 +1100,45 @@ def websocket_handler(ws):
             "name": chat_data["name"] if chat_data else "New Chat"
         }))
 
-        import threading
-        current_grok_response = []
+        call = RealtimeCall(chat_session_id)
 
-        def receive_from_grok():
-            nonlocal current_grok_response
+        def receive_from_grok(session):
             try:
                 while True:
                     resp = session.recv()
                     if not resp:
                         break
-
-                    msg_type = resp.get("type")
-
-                    if msg_type == "input_audio_buffer.speech_started":
-                        ws.send(json.dumps({"type": "speech_started"}))
-                        current_grok_response = []
-
-                    elif msg_type == "conversation.item.input_audio_transcription.completed":
-                        user_text = resp.get("transcript", "")
-                        if user_text:
-                            ws.send(json.dumps({"type": "user_transcript", "text": user_text}))
-                            add_message_to_session(chat_session_id, "user", user_text)
-
-                    elif msg_type == "response.output_audio_transcript.delta":
-                        delta = resp.get("delta", "")
-                        if delta:
-                            current_grok_response.append(delta)
-
-                    elif msg_type == "response.output_audio.delta":
-                        ws.send(json.dumps({"type": "speaking"}))
-                        audio = resp.get("delta", "")
-                        if audio:
-                            ws.send(json.dumps({"type": "audio", "audio": audio}))
-
-                    elif msg_type == "response.done":
-                        full_response = "".join(current_grok_response)
-                        if full_response:
-                            ws.send(json.dumps({"type": "grok_transcript", "text": full_response}))
-                            add_message_to_session(chat_session_id, "grok", full_response)
-                        current_grok_response = []
-                        ws.send(json.dumps({"type": "done"}))
-
-                    elif msg_type == "error":
-                        error_msg = resp.get("error", {}).get("message", "Unknown error")
-                        ws.send(json.dumps({"type": "error", "message": error_msg}))
+                    for out in call.handle(resp):
+                        ws.send(json.dumps(out))
 
             except Exception as e:
                 print(f"Receive error: {e}")
 
-        recv_thread = threading.Thread(target=receive_from_grok, daemon=True)
+        recv_thread = threading.Thread(target=receive_from_grok, args=(session,), daemon=True)
         recv_thread.start()
 
         while True:
             message = ws.receive()
-            if not message:
+            if message is None:   # b"" is an empty audio frame, not the end
                 break
 
+            # Microphone audio: binary frames of 16-bit PCM
+            if isinstance(message, bytes):
+                pcm = resampler.process(message) if resampler else message
+                if pcm:
+                    session.send_audio(pcm)
+                continue
+
             data = json.loads(message)
 
-            if data['type'] == 'set_voice':
-                voice = data['voice']
-                if session:
-                    session.close()
-                instructions = build_context_instructions(chat_session_id)
-                session = GrokSession(voice, instructions)
-                session.connect()
-                recv_thread = threading.Thread(target=receive_from_grok, daemon=True)
-                recv_thread.start()
+            if data['type'] in ('set_voice', 'update_session'):
+                changes = session_changes(data, session)
+                if changes:
+                    session.update(**changes)
+                    print(f"[WS] Session updated in place: {', '.join(changes)}", flush=True)
 
             elif data['type'] == 'audio':
-                session.send_audio(data['audio'])
+                session.send_audio(audio_b64=data['audio'])
 
     except Exception as e:
         import traceback
@@ -898,6 +1148,170 @@ def websocket_handler(ws):
         print(f"[WS] Connection closing", flush=True)
         if session:
             session.close()
+        if recv_thread:
+            recv_thread.join(timeout=5)
+
+
+def create_asgi_app():
+    """ASGI mode: uvicorn --factory web_voice_chat:create_asgi_app (or SERVE_MODE=asgi)"""
+    from starlette.applications import Starlette
+    from starlette.responses import HTMLResponse, JSONResponse, Response as ASGIResponse
+    from starlette.routing import Route, WebSocketRoute
+    from starlette.websockets import WebSocketDisconnect
+    from contextlib import asynccontextmanager
+
+    apool = SessionPool(AsyncGrokSession)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        upkeep = apool.astart()
+        yield
+        if upkeep:
+            upkeep.cancel()
+        await apool.aclose()
+
+    def store(fn, *args):
+        return asyncio.get_running_loop().run_in_executor(store_executor, fn, *args)
+
+    async def index(request):
+        return HTMLResponse(HTML_TEMPLATE)
+
+    async def pool_stats(request):
+        return JSONResponse(apool.stats())
+
+    async def metrics(request):
+        return ASGIResponse(metrics_text(), media_type=METRICS_MIMETYPE)
+
+    async def traces(request):
+        return JSONResponse(recent(int(request.query_params.get("n", 20))))
+
+    async def list_sessions(request):
+        offset = max(int(request.query_params.get("offset", 0)), 0)
+        limit = min(max(int(request.query_params.get("limit", 20)), 1), 100)
+        return JSONResponse(await store(sessions.list, offset, limit))
+
+    async def session_detail(request):
+        session = await store(get_session_context, request.path_params["session_id"])
+        if not session:
+            return JSONResponse({"error": "not found"}, status_code=404)
+        return JSONResponse(session)
+
+    async def new_session(request):
+        return JSONResponse(await store(create_new_session))
+
+    async def realtime_gateway(ws):
+        """/ws: a task pumps upstream events to the browser while this one
+        forwards the browser's audio upstream"""
+        await ws.accept()
+        print(f"[WS] New WebSocket connection from {ws.client.host if ws.client else '?'}", flush=True)
+        session = pump = None
+        voice = ws.query_params.get('voice') or "Ara"
+        resampler = make_resampler(input_rate(ws.query_params.get('rate')), AUDIO_RATE)
+        chat_session_id = ws.query_params.get('session')
+        print(f"[WS] Session ID: {chat_session_id}", flush=True)
+
+        if not chat_session_id:
+            chat_session_id = (await store(create_new_session))["id"]
+            print(f"[WS] Created new session: {chat_session_id}", flush=True)
+
+        # Saves go through store_executor too, so they land in order
+        call = RealtimeCall(chat_session_id,
+                            save=lambda *args: store_executor.submit(add_message_to_session, *args))
+
+        async def receive_from_grok(session):
+            try:
+                while True:
+                    resp = await session.recv()
+                    if not resp:
+                        break
+                    for out in call.handle(resp):
+                        await ws.send_text(json.dumps(out))
+            except Exception as e:
+                print(f"Receive error: {e}")
+
+        async def open_session():
+            instructions = await store(build_context_instructions, chat_session_id)
+            session = apool.claim(voice)
+            if session:
+                try:
+                    await session.update(instructions=instructions)
+                except Exception as e:
+                    print(f"[POOL] Warm session was dead, connecting: {e}", flush=True)
+                    await session.close()
+                    session = None
+            if not session:
+                session = AsyncGrokSession(voice, instructions)
+                await session.connect()
+            return session, asyncio.create_task(receive_from_grok(session))
+
+        try:
+            print(f"[WS] Connecting to Grok...", flush=True)
+            try:
+                session, pump = await open_session()
+            except Exception as conn_error:
+                if "429" in str(conn_error):
+                    print(f"[WS] Rate limit hit! Sending error to client.", flush=True)
+                    await ws.send_text(json.dumps({
+                        "type": "error",
+                        "message": "Rate limit exceeded. Please wait 2-3 minutes and try again."
+                    }))
+                    return
+                raise
+            print(f"[WS] Connected to Grok successfully!", flush=True)
+
+            chat_data = await store(get_session_context, chat_session_id)
+            await ws.send_text(json.dumps({
+                "type": "session_id",
+                "id": chat_session_id,
+                "name": chat_data["name"] if chat_data else "New Chat"
+            }))
+
+            while True:
+                message = await ws.receive()
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
+                if message.get("bytes") is not None:
+                    pcm = message["bytes"]
+                    if resampler:
+                        pcm = resampler.process(pcm)
+                    if pcm:   # an empty frame, or too short for a resampled sample
+                        await session.send_audio(pcm)
+                    continue
+                data = json.loads(message["text"])
+
+                if data['type'] in ('set_voice', 'update_session'):
+                    changes = session_changes(data, session)
+                    if changes:
+                        await session.update(**changes)
+                        print(f"[WS] Session updated in place: {', '.join(changes)}", flush=True)
+
+                elif data['type'] == 'audio':
+                    await session.send_audio(audio_b64=data['audio'])
+
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            import traceback
+            print(f"[WS] WebSocket error: {e}", flush=True)
+            print(f"[WS] Traceback: {traceback.format_exc()}", flush=True)
+        finally:
+            print(f"[WS] Connection closing", flush=True)
+            if pump:
+                pump.cancel()
+                await asyncio.gather(pump, return_exceptions=True)
+            if session:
+                await session.close()
+
+    return Starlette(routes=[
+        Route("/", index),
+        Route("/pool-stats", pool_stats),
+        Route("/metrics", metrics),
+        Route("/traces", traces),
+        Route("/api/sessions", list_sessions),
+        Route("/api/sessions/new", new_session, methods=["POST"]),
+        Route("/api/sessions/{session_id}", session_detail),
+        WebSocketRoute("/ws", realtime_gateway),
+    ], lifespan=lifespan)
 
 
 if __name__ == '__main__':
@@ -905,9 +1319,16 @@ if __name__ == '__main__':
     print("GROK VOICE CHAT - WITH DEBUG")
     print("="*50)
     print()
-    print("Open: http://localhost:5555")
+    port = int(os.getenv("PORT", 5555))
+    print(f"Open: http://localhost:{port}")
     print()
     print("Press Ctrl+C to stop")
     print("="*50)
 
-    app.run(host='0.0.0.0', port=5555, debug=False, threaded=True)
+    if os.getenv("SERVE_MODE") == "asgi":
+        import uvicorn
+        # Same wire format as the Flask bridge: no per-message compression
+        uvicorn.run(create_asgi_app(), host='0.0.0.0', port=port, ws_per_message_deflate=False)
+    else:
+        pool.start()
+        app.run(host='0.0.0.0', port=port, debug=False, threaded=True)